@@ -22,7 +22,9 @@ import subprocess
 import time
 import signal
 import shutil
-import json
+import sqlite3
+import selectors
+import importlib
 
 VERSION = '3.0.18'
 
@@ -30,61 +32,152 @@ sys.path.append(sys.path[0] + '/..')
 
 import clam.common.data #pylint: disable=wrong-import-position
 import clam.common.status
+import clam.common.registry
+import clam.common.scheduler
+import clam.common.manifest
+import clam.common.callback
+from clam.common.monitor import ResourceMonitor
+from clam.common.index import ProjectIndex
 from clam.common.util import computediskusage
 
 
-def mem(pid, size="rss"):
-    """memory sizes: rss, rsz, vsz."""
-    return int(os.popen('ps -p %d -o %s | tail -1' % (pid, size)).read())
-
 def total_seconds(delta):
     return delta.days * 86400 + delta.seconds + (delta.microseconds / 1000000.0)
 
-def updateindex(projectpath):
-    """Update the index"""
-    totalsize = 0.0
-    if os.path.exists(os.path.join(projectpath,'..','.index')):
-        with open(os.path.join(projectpath,'..','.index'),'r',encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-            except ValueError:
-                #delete the entire index
-                os.unlink(os.path.join(projectpath,'..','.index'))
-                return False
-    else:
-        data = {"projects": [], 'totalsize': 0.0}
+def updateindex(projectpath, reconcileinterval=0):
+    """Update the index. The disk usage of the project is recomputed from scratch if it was last done more than reconcileinterval seconds ago (0 = never), to correct any drift in the incrementally tracked usage"""
     if not os.path.isdir(projectpath):
         return False
     d = datetime.datetime.fromtimestamp(os.stat(projectpath)[8])
     project = os.path.basename(projectpath.rstrip('/'))
-    projectsize, filecount = computediskusage(projectpath)
-    with open(os.path.join(projectpath,'.du'),'w') as f:
-        f.write(str(projectsize) + "\n")
-        f.write(str(filecount))
-    index = None
-    for i, projectdata in enumerate(data['projects']):
-        if projectdata[0] == project:
-            index = i
-        else:
-            totalsize += projectdata[2]
-    projectdata = ( project , d.strftime("%Y-%m-%d %H:%M:%S"), round(projectsize,2), clam.common.status.DONE )
-    changed = True
-    if index is None:
-        data['projects'].append(  projectdata   )
-        data["totalsize"] = totalsize + projectsize
-    elif data["projects"][index] != projectdata:
-        data["projects"][index] = projectdata
-        data["totalsize"] = totalsize + projectsize
+    index = ProjectIndex(os.path.dirname(os.path.abspath(projectpath)))
+    reconciled = index.reconciled(project) if reconcileinterval > 0 else None
+    if reconciled is not None and time.time() - reconciled > reconcileinterval:
+        projectsize, _ = computediskusage(projectpath)
+        index.update(project, date=d.strftime("%Y-%m-%d %H:%M:%S"), size=projectsize, reconciled=time.time(), status=clam.common.status.DONE)
     else:
-        changed = False
-        if totalsize != data['totalsize']:
-            data["totalsize"] = totalsize
-            changed = True
-    if changed:
-        with open(os.path.join(projectpath,'..','.index'),'w',encoding='utf-8') as f:
-            json.dump(data,f, ensure_ascii=False)
+        #the output directory is emptied before a project is started, so the output produced is all the disk usage we need to add
+        outputsize, _ = computediskusage(os.path.join(projectpath, 'output'))
+        index.update(project, date=d.strftime("%Y-%m-%d %H:%M:%S"), grow=outputsize, status=clam.common.status.DONE)
     return True
 
+def register(registry, projectdir, **kwargs):
+    """Update the state of the project in the registry, failures are not fatal as the marker files remain available for recovery"""
+    if registry is None:
+        return
+    registry, user, project = registry
+    try:
+        registry.set(user, project, **kwargs)
+    except sqlite3.Error as e:
+        print("[CLAM Dispatcher] Unable to update project registry for " + projectdir + ": " + str(e), file=sys.stderr)
+
+def openregistry(projectdir, settings=None):
+    """Returns a (registry, user, project) tuple for the project, or None if the registry is disabled. Without settings (they could not be loaded), an existing registry is used"""
+    if settings is not None and not settings.PROJECTREGISTRY:
+        return None
+    registry = clam.common.registry.fromprojectpath(projectdir)
+    if settings is None and not os.path.exists(registry[0].filename):
+        return None
+    return registry
+
+def finish(projectdir, statuscode, registry):
+    """Marks the project as done and starts the next queued project(s) in the slot that was freed. This is done on every exit once the project directory is known, failures included, so the queue never stalls"""
+    with open(projectdir + '.done','w') as f:
+        f.write(str(statuscode))
+    if os.path.exists(projectdir + '.pid'): os.unlink(projectdir + '.pid')
+    register(registry, projectdir, status=clam.common.status.DONE, pid=0, exitcode=statuscode)
+    if registry is not None:
+        try:
+            clam.common.scheduler.Scheduler.load(registry[0]).schedule()
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print("[CLAM Dispatcher] Unable to schedule queued projects: " + str(e), file=sys.stderr)
+
+def postcallback(projectdir, statuscode, settings=None):
+    """Posts the final state of the project to its callback URL, if one was registered. Done on every exit once the project directory is known, failures included. Without settings (they could not be loaded), the output files are not described and the callback is not signed"""
+    if not os.path.exists(projectdir + clam.common.callback.CALLBACKFILE):
+        return
+    #this is done last as it may take a while if the receiver is unavailable
+    print("[CLAM Dispatcher] Posting callback", file=sys.stderr)
+    try:
+        clam.common.callback.notify(projectdir, statuscode, getattr(settings, 'PROFILES', None), getattr(settings, 'CALLBACKRETRIES', 5), getattr(settings, 'CALLBACKTIMEOUT', 10), getattr(settings, 'CALLBACKSECRET', None), log=lambda msg: print("[CLAM Dispatcher] " + msg, file=sys.stderr))
+    except Exception as e: #pylint: disable=broad-except
+        print("[CLAM Dispatcher] Unable to post callback: " + str(e), file=sys.stderr)
+
+def abortcheckinterval(d):
+    """Interval (in seconds) at which the abort file is checked, more frequently at the beginning"""
+    return min(10, max(1, d * 0.5))
+
+def watchprocess(pid):
+    """Returns a (fd, kind) tuple, the file descriptor becomes readable when the process exits. This is a pidfd if the platform supports it (kind 'exit'), otherwise the read end of a pipe that is written to on SIGCHLD (kind 'sigchld')"""
+    try:
+        return os.pidfd_open(pid), 'exit'
+    except (AttributeError, OSError):
+        pass
+    r, w = os.pipe()
+    os.set_blocking(r, False)
+    os.set_blocking(w, False)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.set_wakeup_fd(w)
+    return r, 'sigchld'
+
+def opencontrol(projectdir):
+    """Creates and opens the control pipe through which the webservice sends requests (such as abort) to the dispatcher. Returns None if no pipe could be created, in which case we rely on the abort file only"""
+    controlfile = projectdir + '.control'
+    try:
+        if os.path.exists(controlfile):
+            os.unlink(controlfile)
+        os.mkfifo(controlfile)
+        os.chmod(controlfile, 0o666)
+        #we open it for writing as well, so the pipe never signals end-of-file when a writer disconnects
+        return os.open(controlfile, os.O_RDWR | os.O_NONBLOCK)
+    except OSError as e:
+        print("[CLAM Dispatcher] Unable to create control pipe, falling back to polling: " + str(e), file=sys.stderr)
+        return None
+
+def wait(selector, timeout):
+    """Sleep until an event occurs or the timeout expires, returns the events that occurred"""
+    events = []
+    for key, _ in selector.select(timeout):
+        if key.data == 'sigchld':
+            #drain the wakeup pipe
+            try:
+                while os.read(key.fd, 512):
+                    pass
+            except (BlockingIOError, InterruptedError):
+                pass
+            events.append('exit')
+        else:
+            events.append(key.data)
+    return events
+
+def signaltree(monitor, signum):
+    """Send a signal to the process and all of its descendants"""
+    for pid in monitor.processes():
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+def terminate(pid, selector, monitor, grace=30):
+    """Terminate the process tree, kill it if it does not exit within the grace period (in seconds). Returns the resource usage of the process (or None)"""
+    signaltree(monitor, signal.SIGTERM)
+    deadline = time.time() + grace
+    while True:
+        try:
+            returnedpid, _, rusage = os.wait4(pid, os.WNOHANG)
+            if returnedpid != 0:
+                return rusage
+        except ChildProcessError:
+            return None
+        if time.time() >= deadline:
+            print("[CLAM Dispatcher] Process did not terminate within " + str(grace) + " seconds, killing it", file=sys.stderr)
+            try:
+                signaltree(monitor, signal.SIGKILL)
+                return os.wait4(pid, 0)[2]
+            except (ProcessLookupError, ChildProcessError):
+                return None
+        wait(selector, deadline - time.time())
+
 def main():
     if len(sys.argv) < 4:
         print("[CLAM Dispatcher] ERROR: Invalid syntax, use clamdispatcher.py [pythonpath] settingsmodule projectdir cmd arg1 arg2 ... got: " + " ".join(sys.argv[1:]), file=sys.stderr)
@@ -129,10 +222,8 @@ def main():
     if not cmd:
         print("[CLAM Dispatcher] FATAL ERROR: No command specified!", file=sys.stderr)
         if projectdir:
-            f = open(projectdir + '.done','w')
-            f.write(str(1))
-            f.close()
-            if os.path.exists(projectdir + '.pid'): os.unlink(projectdir + '.pid')
+            finish(projectdir, 1, openregistry(projectdir))
+            postcallback(projectdir, 1)
         return 1
     elif projectdir and not os.path.isdir(projectdir):
         print("[CLAM Dispatcher] FATAL ERROR: Project directory "+ projectdir + " does not exist", file=sys.stderr)
@@ -140,20 +231,20 @@ def main():
 
     try:
         #exec("import " + settingsmodule + " as settings")
-        settings = __import__(settingsmodule , globals(), locals(),0)
+        settings = importlib.import_module(settingsmodule) #__import__ would return the top-level package for dotted module names
         try:
             if settings.CUSTOM_FORMATS:
                 clam.common.data.CUSTOM_FORMATS = settings.CUSTOM_FORMATS
                 print("[CLAM Dispatcher] Dependency injection for custom formats succeeded", file=sys.stderr)
         except AttributeError:
             pass
-    except ImportError as e:
+    except Exception as e: #pylint: disable=broad-except
+        #not only ImportError, a configuration may raise anything whilst being loaded
         print("[CLAM Dispatcher] FATAL ERROR: Unable to import settings module, settingsmodule is " + settingsmodule + ", error: " + str(e), file=sys.stderr)
         print("[CLAM Dispatcher]      hint: If you're using the development server, check you pass the path your service configuration file is in using the -P flag. For Apache integration, verify you add this path to your PYTHONPATH (can be done from the WSGI script)", file=sys.stderr)
         if projectdir:
-            f = open(projectdir + '.done','w')
-            f.write(str(1))
-            f.close()
+            finish(projectdir, 1, openregistry(projectdir))
+            postcallback(projectdir, 1)
         return 1
 
     settingkeys = dir(settings)
@@ -163,6 +254,18 @@ def main():
         settings.DISPATCHER_MAXRESMEM = 0
     if not 'DISPATCHER_MAXTIME' in settingkeys:
         settings.DISPATCHER_MAXTIME = 0
+    if not 'PROJECTREGISTRY' in settingkeys:
+        settings.PROJECTREGISTRY = True
+    if not 'CALLBACKRETRIES' in settingkeys:
+        settings.CALLBACKRETRIES = 5
+    if not 'CALLBACKTIMEOUT' in settingkeys:
+        settings.CALLBACKTIMEOUT = 10
+    if not 'CALLBACKSECRET' in settingkeys:
+        settings.CALLBACKSECRET = None
+    if not 'DISKUSAGERECONCILE' in settingkeys:
+        settings.DISKUSAGERECONCILE = 86400
+
+    registry = openregistry(projectdir, settings) if projectdir else None
 
 
     try:
@@ -170,10 +273,14 @@ def main():
     except (UnicodeDecodeError, UnicodeError, UnicodeEncodeError):
         print("[CLAM Dispatcher] Running " + repr(cmd), file=sys.stderr) #unicode-issues on Python 2
 
-    if projectdir:
-        process = subprocess.Popen(cmd,cwd=projectdir, shell=True, stderr=sys.stderr)
-    else:
-        process = subprocess.Popen(cmd, shell=True, stderr=sys.stderr)
+    try:
+        if projectdir:
+            process = subprocess.Popen(cmd,cwd=projectdir, shell=True, stderr=sys.stderr)
+        else:
+            process = subprocess.Popen(cmd, shell=True, stderr=sys.stderr)
+    except OSError as e:
+        print("[CLAM Dispatcher] " + str(e), file=sys.stderr)
+        process = None
     begintime = datetime.datetime.now()
     if process:
         pid = process.pid
@@ -182,86 +289,125 @@ def main():
         if projectdir:
             with open(projectdir + '.pid','w') as f:
                 f.write(str(pid))
+            #the registry holds our own pid rather than that of the process: we outlive it until the project is registered as done, so the project is never mistaken for one whose process disappeared in the meantime
+            register(registry, projectdir, status=clam.common.status.RUNNING, pid=os.getpid(), exitcode=None, aborted=0)
     else:
         print("[CLAM Dispatcher] Unable to launch process", file=sys.stderr)
         sys.stderr.flush()
         if projectdir:
-            with open(projectdir + '.done','w') as f:
-                f.write(str(1))
+            finish(projectdir, 1, registry)
+            postcallback(projectdir, 1, settings)
         return 1
 
-    #intervalf = lambda s: min(s/10.0, 15)
+    #Rather than polling, we sleep until the process exits, a control message arrives, or a periodic check is due
+    selector = selectors.DefaultSelector()
+    exitfd, kind = watchprocess(pid)
+    selector.register(exitfd, selectors.EVENT_READ, kind)
+    controlfd = None
+    if projectdir:
+        controlfd = opencontrol(projectdir)
+        if controlfd is not None:
+            selector.register(controlfd, selectors.EVENT_READ, 'control')
+
+    monitor = ResourceMonitor(pid)
+    rusage = None
     abort = False
     idle = 0
-    done = False
-    lastpolltime = datetime.datetime.now()
-    lastabortchecktime = datetime.datetime.now()
+    lastpolltime = lastabortchecktime = time.time()
+    statuslogcache = clam.common.status.StatusLogCache(1)
+    progress = None
 
-    while not done:
+    while True:
         d = total_seconds(datetime.datetime.now() - begintime)
         try:
-            returnedpid, statuscode = os.waitpid(pid, os.WNOHANG)
+            returnedpid, statuscode, rusage = os.wait4(pid, os.WNOHANG)
             if returnedpid != 0:
                 print("[CLAM Dispatcher] Process ended (" + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ", " + str(d)+"s) ", file=sys.stderr)
-                done = True
+                break
         except OSError: #no such process
             print("[CLAM Dispatcher] Process lost! (" + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S') + ", " + str(d)+"s)", file=sys.stderr)
             statuscode = 1
-            done = True
-
-        if done:
             break
 
-        if total_seconds(datetime.datetime.now() - lastabortchecktime) >= min(10, d* 0.5):  #every 10 seconds, faster at beginning
-            if projectdir and os.path.exists(projectdir + '.abort'):
+        now = time.time()
+        if projectdir and now - lastabortchecktime >= abortcheckinterval(d):
+            #the abort file is a fallback for when the control pipe can't be used (e.g. remote hosts)
+            if os.path.exists(projectdir + '.abort'):
                 abort = True
-            if abort:
-                print("[CLAM Dispatcher] ABORTING PROCESS ON SIGNAL! (" + str(d)+"s)", file=sys.stderr)
-                os.system("sleep 30 && kill -9 " + str(pid) + " &") #deathtrap in case the process doesn't listen within 30 seconds
-                os.kill(pid, signal.SIGTERM)
-                os.waitpid(pid, 0)
-                if projectdir:
-                    os.unlink(projectdir + '.abort')
-                    open(projectdir + '.aborted','w')
-                    f.close()
-                done = True
-                break
-            lastabortchecktime = datetime.datetime.now()
-
-
-        if d <= 1:
-            idle += 0.05
-            time.sleep(0.05)
-        elif d <= 2:
-            idle += 0.2
-            time.sleep(0.2)
-        elif d <= 10:
-            idle += 0.5
-            time.sleep(0.5)
-        else:
-            idle += 1
-            time.sleep(1)
-
-        if settings.DISPATCHER_MAXRESMEM > 0 and total_seconds(datetime.datetime.now() - lastpolltime) >= settings.DISPATCHER_POLLINTERVAL:
-            resmem = mem(pid)
-            if resmem > settings.DISPATCHER_MAXRESMEM * 1024:
+            lastabortchecktime = now
+
+            if registry is not None:
+                #report progress, only the newly appended part of the status file is parsed
+                statuslog, completion = statuslogcache.read(projectdir + '.status', 1)
+                if statuslog and (completion, statuslog[0][0]) != progress:
+                    progress = (completion, statuslog[0][0])
+                    register(registry, projectdir, completion=completion, message=statuslog[0][0])
+
+        if now - lastpolltime >= settings.DISPATCHER_POLLINTERVAL:
+            resmem = monitor.sample() #resident memory of the entire process tree
+            if settings.DISPATCHER_MAXRESMEM > 0 and resmem > settings.DISPATCHER_MAXRESMEM * 1024:
                 print("[CLAM Dispatcher] PROCESS EXCEEDS MAXIMUM RESIDENT MEMORY USAGE (" + str(resmem) + ' >= ' + str(settings.DISPATCHER_MAXRESMEM) + ')... ABORTING', file=sys.stderr)
                 abort = True
                 statuscode = 2
-            lastpolltime = datetime.datetime.now()
+            lastpolltime = now
         elif settings.DISPATCHER_MAXTIME > 0 and d > settings.DISPATCHER_MAXTIME:
             print("[CLAM Dispatcher] PROCESS TIMED OUT.. NO COMPLETION WITHIN " + str(d) + " SECONDS ... ABORTING", file=sys.stderr)
             abort = True
             statuscode = 3
 
+        if abort:
+            print("[CLAM Dispatcher] ABORTING PROCESS ON SIGNAL! (" + str(d)+"s)", file=sys.stderr)
+            if controlfd is not None:
+                selector.unregister(controlfd)
+            rusage = terminate(pid, selector, monitor)
+            if projectdir:
+                if os.path.exists(projectdir + '.abort'):
+                    os.unlink(projectdir + '.abort')
+                open(projectdir + '.aborted','w').close()
+                register(registry, projectdir, aborted=1)
+            break
+
+        #determine how long we can sleep before the next periodic check is due
+        timeout = min(lastabortchecktime + abortcheckinterval(d), lastpolltime + settings.DISPATCHER_POLLINTERVAL) - now
+        if settings.DISPATCHER_MAXTIME > 0:
+            timeout = min(timeout, settings.DISPATCHER_MAXTIME - d)
+        timeout = max(timeout, 0.001)
+
+        begin = time.time()
+        for event in wait(selector, timeout):
+            if event == 'control':
+                try:
+                    message = os.read(controlfd, 4096)
+                except (BlockingIOError, InterruptedError):
+                    message = b""
+                if b"abort" in message:
+                    print("[CLAM Dispatcher] Received abort request", file=sys.stderr)
+                    abort = True
+        idle += time.time() - begin
+
+    selector.close()
+    os.close(exitfd)
+    if controlfd is not None:
+        os.close(controlfd)
+        if os.path.exists(projectdir + '.control'): os.unlink(projectdir + '.control')
+
+    monitor.finish(rusage)
+    print("[CLAM Dispatcher] Resource usage: peak resident memory " + str(round(monitor.peakrss / 1024.0, 2)) + " MB, cpu time " + str(round(monitor.cputime, 2)) + "s", file=sys.stderr)
+
     if projectdir:
-        with open(projectdir + '.done','w') as f:
-            f.write(str(statuscode))
-        if os.path.exists(projectdir + '.pid'): os.unlink(projectdir + '.pid')
+        if 'PROFILES' in settingkeys:
+            #build the manifest of the output files before the project is marked as done, so the webservice does not have to load the metadata of all output files
+            print("[CLAM Dispatcher] Building output manifest", file=sys.stderr)
+            try:
+                clam.common.manifest.get(projectdir, 'output', settings.PROFILES, settle=0)
+            except Exception as e: #pylint: disable=broad-except
+                print("[CLAM Dispatcher] Unable to build output manifest: " + str(e), file=sys.stderr)
+        monitor.write(projectdir + '.stats', duration=round(total_seconds(datetime.datetime.now() - begintime), 2), exitcode=statuscode)
+        finish(projectdir, statuscode, registry)
 
         #update project index cache
         print("[CLAM Dispatcher] Updating project index", file=sys.stderr)
-        updateindex(projectdir)
+        updateindex(projectdir, settings.DISKUSAGERECONCILE)
 
 
     if tmpdir and os.path.exists(tmpdir):
@@ -276,6 +422,9 @@ def main():
             except: #pylint: disable=bare-except
                 print("[CLAM Dispatcher] Unable to remove " + filename, file=sys.stderr)
 
+    if projectdir:
+        postcallback(projectdir, statuscode, settings)
+
     d = total_seconds(datetime.datetime.now() - begintime)
     if statuscode > 127:
         print("[CLAM Dispatcher] Status code out of range (" + str(statuscode) + "), setting to 127", file=sys.stderr)
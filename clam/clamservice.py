@@ -30,6 +30,7 @@ import re
 import hashlib
 import argparse
 import time
+import threading
 import socket
 import json
 import mimetypes
@@ -38,6 +39,8 @@ import werkzeug
 import requests
 import base64
 import copy
+import codecs
+import concurrent.futures
 
 import clam.common.status
 import clam.common.parameters
@@ -45,7 +48,18 @@ import clam.common.formats
 import clam.common.auth
 import clam.common.oauth
 import clam.common.data
-from clam.common.util import globsymlinks, setdebug, setlog, setlogfile, printlog, printdebug, xmlescape, withheaders, computediskusage
+import clam.common.registry
+import clam.common.scheduler
+import clam.common.admission
+import clam.common.index
+import clam.common.archive
+import clam.common.manifest
+import clam.common.jsonapi
+import clam.common.callback
+import clam.common.resumable
+import clam.common.fetch
+import clam.common.sequence
+from clam.common.util import symlinkindex, beginsymlinkindex, endsymlinkindex, invalidatesymlinkindex, setdebug, setlog, setlogfile, printlog, printdebug, xmlescape, withheaders, computediskusage, filesize
 import clam.config.defaults as settings #will be overridden by real settings later
 settings.INTERNALURLPREFIX = ''
 
@@ -77,7 +91,14 @@ VERSION = clam.common.data.VERSION
 
 DEBUG = False
 
-DATEMATCH = re.compile(r'^[\d\.\-\s:]*$')
+REGISTRY = None
+SCHEDULER = None
+SCHEDULERLOCK = threading.Lock()
+SAMPLER = None
+FETCHER = None
+SPEC = None
+STATUSLOGCACHE = clam.common.status.StatusLogCache()
+PROGRESSPOLLINTERVAL = 0.5 #seconds between checks for progress whilst long polling or streaming
 
 settingsmodule = None #will be overwritten later
 
@@ -301,6 +322,20 @@ def auth_type():
     else:
         return "none"
 
+def wantsjson():
+    """Does the client ask for the JSON representation rather than CLAM XML?"""
+    return clam.common.jsonapi.accepted(flask.request.accept_mimetypes)
+
+def jsonresponse(fields, http_code=200):
+    """Serialises the fields selected in the request (all by default, and outside of a request) to the JSON representation"""
+    try:
+        data = clam.common.jsonapi.serialise(fields, clam.common.jsonapi.parsefields(flask.request.values.get('fields') if flask.has_request_context() else None))
+    except KeyError as e:
+        return withheaders(flask.make_response("Unknown field: " + str(e),400) ,"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})#400
+    except ValueError:
+        return withheaders(flask.make_response("Invalid offset or limit",400) ,"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})#400
+    return withheaders(flask.make_response(data, http_code), clam.common.jsonapi.MIMETYPE, {'Vary': 'Accept', 'allow_origin': settings.ALLOW_ORIGIN})
+
 ################# Views ##########################
 
 #Are tied into flask later because at this point we don't have an app instance yet
@@ -369,33 +404,151 @@ def entryshortcut(credentials = None, fromstart=False): #pylint: disable=too-man
 
     return None
 
+def getregistry():
+    """Returns the project state registry, or None if it is disabled"""
+    global REGISTRY #pylint: disable=global-statement
+    if REGISTRY is None and settings.PROJECTREGISTRY:
+        REGISTRY = clam.common.registry.Registry(settings.ROOT + "projects/" + clam.common.registry.REGISTRYFILE)
+    return REGISTRY
+
+def getscheduler():
+    """Returns the job scheduler, or None if the project registry (which holds the queue) is disabled"""
+    global SCHEDULER #pylint: disable=global-statement
+    if SCHEDULER is None and getregistry() is not None:
+        with SCHEDULERLOCK: #the thread of the resource sampler may be creating it as well
+            if SCHEDULER is None:
+                #projects are queued rather than refused when the system resources do not suffice
+                requirements = {'requirememory': settings.REQUIREMEMORY, 'maxloadavg': settings.MAXLOADAVG, 'mindiskspace': settings.MINDISKSPACE}
+                scheduler = clam.common.scheduler.Scheduler(getregistry(), settings.MAXCONCURRENTPROJECTS, settings.MAXCONCURRENTPROJECTSPERUSER, settings.PRIORITIES, printlog, getsampler(), requirements)
+                scheduler.save() #for the dispatchers
+                SCHEDULER = scheduler
+    return SCHEDULER
+
+def schedulequeued():
+    """Starts queued projects if slots and system resources have become available, called by the resource sampler after every sample"""
+    try:
+        if getscheduler() is not None:
+            getscheduler().schedule()
+    except Exception as e: #pylint: disable=broad-except
+        printlog("Unable to start queued projects: " + str(e))
+
+def getspec():
+    """Returns the static parts of the service specification, rendered only once: the formats and profiles included in responses (fragment) and the complete specification served at /spec/ (document, with its etag). Must be called within an application context"""
+    global SPEC #pylint: disable=global-statement
+    if SPEC is None:
+        fragment = flask.render_template('spec.xml',
+            formats=clam.common.data.getformats(settings.PROFILES),
+            profiles=settings.PROFILES,
+        )
+        #pylint: disable=bad-continuation
+        document = flask.render_template('response.xml',
+            version=VERSION,
+            system_id=settings.SYSTEM_ID,
+            system_name=settings.SYSTEM_NAME,
+            system_description=settings.SYSTEM_DESCRIPTION,
+            system_author=settings.SYSTEM_AUTHOR,
+            system_affiliation=settings.SYSTEM_AFFILIATION,
+            system_version=settings.SYSTEM_VERSION,
+            system_email=settings.SYSTEM_EMAIL,
+            system_url=settings.SYSTEM_URL,
+            system_parent_url=settings.SYSTEM_PARENT_URL,
+            system_register_url=settings.SYSTEM_REGISTER_URL,
+            system_login_url=settings.SYSTEM_LOGIN_URL,
+            system_logout_url=settings.SYSTEM_LOGOUT_URL,
+            system_cover_url=settings.SYSTEM_COVER_URL,
+            system_license=settings.SYSTEM_LICENSE,
+            user=None,
+            project=None,
+            url="",
+            statuscode=-1,
+            statusmessage="",
+            statuslog=[],
+            completion=0,
+            errors="no",
+            errormsg="",
+            parameterdata=settings.PARAMETERS,
+            inputsources=[],
+            outputpaths=None,
+            inputpaths=None,
+            spec=fragment,
+            datafile=None,
+            projects=[],
+            actions=settings.ACTIONS,
+            info=False,
+            porch=True,
+            disableinterface=True,
+            accesstoken=None,
+            interfaceoptions=settings.INTERFACEOPTIONS,
+            customhtml="",
+            customcss="",
+            allow_origin=settings.ALLOW_ORIGIN,
+            oauth_access_token="",
+            auth_type=auth_type()
+        )
+        SPEC = {
+            'fragment': fragment,
+            'document': document,
+            'etag': hashlib.md5(document.encode('utf-8')).hexdigest(),
+        }
+    return SPEC
+
+def spec():
+    """Serves the specification of the service (profiles, parameters, formats) in CLAM XML. It does not change whilst the service runs, but may when it is reconfigured, so caches have to revalidate it (which is cheap, by its etag). It is the same for all users, parameters are not filtered by access"""
+    extraheaders = {
+        'allow_origin': settings.ALLOW_ORIGIN,
+        'ETag': '"' + getspec()['etag'] + '"',
+        'Cache-Control': 'no-cache',
+    }
+    if getspec()['etag'] in flask.request.if_none_match:
+        return withheaders(flask.make_response("",304), headers=extraheaders)
+    return withheaders(flask.make_response(getspec()['document']), headers=extraheaders)
+
+def getsampler():
+    """Returns the resource sampler, starting its background thread if needed"""
+    global SAMPLER #pylint: disable=global-statement
+    if SAMPLER is None:
+        if settings.DISK and os.path.isdir(settings.DISK):
+            SAMPLER = clam.common.admission.ResourceSampler(settings.DISK, settings.RESOURCEPOLLINTERVAL, onsample=schedulequeued)
+        else:
+            SAMPLER = clam.common.admission.ResourceSampler(settings.ROOT, settings.RESOURCEPOLLINTERVAL, onsample=schedulequeued)
+    SAMPLER.start()
+    return SAMPLER
+
+def getfetcher():
+    """Returns the fetcher that downloads input files from URLs"""
+    global FETCHER #pylint: disable=global-statement
+    if FETCHER is None:
+        FETCHER = clam.common.fetch.Fetcher(settings.FETCHTHREADS, settings.FETCHMAXSIZE * 1024 * 1024, settings.FETCHTIMEOUT, printlog)
+    return FETCHER
+
+def getindex(user):
+    """Returns the project index of the user"""
+    return clam.common.index.ProjectIndex(settings.ROOT + "projects/" + user)
+
+def buildindex(user):
+    """Computes the project index for a user from scratch"""
+    printdebug("Computing index for " + user + "...")
+    projects = {}
+    for f in glob.glob(settings.ROOT + "projects/" + user + '/*'):
+        if os.path.isdir(f):
+            d = datetime.datetime.fromtimestamp(os.stat(f)[8])
+            project = os.path.basename(f)
+            projectsize, _ = computediskusage(f)
+            projects[project] = [ d.strftime("%Y-%m-%d %H:%M:%S"), projectsize, Project.simplestatus(project,user), time.time() ]
+    return projects
+
 def getprojects(user):
-    projects = []
-    totalsize = 0.0
     path = settings.ROOT + "projects/" + user
-    if os.path.exists(os.path.join(path,'.index')):
-        with io.open(os.path.join(path,'.index'),'r',encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-            except ValueError:
-                printlog("Invalid json in .index")
-                os.unlink(os.path.join(path,'.index'))
-                return getprojects(user)
-            totalsize = float(data['totalsize'])
-            projects = data['projects']
-    else:
-        printdebug("Computing index for " + user + "...")
-        for f in glob.glob(path + '/*'):
-            if os.path.isdir(f):
-                d = datetime.datetime.fromtimestamp(os.stat(f)[8])
-                project = os.path.basename(f)
-                projectsize, filecount = Project.getdiskusage(user,project )
-                totalsize += projectsize
-                projects.append( ( project , d.strftime("%Y-%m-%d %H:%M:%S"), round(projectsize,2), Project.simplestatus(project,user)  ) )
-        printdebug("Writing index for " + user + "...")
-        if os.path.exists(path):
-            with io.open(os.path.join(path,'.index'),'w',encoding='utf-8') as f_index:
-                json.dump({'totalsize': totalsize, 'projects': projects},f_index, ensure_ascii=False)
+    if not os.path.isdir(path):
+        return [], 0
+    index = getindex(user).get(lambda: buildindex(user))
+    totalsize = sum( projectdata[1] for projectdata in index.values() )
+    projects = [ (project, projectdata[0], round(projectdata[1],2), projectdata[2]) for project, projectdata in index.items() ]
+    registry = getregistry()
+    if registry is not None:
+        #the status in the index is only updated on creation and completion, the registry is authoritative
+        states = registry.projects(user)
+        projects = [ (projectdata[0], projectdata[1], projectdata[2], states[projectdata[0]]['status'] if projectdata[0] in states else projectdata[3]) for projectdata in projects ]
     return projects, round(totalsize)
 
 
@@ -430,6 +583,16 @@ def index(credentials = None):
     errors = "no"
     errormsg = ""
 
+    if wantsjson():
+        return jsonresponse({
+            'user': lambda: user,
+            'baseurl': getrooturl,
+            'projects': lambda: clam.common.jsonapi.projects(projects),
+            'totalsize': lambda: totalsize,
+            'parameters': lambda: clam.common.jsonapi.parameters(settings.PARAMETERS, user),
+            'corpora': CLAMService.corpusindex,
+        })
+
     corpora = CLAMService.corpusindex()
 
     #pylint: disable=bad-continuation
@@ -462,8 +625,7 @@ def index(credentials = None):
             inputsources=corpora,
             outputpaths=None,
             inputpaths=None,
-            profiles=settings.PROFILES,
-            formats=clam.common.data.getformats(settings.PROFILES),
+            spec=getspec()['fragment'],
             datafile=None,
             projects=projects,
             totalsize=totalsize,
@@ -520,8 +682,7 @@ def porch(credentials=None):
             inputsources=[],
             outputpaths=None,
             inputpaths=None,
-            profiles=settings.PROFILES,
-            formats=clam.common.data.getformats(settings.PROFILES),
+            spec=getspec()['fragment'],
             datafile=None,
             projects=projects,
             actions=settings.ACTIONS,
@@ -582,8 +743,7 @@ def info(credentials=None):
             inputsources=corpora,
             outputpaths=None,
             inputpaths=None,
-            profiles=settings.PROFILES,
-            formats=clam.common.data.getformats(settings.PROFILES),
+            spec=getspec()['fragment'],
             datafile=None,
             projects=projects,
             actions=settings.ACTIONS,
@@ -600,6 +760,28 @@ def info(credentials=None):
             auth_type=auth_type()
     )), headers={'allow_origin': settings.ALLOW_ORIGIN})
 
+def health():
+    """Reports the available system resources and how many projects are running and queued, for load balancers and monitoring. Returns HTTP 503 if no new projects would be admitted"""
+    sampler = getsampler()
+    snapshot = sampler.get()
+    if settings.ENABLED:
+        admissible, msg = sampler.check(settings.REQUIREMEMORY, settings.MAXLOADAVG, settings.MINDISKSPACE)
+    else:
+        admissible, msg = False, "Service is disabled for maintenance"
+    data = {
+        'status': "ok" if admissible else "saturated",
+        'message': msg,
+        'time': snapshot['time'],
+        'memavailable': round((snapshot.get('memavailable',0) + snapshot.get('memcached',0)) / 1024.0, 2), #MB
+        'loadavg': snapshot.get('loadavg'),
+        'diskfree': snapshot.get('diskfree'), #MB
+    }
+    if getregistry() is not None:
+        counts = getregistry().counts()
+        data['running'] = counts.get(clam.common.status.RUNNING, 0)
+        data['queued'] = counts.get(clam.common.status.QUEUED, 0)
+    return withheaders(flask.make_response(json.dumps(data), 200 if admissible else 503), "application/json", {'Cache-Control': 'no-cache', 'allow_origin': settings.ALLOW_ORIGIN})
+
 class Admin:
     @staticmethod
     def index(credentials=None):
@@ -687,10 +869,20 @@ class Admin:
                 return withheaders(flask.make_response("Ok"),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
             else:
                 return withheaders(flask.make_response('Failed',403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+        elif command == 'diskusage':
+            #reconcile the recorded disk usage of the project with what is actually on disk
+            if not os.path.isdir(Project.path(project, targetuser)):
+                return withheaders(flask.make_response('Not Found',404),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
+            size, count = Project.getdiskusage(targetuser, project)
+            printlog("Recomputed disk usage of project " + project + " of user " + targetuser + ": " + str(round(size,2)) + " MB in " + str(count) + " files")
+            return withheaders(flask.make_response(str(round(size,2)) + " MB in " + str(count) + " files"),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
         elif command == 'delete':
             d = Project.path(project, targetuser)
             if os.path.isdir(d):
                 shutil.rmtree(d)
+                if getregistry() is not None:
+                    getregistry().delete(targetuser, project)
+                getindex(targetuser).remove(project)
                 return withheaders(flask.make_response("Ok"),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
             else:
                 return withheaders(flask.make_response('Not Found',403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
@@ -724,7 +916,7 @@ class Admin:
             mimetype = 'application/octet-stream'
         headers['allow_origin'] = settings.ALLOW_ORIGIN
         try:
-            return withheaders(flask.Response( (line for line in outputfile) ), mimetype, headers )
+            return sendfile(outputfile, mimetype, headers)
         except UnicodeError:
             return withheaders(flask.make_response("Output file " + str(outputfile) + " is not in the expected encoding! Make sure encodings for output templates service configuration file are accurate.",500),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
         except FileNotFoundError:
@@ -763,6 +955,19 @@ def getbinarydata(path, buffersize=16*1024):
                 break
             else:
                 yield data
+
+def sendfile(clamfile, mimetype, headers):
+    """Serves a local input or output file. The file is sent as-is, using sendfile() where the WSGI server supports it, and conditional and range requests are supported (ETags are added by default, the argument to do so differs between Flask versions). Only if the contents would otherwise be misinterpreted, because the file is not in utf-8 and the content type declares no charset, it is decoded and sent in utf-8"""
+    contenttype = headers.get('Content-Type', mimetype)
+    if clamfile.metadata and 'encoding' in clamfile.metadata and 'charset=' not in contenttype.lower():
+        try:
+            convert = codecs.lookup(clamfile.metadata['encoding']).name not in ('utf-8','ascii')
+        except LookupError:
+            convert = False
+        if convert:
+            return withheaders(flask.Response( (line for line in clamfile) ), mimetype, headers )
+    return withheaders(flask.send_file(str(clamfile), mimetype=contenttype, conditional=True), contenttype, headers)
+
 class Project:
     """This class simply groups project methods, is not instantiated and does not offer any kind of persistence, all methods are static"""
 
@@ -778,13 +983,18 @@ class Project:
 
     @staticmethod
     def getdiskusage(user, project):
+        """Recomputes the disk usage of the project from scratch and records it in the index (reconciliation), correcting any drift in the incrementally tracked usage. Done by the dispatcher when a job finishes and the usage was not reconciled for DISKUSAGERECONCILE seconds, and on request of an administrator"""
         path = settings.ROOT + "projects/" + user + '/' + project + "/"
         size, count = computediskusage(path)
-        with open(os.path.join(path,'.du'),'w') as f:
-            f.write(str(size) + "\n")
-            f.write(str(count))
+        getindex(user).update(project, size=size, reconciled=time.time())
         return size, count
 
+    @staticmethod
+    def adjustdiskusage(project, user, size):
+        """Adjusts the recorded disk usage of the project by the specified amount (in MB, may be negative)"""
+        if size:
+            getindex(user).update(project, grow=size)
+
     @staticmethod
     def create(project, credentials): #pylint: disable=too-many-return-statements
         """Create project skeleton if it does not already exist (static method)"""
@@ -807,14 +1017,18 @@ class Project:
 
         #checking user quota
         if settings.USERQUOTA > 0:
-            _, totalsize = getprojects(user)
+            totalsize = round(getindex(user).totalsize(lambda: buildindex(user)))
             if totalsize > settings.USERQUOTA:
                 printlog("User " + user + " exceeded quota, refusing to create new project...")
                 return withheaders(flask.make_response("Unable to create new project because you are exceeding your disk quota (max " + str(settings.USERQUOTA) + " MB, you now use " + str(totalsize) + " MB). Please delete some projects and try again.",403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
 
+        created = False
         if not os.path.isdir(settings.ROOT + "projects/" + user + '/' + project):
             printlog("Creating project '" + project + "'")
+            created = True
             os.makedirs(settings.ROOT + "projects/" + user + '/' + project)
+            if getregistry() is not None:
+                getregistry().set(user, project, status=clam.common.status.READY, pid=0, exitcode=None, aborted=0, completion=0, message=None)
 
         if not os.path.isdir(settings.ROOT + "projects/" + user + '/' + project + '/input/'):
             os.makedirs(settings.ROOT + "projects/" + user + '/' + project + "/input")
@@ -829,24 +1043,9 @@ class Project:
             if not os.path.isdir(settings.ROOT + "projects/" + user + '/' + project + '/tmp'):
                 return withheaders(flask.make_response("tmp directory " + settings.ROOT + "projects/" + user + '/' + project + "/tmp/  could not be created succesfully",403),"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})
 
-        #Add project to index cache file
-        indexfile = os.path.join(settings.ROOT + "projects/" + user,'.index')
-        if os.path.exists(indexfile):
-            with open(os.path.join(indexfile),'r',encoding='utf-8') as f:
-                try:
-                    data = json.load(f)
-                    if 'projects' in data:
-                        for projectdata in data['projects']:
-                            if projectdata[0] == project:
-                                return None #all is well, project already in index, nothing to do
-                    d = datetime.datetime.fromtimestamp(os.stat(settings.ROOT + "projects/" + user + '/' + project)[8])
-                    projectdata = ( project , d.strftime("%Y-%m-%d %H:%M:%S"), 0.00, clam.common.status.READY )
-                    data['projects'].append(projectdata)
-                    with open(os.path.join(indexfile),'w',encoding='utf-8') as f:
-                        json.dump(data,f, ensure_ascii=False)
-                except ValueError:
-                    #something went wrong, delete the entire index (will be recomputed)
-                    os.unlink(os.path.join(indexfile))
+        if created:
+            #add project to the index
+            getindex(user).update(project, date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), size=0.0, status=clam.common.status.READY, reconciled=time.time())
 
         return None #checks rely on this
 
@@ -883,15 +1082,37 @@ class Project:
 
     @staticmethod
     def abort(project, user):
+        if getscheduler() is not None and getscheduler().cancel(user, project):
+            printlog("Removed project '" + project + "' from the queue" )
+            return True
         if Project.pid(project, user) == 0:
             return False
         printlog("Aborting process of project '" + project + "'" )
         f = open(Project.path(project,user) + ".abort", 'w')
         f.close()
         os.chmod( Project.path(project,user) + ".abort", 0o777)
+        #notify the dispatcher immediately through its control pipe, the abort file remains as a fallback
+        Project.notify(project, user, "abort")
         while not os.path.exists(Project.path(project, user) + ".done"):
             printdebug("Waiting for process to die")
-            time.sleep(1)
+            time.sleep(0.1)
+        return True
+
+    @staticmethod
+    def notify(project, user, command):
+        """Send a command to the dispatcher of the project through its control pipe, returns False if no dispatcher is listening"""
+        try:
+            fd = os.open(Project.path(project, user) + ".control", os.O_WRONLY | os.O_NONBLOCK)
+        except OSError: #no control pipe, or no dispatcher listening on it (on this host)
+            return False
+        try:
+            if not stat.S_ISFIFO(os.fstat(fd).st_mode):
+                return False
+            os.write(fd, command.encode('utf-8') + b"\n")
+        except OSError:
+            return False
+        finally:
+            os.close(fd)
         return True
 
     @staticmethod
@@ -905,10 +1126,12 @@ class Project:
 
     @staticmethod
     def exitstatus(project, user):
-        f = open(Project.path(project, user) + ".done")
-        status = int(f.read(1024))
-        f.close()
-        return status
+        exitcode = Project.state(project, user)['exitcode']
+        if exitcode is None:
+            f = open(Project.path(project, user) + ".done")
+            exitcode = int(f.read(1024))
+            f.close()
+        return exitcode
 
     @staticmethod
     def exists(project, credentials):
@@ -918,53 +1141,70 @@ class Project:
         return os.path.isdir(Project.path(project, user))
 
     @staticmethod
-    def statuslog(project, user):
-        statuslog = []
-        statusfile = Project.path(project,user) + ".status"
-        totalcompletion = 0
-        if os.path.isfile(statusfile): #pylint: disable=too-many-nested-blocks
-            prevmsg = None
-            with open(statusfile) as f:
-                for line in f: #pylint: disable=too-many-nested-blocks
-                    line = line.strip()
-                    if line:
-                        message = ""
-                        completion = 0
-                        timestamp = ""
-                        for field in line.split("\t"):
-                            if field:
-                                if field[-1] == '%' and field[:-1].isdigit():
-                                    completion = int(field[:-1])
-                                    if completion > 0:
-                                        totalcompletion = completion
-                                elif DATEMATCH.match(field):
-                                    if field.isdigit():
-                                        try:
-                                            d = datetime.datetime.fromtimestamp(float(field))
-                                            timestamp = d.strftime("%d/%b/%Y %H:%M:%S")
-                                        except ValueError:
-                                            pass
-                                else:
-                                    message += " " + field
-
-                        if message and (message != prevmsg):
-                            #print "STATUSLOG: t=",timestamp,"c=",completion,"msg=" + message.strip()
-                            statuslog.append( (message.strip(), timestamp, completion) )
-                            prevmsg = message
-            statuslog.reverse()
-        return statuslog, totalcompletion
+    def statuslog(project, user, limit=None):
+        """Returns the status log (most recent entry first) and the total completion, only lines appended since the previous call are parsed"""
+        if limit is None:
+            limit = settings.MAXSTATUSLOG
+        return STATUSLOGCACHE.read(Project.path(project,user) + ".status", limit)
 
     @staticmethod
-    def status(project, user):
+    def recoverstate(project, user):
+        """Derive the state of a project from the marker files in the project directory, used if the registry has no (valid) state"""
         if Project.running(project, user):
+            return {'status': clam.common.status.RUNNING, 'pid': Project.pid(project, user), 'exitcode': None, 'aborted': 0}
+        elif Project.done(project, user):
+            try:
+                f = open(Project.path(project, user) + ".done")
+                exitcode = int(f.read(1024))
+                f.close()
+            except ValueError:
+                exitcode = 1
+            return {'status': clam.common.status.DONE, 'pid': 0, 'exitcode': exitcode, 'aborted': int(Project.aborted(project, user))}
+        else:
+            return {'status': clam.common.status.READY, 'pid': 0, 'exitcode': None, 'aborted': 0}
+
+    @staticmethod
+    def state(project, user):
+        """Returns the state of the project as a dictionary (status, pid, exitcode, aborted), as held by the registry"""
+        registry = getregistry()
+        state = None
+        lost = False
+        if registry is not None:
+            state = registry.get(user, project)
+            if state is not None and state['status'] == clam.common.status.RUNNING:
+                if state['pid'] > 0:
+                    try:
+                        os.kill(state['pid'], 0) #raises error if pid doesn't exist
+                    except ProcessLookupError:
+                        printlog("Process of project " + project + " disappeared without notice, recovering state")
+                        state = None
+                        lost = True
+                elif time.time() - state['updated'] > 60:
+                    #the dispatcher never registered itself
+                    state = None
+                    lost = True
+        if state is None:
+            state = Project.recoverstate(project, user)
+            if registry is not None and os.path.isdir(Project.path(project, user)):
+                registry.set(user, project, **state)
+                if lost and state['status'] != clam.common.status.RUNNING:
+                    getscheduler().schedule() #the slot of the lost process is free, its dispatcher did not advance the queue
+        return state
+
+    @staticmethod
+    def status(project, user):
+        state = Project.state(project, user)
+        if state['status'] == clam.common.status.QUEUED: #the queue advances whenever a job finishes, see clamdispatcher
+            return (clam.common.status.QUEUED, "Waiting in the queue for a free slot (position " + str(getscheduler().position(user, project)) + "), the system will start automatically", [], 0)
+        elif state['status'] == clam.common.status.RUNNING:
             statuslog, completion = Project.statuslog(project, user)
             if statuslog:
                 return (clam.common.status.RUNNING, statuslog[0][0],statuslog, completion)
             else:
                 return (clam.common.status.RUNNING, "The system is running",  [], 0) #running
-        elif Project.done(project, user):
+        elif state['status'] == clam.common.status.DONE:
             statuslog, completion = Project.statuslog(project, user)
-            if Project.aborted(project,user):
+            if state['aborted']:
                 if not statuslog:
                     completion = 100
                 return (clam.common.status.DONE, "Aborted! Output may be partial or unavailable", statuslog, completion)
@@ -978,12 +1218,7 @@ class Project:
 
     @staticmethod
     def simplestatus(project, user):
-        if Project.done(project, user):
-            return clam.common.status.DONE
-        elif Project.running(project, user):
-            return clam.common.status.RUNNING
-        else:
-            return clam.common.status.READY
+        return Project.state(project, user)['status']
 
     @staticmethod
     def status_json(project, credentials=None):
@@ -1005,79 +1240,166 @@ class Project:
         return json.dumps({'success':True, 'statuscode':statuscode,'statusmsg':statusmsg, 'statuslog': statuslog, 'completion': completion})
 
     @staticmethod
-    def inputindex(project, user, d = ''):
-        prefix = Project.path(project, user) + 'input/'
-        for f in glob.glob(prefix + d + "/*"):
-            if os.path.basename(f)[0] != '.': #always skip all hidden files
-                if os.path.isdir(f):
-                    for result in Project.inputindex(project, user, f[len(prefix):]):
-                        yield result
-                else:
-                    file = clam.common.data.CLAMInputFile(Project.path(project,user), f[len(prefix):])
-                    file.attachviewers(settings.PROFILES) #attaches converters as well
-                    yield file
+    def progressdata(project, user, since=0):
+        """Returns the status and completion of the project, along with the status log entries following the first since ones (chronologically)"""
+        statuscode, statusmsg, _, completion = Project.status(project, user)
+        entries, offset, _ = STATUSLOGCACHE.since(Project.path(project, user) + ".status", since)
+        return {'status': statuscode, 'statusmessage': statusmsg, 'completion': completion, 'log': [ list(entry) for entry in entries ], 'offset': offset}
 
+    @staticmethod
+    def progress(project, credentials=None):
+        """Returns the status, completion and new status log entries of the project in JSON, a cheap alternative to the full project response for watching its progress. Supports long polling (wait) and server-sent events"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        if not Project.exists(project, user):
+            return withheaders(flask.make_response("Project " + project + " was not found for user " + user,404) ,"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})#404
+        try:
+            since = int(flask.request.headers.get('Last-Event-ID') or flask.request.values.get('since') or 0)
+            wait = min(float(flask.request.values.get('wait') or 0), settings.LONGPOLLTIMEOUT)
+        except ValueError:
+            return withheaders(flask.make_response("Invalid since or wait",400) ,"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})#400
+        active = (clam.common.status.RUNNING, clam.common.status.QUEUED)
+
+        if any( mimetype == 'text/event-stream' for mimetype, _ in flask.request.accept_mimetypes ):
+            def stream(since):
+                status = None
+                lastevent = time.time()
+                deadline = lastevent + settings.LONGPOLLTIMEOUT #the stream holds a worker, so it ends after a while and the client reconnects (with Last-Event-ID)
+                yield "retry: 1000\n\n" #reconnection delay (ms)
+                while True:
+                    data = Project.progressdata(project, user, since)
+                    for i, entry in enumerate(data['log']):
+                        yield "event: log\nid: " + str(since + i + 1) + "\ndata: " + json.dumps(entry) + "\n\n"
+                        lastevent = time.time()
+                    since = data['offset']
+                    if data['status'] != status or data['log']:
+                        status = data['status']
+                        del data['log']
+                        yield "event: status\ndata: " + json.dumps(data) + "\n\n"
+                        lastevent = time.time()
+                    if status not in active or time.time() >= deadline:
+                        break
+                    if time.time() - lastevent >= 15:
+                        yield ": keepalive\n\n"
+                        lastevent = time.time()
+                    time.sleep(PROGRESSPOLLINTERVAL)
+            return withheaders(flask.Response(flask.stream_with_context(stream(since))), 'text/event-stream', {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'allow_origin': settings.ALLOW_ORIGIN})
+
+        #long polling: wait until there are new log entries or the status changes
+        deadline = time.time() + wait
+        data = Project.progressdata(project, user, since)
+        status = data['status']
+        while not data['log'] and data['status'] == status and status in active and time.time() < deadline:
+            time.sleep(PROGRESSPOLLINTERVAL)
+            data = Project.progressdata(project, user, since)
+        return withheaders(flask.make_response(json.dumps(data)), 'application/json', {'Cache-Control': 'no-cache', 'allow_origin': settings.ALLOW_ORIGIN})
 
     @staticmethod
-    def outputindex(project, user, d = '', quick=False):
-        prefix = Project.path(project, user) + 'output/'
-        begintime = time.time()
-        for f in glob.glob(prefix + d + "/*"):
-            if os.path.basename(f)[0] != '.': #always skip all hidden files
-                if os.path.isdir(f):
-                    for result in Project.outputindex(project, user, f[len(prefix):], quick):
-                        yield result
-                else:
-                    file = clam.common.data.CLAMOutputFile(Project.path(project,user), f[len(prefix):], loadmetadata=not quick)
-                    file.attachviewers(settings.PROFILES) #attaches converters as well
-                    yield file
-                if not quick and time.time() - begintime >= settings.QUICKTIMEOUT:
-                    printlog("Loading output index is taking too long, enabling quick mode")
-                    quick = True
+    def inputindex(project, user, quick=False):
+        """Returns the manifest of all input files (a list of ManifestEntry instances)"""
+        return clam.common.manifest.get(Project.path(project, user), 'input', settings.PROFILES, quick, settings.QUICKTIMEOUT, printlog)
+
+    @staticmethod
+    def outputindex(project, user, quick=False):
+        """Returns the manifest of all output files (a list of ManifestEntry instances)"""
+        return clam.common.manifest.get(Project.path(project, user), 'output', settings.PROFILES, quick, settings.QUICKTIMEOUT, printlog)
+
+    @staticmethod
+    def selectfiles(entries):
+        """Selects the files from a manifest as requested by the template, glob, offset and limit request parameters. Returns the selection and a dictionary with the offset, limit and total number of files, the latter is None if no page was requested. Raises ValueError on invalid parameters"""
+        values = flask.request.values
+        offset = int(values.get('offset') or 0)
+        limit = int(values['limit']) if values.get('limit') else None
+        entries, total = clam.common.manifest.select(entries, values.get('template'), values.get('glob'), offset, limit)
+        if 'offset' in values or 'limit' in values:
+            return entries, {'offset': offset, 'limit': limit, 'total': total}
+        return entries, None
+
+    @staticmethod
+    def listfiles(project, user, basedir):
+        """Returns a listing of the input or output files only, optionally filtered and paginated"""
+        if not Project.exists(project, user):
+            return withheaders(flask.make_response("Project " + project + " was not found for user " + user,404) ,"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})#404
+        quick = 'quick' in flask.request.values and str(flask.request.values['quick']) == "1"
+        if basedir == 'input':
+            entries = Project.inputindex(project, user, quick)
+        else:
+            entries = Project.outputindex(project, user, quick)
+        try:
+            entries, page = Project.selectfiles(entries)
+        except ValueError:
+            return withheaders(flask.make_response("Invalid offset or limit",400) ,"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})#400
+        return withheaders(flask.make_response(flask.render_template('listing.xml',
+                version=VERSION,
+                system_id=settings.SYSTEM_ID,
+                system_name=settings.SYSTEM_NAME,
+                user=user,
+                project=project,
+                url=getrooturl(),
+                basedir=basedir,
+                files=entries,
+                page=page,
+                auth_type=auth_type()
+        )), headers={'allow_origin':settings.ALLOW_ORIGIN})
 
     @staticmethod
     def inputindexbytemplate(project, user, inputtemplate):
         """Retrieve sorted index for the specified input template"""
-        index = [] #pylint: disable=redefined-outer-name
         prefix = Project.path(project, user) + 'input/'
-        for linkf, f in globsymlinks(prefix + '.*.INPUTTEMPLATE.' + inputtemplate.id + '.*'):
-            seq = int(linkf.split('.')[-1])
-            index.append( (seq,f) )
-
         #yield CLAMFile objects in proper sequence
-        for seq, f in sorted(index):
+        for seq, _, f in symlinkindex(prefix).get(inputtemplate.id, []):
             yield seq, clam.common.data.CLAMInputFile(Project.path(project, user), f[len(prefix):])
 
 
+    @staticmethod
+    def allocateseq(project, user, inputtemplate, count=1):
+        """Reserves count consecutive sequence numbers for input files of the specified (non-unique) input template, returns the first. Unused numbers are to be returned with releaseseq()"""
+        return clam.common.sequence.allocate(Project.path(project, user), inputtemplate.id, lambda: [ seq for seq, _, _ in symlinkindex(Project.path(project, user) + 'input/').get(inputtemplate.id, []) ], count)
+
+    @staticmethod
+    def releaseseq(project, user, inputtemplate, seq, count=1):
+        """Returns reserved sequence numbers that ended up unused"""
+        clam.common.sequence.release(Project.path(project, user), inputtemplate.id, seq, count)
+
     @staticmethod
     def outputindexbytemplate(project, user, outputtemplate):
         """Retrieve sorted index for the specified input template"""
-        index = [] #pylint: disable=redefined-outer-name
         prefix = Project.path(project, user) + 'output/'
-        for linkf, f in globsymlinks(prefix + '.*.OUTPUTTEMPLATE.' + outputtemplate.id + '.*'):
-            seq = int(linkf.split('.')[-1])
-            index.append( (seq,f) )
-
         #yield CLAMFile objects in proper sequence
-        for seq, f in sorted(index):
+        for seq, _, f in symlinkindex(prefix, 'OUTPUTTEMPLATE').get(outputtemplate.id, []):
             yield seq, clam.common.data.CLAMOutputFile(Project.path(project, user), f[len(prefix):])
 
 
 
     #main view
     @staticmethod
-    def response(user, project, parameters, errormsg = "", datafile = False, oauth_access_token="", matchedprofiles=None, program=None,http_code=200):
+    def response(user, project, parameters, errormsg = "", datafile = False, oauth_access_token="", matchedprofiles=None, program=None,http_code=200, listing=False):
+        statuscode, statusmsg, statuslog, completion = Project.status(project, user)
+
+        failed = statuscode == clam.common.status.DONE and Project.exitstatus(project, user) != 0 #non-zero codes indicate errors!
+        if failed:
+            errormsg = "An error occurred within the system. Please inspect the error log for details"
+            printlog("Child process failed, exited with non zero-exit code.")
+
         #check if there are invalid parameters:
-        if not errormsg:
-            errors = "no"
-        else:
-            errors = "yes"
+        for parametergroup, parameterlist in parameters: #pylint: disable=unused-variable
+            for parameter in parameterlist:
+                if parameter.error:
+                    if not errormsg: errormsg = "One or more parameters are invalid"
+                    printlog("One or more parameters are invalid: " + parameter.id)
+                    break
 
-        statuscode, statusmsg, statuslog, completion = Project.status(project, user)
+        if not datafile and wantsjson():
+            return Project.jsonresponse(user, project, parameters, statuscode, statusmsg, statuslog, completion, errormsg, matchedprofiles, program, http_code, listing)
+
+        errors = "yes" if errormsg else "no"
 
         customhtml = ""
         if statuscode == clam.common.status.READY:
             customhtml = settings.CUSTOMHTML_PROJECTSTART
+        elif failed:
+            customhtml = settings.CUSTOMHTML_PROJECTFAILED
+        elif statuscode == clam.common.status.DONE:
+            customhtml = settings.CUSTOMHTML_PROJECTDONE
 
         inputpaths = []
         if statuscode == clam.common.status.READY or statuscode == clam.common.status.DONE:
@@ -1087,25 +1409,18 @@ class Project:
         quick = 'quick' in flask.request.values and str(flask.request.values['quick']) == "1"
 
         if statuscode == clam.common.status.DONE:
-            outputpaths = list(Project.outputindex(project, user,'',quick=quick))
-            if Project.exitstatus(project, user) != 0: #non-zero codes indicate errors!
-                errors = "yes"
-                errormsg = "An error occurred within the system. Please inspect the error log for details"
-                printlog("Child process failed, exited with non zero-exit code.")
-                customhtml = settings.CUSTOMHTML_PROJECTFAILED
-            else:
-                customhtml = settings.CUSTOMHTML_PROJECTDONE
+            outputpaths = Project.outputindex(project, user, quick)
         else:
             outputpaths = []
 
-
-        for parametergroup, parameterlist in parameters: #pylint: disable=unused-variable
-            for parameter in parameterlist:
-                if parameter.error:
-                    errors = "yes"
-                    if not errormsg: errormsg = "One or more parameters are invalid"
-                    printlog("One or more parameters are invalid: " + parameter.id)
-                    break
+        #the listings of input and output files may be filtered and paginated
+        inputpage = outputpage = None
+        if listing:
+            try:
+                inputpaths, inputpage = Project.selectfiles(inputpaths)
+                outputpaths, outputpage = Project.selectfiles(outputpaths)
+            except ValueError:
+                return withheaders(flask.make_response("Invalid offset or limit",400) ,"text/plain",headers={'allow_origin': settings.ALLOW_ORIGIN})#400
 
         return withheaders(flask.make_response(flask.render_template('response.xml',
                 version=VERSION,
@@ -1136,8 +1451,9 @@ class Project:
                 inputsources=settings.INPUTSOURCES,
                 outputpaths=outputpaths,
                 inputpaths=inputpaths,
-                profiles=settings.PROFILES,
-                formats=clam.common.data.getformats(settings.PROFILES),
+                outputpage=outputpage,
+                inputpage=inputpage,
+                spec=getspec()['fragment'],
                 matchedprofiles=matchedprofiles, #comma-separated list of indices (str)
                 program=program, #Program instance
                 datafile=datafile,
@@ -1158,6 +1474,41 @@ class Project:
         ),http_code), headers={'allow_origin':settings.ALLOW_ORIGIN})
 
 
+    @staticmethod
+    def jsonresponse(user, project, parameters, statuscode, statusmsg, statuslog, completion, errormsg, matchedprofiles=None, program=None, http_code=200, listing=False):
+        """Returns the state of the project in the JSON representation, only the requested fields are computed"""
+        quick = 'quick' in flask.request.values and str(flask.request.values['quick']) == "1"
+        listings = {}
+
+        def files(basedir):
+            if basedir not in listings:
+                if basedir == 'input' and statuscode in (clam.common.status.READY, clam.common.status.DONE):
+                    entries = Project.inputindex(project, user)
+                elif basedir == 'output' and statuscode == clam.common.status.DONE:
+                    entries = Project.outputindex(project, user, quick)
+                else:
+                    entries = []
+                listings[basedir] = Project.selectfiles(entries) if listing else (entries, None)
+            return listings[basedir]
+
+        return jsonresponse({
+            'project': lambda: project,
+            'user': lambda: user,
+            'baseurl': getrooturl,
+            'status': lambda: statuscode,
+            'statusmessage': lambda: statusmsg,
+            'completion': lambda: completion,
+            'statuslog': lambda: statuslog,
+            'errors': lambda: bool(errormsg),
+            'errormsg': lambda: errormsg,
+            'parameters': lambda: clam.common.jsonapi.parameters(parameters, user),
+            'input': lambda: clam.common.jsonapi.files(files('input')[0]),
+            'inputpage': lambda: files('input')[1],
+            'output': lambda: clam.common.jsonapi.files(files('output')[0]),
+            'outputpage': lambda: files('output')[1],
+            'program': lambda: clam.common.jsonapi.program(program, matchedprofiles) if program else None,
+        }, http_code)
+
     @staticmethod
     def getaccesstoken(user,project):
         #for fineuploader, not oauth
@@ -1187,7 +1538,7 @@ class Project:
                 xmldata = f.read(os.path.getsize(datafile))
                 f.close()
                 data = clam.common.data.CLAMData(xmldata, None,False, Project.path(project,credentials), loadmetadata=False)
-                return Project.response(user, project, settings.PARAMETERS,"",False,oauth_access_token,','.join([str(x) for x in data.program.matchedprofiles]) if data.program else "", data.program) #200
+                return Project.response(user, project, settings.PARAMETERS,"",False,oauth_access_token,','.join([str(x) for x in data.program.matchedprofiles]) if data.program else "", data.program, listing=True) #200
             else:
                 #HTTP request parameters may be used to pre-set global parameters when starting a project (issue #66)
                 for parametergroup, parameterlist in settings.PARAMETERS: #pylint: disable=unused-variable
@@ -1195,7 +1546,7 @@ class Project:
                         value = parameter.valuefrompostdata(flask.request.values)
                         if value is not None:
                             parameter.set(value)
-                return Project.response(user, project, settings.PARAMETERS,"",False,oauth_access_token) #200
+                return Project.response(user, project, settings.PARAMETERS,"",False,oauth_access_token, listing=True) #200
 
 
     @staticmethod
@@ -1235,13 +1586,21 @@ class Project:
             else:
                 return withheaders(flask.redirect(getrooturl() + '/' + project),headers={'allow_origin': settings.ALLOW_ORIGIN})
 
+        if clam.common.fetch.pending(Project.path(project, user), settings.FETCHTIMEOUT):
+            return withheaders(flask.make_response("Input files are still being fetched, try again once they are in",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+
         #Generate arguments based on POSTed parameters
         commandlineparams = []
         postdata = flask.request.values
 
+        callback = postdata.get('callback') or None
+        if callback is not None and not clam.common.callback.allowed(callback, settings.ALLOWCALLBACKS):
+            return withheaders(flask.make_response("Callback URL not permitted: " + callback,403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+
         errors, parameters, commandlineparams = clam.common.data.processparameters(postdata, settings.PARAMETERS)
 
-        sufresources, resmsg = sufficientresources(user, project)
+        #with a scheduler, projects are queued until there are sufficient system resources, only hard limits are refused here
+        sufresources, resmsg = sufficientresources(user, project, getscheduler() is None)
         if not sufresources:
             printlog("*** NOT ENOUGH SYSTEM RESOURCES AVAILABLE: " + resmsg + " ***")
             return withheaders(flask.make_response("There are not enough system resources available to accommodate your request. " + resmsg + " .Please try again later.",503),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
@@ -1265,6 +1624,8 @@ class Project:
             with io.open(Project.path(project, user) + "clam.xml",'wb') as f:
                 f.write(Project.response(user, project, parameters, "",True, oauth_access_token, ",".join([str(x) for x in matchedprofiles_byindex]), program).data)
 
+            #the dispatcher posts the final state of the project to the callback URL (if any) when it finishes
+            clam.common.callback.register(Project.path(project, user), callback, getrooturl() + '/' + project + '/')
 
 
             #Start project with specified parameters
@@ -1311,13 +1672,19 @@ class Project:
                 else:
                     cmd = "ssh -o NumberOfPasswordPrompts=0 " + settings.REMOTEHOST + " " + cmd
             printlog("Starting dispatcher " +  settings.DISPATCHER + " with " + settings.COMMAND + ": " + repr(cmd) + " ..." )
-            #process = subprocess.Popen(cmd,cwd=Project.path(project), shell=True)
-            process = subprocess.Popen(cmd,cwd=settings.CLAMDIR, shell=True)
-            if process:
-                pid = process.pid
-                printlog("Started dispatcher with pid " + str(pid) )
-                with open(Project.path(project, user) + '.pid','w') as f: #will be handled by dispatcher!
-                    f.write(str(pid))
+            if getscheduler() is not None:
+                #the scheduler launches the dispatcher if a slot is free, and queues it otherwise
+                pid = getscheduler().submit(user, project, cmd, settings.CLAMDIR, Project.path(project, user))
+            else:
+                #process = subprocess.Popen(cmd,cwd=Project.path(project), shell=True)
+                process = subprocess.Popen(cmd,cwd=settings.CLAMDIR, shell=True)
+                pid = process.pid if process else None
+                if pid:
+                    with open(Project.path(project, user) + '.pid','w') as f: #will be handled by dispatcher!
+                        f.write(str(pid))
+            if pid is not None:
+                if pid:
+                    printlog("Started dispatcher with pid " + str(pid) )
                 if shortcutresponse is True:
                     #redirect to project page to lose parameters in URL
                     if oauth_access_token:
@@ -1345,41 +1712,25 @@ class Project:
         if statuscode == clam.common.status.RUNNING:
             Project.abort(project, user)
             msg = "Aborted"
+        elif statuscode == clam.common.status.QUEUED:
+            getscheduler().cancel(user, project)
+            msg = "Removed from queue"
         if not abortonly:
             printlog("Deleting project '" + project + "'" )
             shutil.rmtree(Project.path(project, user))
+            if getregistry() is not None:
+                getregistry().delete(user, project)
+            getindex(user).remove(project)
             msg += " Deleted"
         msg = msg.strip()
-        indexfile = os.path.join(settings.ROOT + "projects/" + user,'.index')
-        if os.path.exists(indexfile):
-            #delete project from the index cache
-            data = {}
-            with open(os.path.join(indexfile),'r',encoding='utf-8') as f:
-                try:
-                    data = json.load(f)
-                except ValueError:
-                    #delete the entire index
-                    data = {'projects': []}
-                    os.unlink(os.path.join(indexfile))
-            totalsize = 0.0
-            newdata = {
-                'projects': [],
-                'totalsize': 0.0,
-            }
-            for i, projectdata in enumerate(data['projects']):
-                if projectdata[0] != project:
-                    newdata['projects'].append(projectdata)
-                    totalsize += projectdata[2]
-            newdata['totalsize'] = totalsize
-            with open(os.path.join(indexfile),'w',encoding='utf-8') as f:
-                json.dump(newdata,f, ensure_ascii=False)
-
         return withheaders(flask.make_response(msg),'text/plain',{'Content-Length':len(msg), 'allow_origin': settings.ALLOW_ORIGIN})  #200
 
 
     @staticmethod
     def download_zip(project, credentials=None):
         user, _ = parsecredentials(credentials)
+        if 'list' in flask.request.args:
+            return Project.listfiles(project, user, 'output')
         return Project.getarchive(project, user,'zip')
 
     @staticmethod
@@ -1473,7 +1824,7 @@ class Project:
             headers['allow_origin'] = settings.ALLOW_ORIGIN
             printdebug("Returning output file " + str(outputfile) + " with mimetype " + mimetype + " and headers: " + repr(headers))
             try:
-                return withheaders(flask.Response( (line for line in outputfile) ), mimetype, headers )
+                return sendfile(outputfile, mimetype, headers)
             except UnicodeError:
                 return flask.make_response("Output file " + str(outputfile) + " is not in the expected encoding! Make sure encodings for output templates service configuration file are accurate.",500)
             except FileNotFoundError:
@@ -1499,7 +1850,10 @@ class Project:
             return withheaders(flask.make_response(msg), 'text/plain',{'Content-Length':len(msg), 'allow_origin': settings.ALLOW_ORIGIN}) #200
         elif os.path.isdir(Project.path(project, user) + filename):
             #Deleting specified directory
+            size, _ = computediskusage(Project.path(project, user) + filename)
             shutil.rmtree(Project.path(project, user) + filename)
+            invalidatesymlinkindex(Project.path(project, user) + filename)
+            Project.adjustdiskusage(project, user, -size)
             msg = "Deleted"
             return withheaders(flask.make_response(msg), 'text/plain',{'Content-Length':len(msg), 'allow_origin': settings.ALLOW_ORIGIN}) #200
         else:
@@ -1508,10 +1862,12 @@ class Project:
             except:
                 raise flask.abort(404)
 
+            size = filesize(Project.path(project, user) + 'output/' + file.filename, Project.path(project, user) + 'output/' + file.metafilename())
             success = file.delete()
             if not success:
                 raise flask.abort(404)
             else:
+                Project.adjustdiskusage(project, user, -size)
                 msg = "Deleted"
                 return withheaders(flask.make_response(msg), 'text/plain',{'Content-Length':len(msg), 'allow_origin': settings.ALLOW_ORIGIN}) #200
 
@@ -1521,81 +1877,56 @@ class Project:
         """Reset system, delete all output files and prepare for a new run"""
         d = Project.path(project, user) + "output"
         if os.path.isdir(d):
+            size, _ = computediskusage(d)
             shutil.rmtree(d)
             os.makedirs(d)
+            Project.adjustdiskusage(project, user, -size)
         else:
             raise flask.abort(404)
         if os.path.exists(Project.path(project, user) + ".done"):
             os.unlink(Project.path(project, user) + ".done")
         if os.path.exists(Project.path(project, user) + ".status"):
             os.unlink(Project.path(project, user) + ".status")
+        if getregistry() is not None:
+            getregistry().set(user, project, status=clam.common.status.READY, pid=0, exitcode=None, aborted=0, completion=0, message=None)
 
     @staticmethod
     def getarchive(project, user, format=None):
-        """Generates and returns a download package (or 403 if one is already in the process of being prepared)"""
-        if os.path.isfile(Project.path(project, user) + '.download'):
-            #make sure we don't start two compression processes at the same time
-            return withheaders(flask.make_response('Another compression is already running',403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
-        else:
-            if not format:
-                data = flask.request.values
-                if 'format' in data:
-                    format = data['format']
-                else:
-                    format = 'zip' #default
-
-            #validation, security
-            contentencoding = None
-            if format == 'zip':
-                contenttype = 'application/zip'
-                command = "/usr/bin/zip -r" #TODO: do not hard-code path!
-                if os.path.isfile(Project.path(project, user) + "output/" + project + ".tar.gz"):
-                    os.unlink(Project.path(project, user) + "output/" + project + ".tar.gz")
-                if os.path.isfile(Project.path(project, user) + "output/" + project + ".tar.bz2"):
-                    os.unlink(Project.path(project, user) + "output/" + project + ".tar.bz2")
-            elif format == 'tar.gz':
-                contenttype = 'application/x-tar'
-                contentencoding = 'gzip'
-                command = "/bin/tar -czf"
-                if os.path.isfile(Project.path(project, user) + "output/" + project + ".zip"):
-                    os.unlink(Project.path(project, user) + "output/" + project + ".zip")
-                if os.path.isfile(Project.path(project, user) + "output/" + project + ".tar.bz2"):
-                    os.unlink(Project.path(project, user) + "output/" + project + ".tar.bz2")
-            elif format == 'tar.bz2':
-                contenttype = 'application/x-bzip2'
-                command = "/bin/tar -cjf"
-                if os.path.isfile(Project.path(project, user) + "output/" + project + ".tar.gz"):
-                    os.unlink(Project.path(project, user) + "output/" + project + ".tar.gz")
-                if os.path.isfile(Project.path(project, user) + "output/" + project + ".zip"):
-                    os.unlink(Project.path(project, user) + "output/" + project + ".zip")
+        """Generates and returns a download package, it is streamed to the client whilst it is being generated"""
+        if not format:
+            data = flask.request.values
+            if 'format' in data:
+                format = data['format']
             else:
-                return withheaders(flask.make_response('Invalid archive format',403) ,"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})#TODO: message won't show
-
-            path = Project.path(project, user) + "output/" + project + "." + format
-
-            if not os.path.isfile(path):
-                printlog("Building download archive in " + format + " format")
-                cmd = command + ' ' + project + '.' + format + ' *'
-                printdebug(cmd)
-                printdebug(Project.path(project, user)+'output/')
-                process = subprocess.Popen(cmd, cwd=Project.path(project, user)+'output/', shell=True)
-                if not process:
-                    return withheaders(flask.make_response("Unable to make download package",500),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
-                else:
-                    pid = process.pid
-                    f = open(Project.path(project, user) + '.download','w')
-                    f.write(str(pid))
-                    f.close()
-                    os.waitpid(pid, 0) #wait for process to finish
-                    os.unlink(Project.path(project, user) + '.download')
+                format = 'zip' #default
+
+        #validation, security
+        contentencoding = None
+        if format == 'zip':
+            contenttype = 'application/zip'
+        elif format == 'tar.gz':
+            contenttype = 'application/x-tar'
+            contentencoding = 'gzip'
+        elif format == 'tar.bz2':
+            contenttype = 'application/x-bzip2'
+        else:
+            return withheaders(flask.make_response('Invalid archive format',403) ,"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})#TODO: message won't show
 
-            extraheaders = {
-                'allow_origin': settings.ALLOW_ORIGIN,
-                'Content-Disposition': 'attachment; filename="' + project +  '.' + format + '"'
-            }
-            if contentencoding:
-                extraheaders['Content-Encoding'] = contentencoding
-            return withheaders(flask.Response( getbinarydata(path) ), contenttype, extraheaders )
+        files = clam.common.archive.listfiles(Project.path(project, user) + "output")
+        etag = clam.common.archive.etag(files, format, settings.ARCHIVECOMPRESSION)
+        extraheaders = {
+            'allow_origin': settings.ALLOW_ORIGIN,
+            'ETag': '"' + etag + '"',
+            'Cache-Control': 'private, no-cache', #clients have to revalidate, the archive changes whenever the output changes
+        }
+        if etag in flask.request.if_none_match:
+            return withheaders(flask.make_response("",304), contenttype, extraheaders)
+
+        printlog("Streaming download archive in " + format + " format")
+        extraheaders['Content-Disposition'] = 'attachment; filename="' + project +  '.' + format + '"'
+        if contentencoding:
+            extraheaders['Content-Encoding'] = contentencoding
+        return withheaders(flask.Response( clam.common.archive.stream(files, format, settings.ARCHIVECOMPRESSION, printlog) ), contenttype, extraheaders )
 
 
     @staticmethod
@@ -1647,7 +1978,7 @@ class Project:
             headers['allow_origin'] = settings.ALLOW_ORIGIN
             try:
                 printdebug("Returning input file " + str(inputfile) + " with mimetype " + mimetype)
-                return withheaders(flask.Response( (line for line in inputfile) ), mimetype, headers )
+                return sendfile(inputfile, mimetype, headers)
             except UnicodeError:
                 return withheaders(flask.make_response("Input file " + str(inputfile) + " is not in the expected encoding! Make sure encodings for output templates service configuration file are accurate.",500),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
             except FileNotFoundError:
@@ -1664,12 +1995,19 @@ class Project:
 
         if len(filename) == 0:
             #Deleting all input files
+            size, _ = computediskusage(Project.path(project, user) + 'input')
             shutil.rmtree(Project.path(project, user) + 'input')
+            invalidatesymlinkindex(Project.path(project, user) + 'input')
+            Project.adjustdiskusage(project, user, -size)
             os.makedirs(Project.path(project, user) + 'input') #re-add new input directory
+            clam.common.sequence.reset(Project.path(project, user)) #numbering starts over
             return "Deleted" #200
         elif os.path.isdir(Project.path(project, user) + filename):
             #Deleting specified directory
+            size, _ = computediskusage(Project.path(project, user) + filename)
             shutil.rmtree(Project.path(project, user) + filename)
+            invalidatesymlinkindex(Project.path(project, user) + filename)
+            Project.adjustdiskusage(project, user, -size)
             return "Deleted" #200
         else:
             try:
@@ -1677,16 +2015,21 @@ class Project:
             except:
                 raise flask.abort(404)
 
+            size = filesize(Project.path(project, user) + 'input/' + file.filename, Project.path(project, user) + 'input/' + file.metafilename())
             success = file.delete()
             if not success:
                 raise flask.abort(404)
             else:
+                Project.adjustdiskusage(project, user, -size)
                 msg = "Deleted"
                 return withheaders(flask.make_response(msg),'text/plain', {'Content-Length': len(msg), 'allow_origin': settings.ALLOW_ORIGIN}) #200
 
     @staticmethod
     def addinputfile_nofile(project, credentials=None):
         printdebug('Addinputfile_nofile' )
+        if flask.request.method == 'GET' and 'list' in flask.request.args:
+            user, _ = parsecredentials(credentials)
+            return Project.listfiles(project, user, 'input')
         return Project.addinputfile(project,'',credentials)
 
     @staticmethod
@@ -1751,20 +2094,290 @@ class Project:
                     return "" #200
                 else:
                     assert False
+            elif 'file' in flask.request.files:
+                #Batch upload of one or more files
+                return addfiles(project, user, postdata, 'jsonapi' if wantsjson() else 'xml')
             else:
                 return withheaders(flask.make_response("No filename or inputsource specified",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
         else:
             #Simply forward to addfile
-            return addfile(project,filename,user, postdata)
+            return addfile(project,filename,user, postdata, None, 'jsonapi' if wantsjson() else 'xml')
 
 
 
-def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'): #pylint: disable=too-many-return-statements
-    """Add a new input file, this invokes the actual uploader"""
+    @staticmethod
+    def uploadstate(state, http_code=200):
+        """Returns the state of a resumable upload in JSON"""
+        data = {
+            'id': state['id'],
+            'filename': state['filename'],
+            'size': state['size'],
+            'received': state['received'],
+            'missing': clam.common.resumable.missing(state),
+            'complete': clam.common.resumable.complete(state),
+        }
+        return withheaders(flask.make_response(json.dumps(data), http_code), 'application/json', {'Cache-Control': 'no-cache', 'allow_origin': settings.ALLOW_ORIGIN})
 
+    @staticmethod
+    def initupload(project, credentials=None):
+        """Initiates a resumable upload of an input file, which is then sent in chunks. Takes the filename and size (in bytes) of the file, along with the request parameters for adding it (input template and metadata)"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        response = Project.create(project, user)
+        if response is not None:
+            return response
+        if Project.simplestatus(project, user) != clam.common.status.READY:
+            return withheaders(flask.make_response("No input files accepted at this stage",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        postdata = flask.request.values
+        try:
+            size = int(postdata.get('size',''))
+            if size < 0: raise ValueError
+        except ValueError:
+            return withheaders(flask.make_response("No valid size specified",400),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        filename = os.path.basename(postdata.get('filename',''))
+        if not filename:
+            return withheaders(flask.make_response("No filename specified",400),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        if settings.PROJECTQUOTA > 0 and size / (1024*1024) > settings.PROJECTQUOTA:
+            return withheaders(flask.make_response("The file exceeds the maximum size of a project (" + str(settings.PROJECTQUOTA) + " MB)",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        clam.common.resumable.expire(Project.path(project, user), settings.UPLOADEXPIRY)
+        fields = { key: value for key, value in postdata.items() if key not in ('filename','size') }
+        state = clam.common.resumable.create(Project.path(project, user), filename, size, fields)
+        printlog("Initiated resumable upload " + state['id'] + " of " + filename + " (" + str(size) + " bytes)")
+        return Project.uploadstate(state, 201)
+
+    @staticmethod
+    def getupload(project, uploadid, credentials=None):
+        """Returns the state of a resumable upload, including the byte ranges that are still missing"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        state = clam.common.resumable.load(Project.path(project, user), uploadid)
+        if state is None:
+            return withheaders(flask.make_response("No such upload",404),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        return Project.uploadstate(state)
+
+    @staticmethod
+    def uploadchunk(project, uploadid, credentials=None):
+        """Receives a chunk of a resumable upload in the request body, to be written at the offset specified in the request parameters. Chunks may be sent again, in any order"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        try:
+            offset = int(flask.request.args.get('offset',''))
+        except ValueError:
+            return withheaders(flask.make_response("No valid offset specified",400),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        try:
+            state = clam.common.resumable.write(Project.path(project, user), uploadid, offset, flask.request.stream, flask.request.content_length)
+        except ValueError as e:
+            return withheaders(flask.make_response(str(e),416),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        if state is None:
+            return withheaders(flask.make_response("No such upload",404),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        return Project.uploadstate(state)
+
+    @staticmethod
+    def finishupload(project, uploadid, credentials=None):
+        """Finalises a complete resumable upload and adds the file as an input file, as if it were uploaded in one go. Request parameters given here override those given when the upload was initiated. Responds like adding an input file does. If the file is not accepted due to parameter errors, the upload is kept so it can be finalised again with other parameters"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        state = clam.common.resumable.load(Project.path(project, user), uploadid)
+        if state is None:
+            return withheaders(flask.make_response("No such upload",404),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        if not clam.common.resumable.complete(state):
+            return withheaders(flask.make_response("The upload is not complete yet, " + str(sum( end - begin for begin, end in clam.common.resumable.missing(state) )) + " bytes are missing",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        if Project.simplestatus(project, user) != clam.common.status.READY:
+            return withheaders(flask.make_response("No input files accepted at this stage",403),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        postdata = dict(state['fields'])
+        postdata.update(flask.request.values.items())
+        datapath = clam.common.resumable.datapath(Project.path(project, user), uploadid)
+        response = addfile(project, state['filename'], user, postdata, None, 'jsonapi' if wantsjson() else 'xml', datapath)
+        if not os.path.exists(datapath):
+            #the upload was consumed (whether accepted or not)
+            clam.common.resumable.remove(Project.path(project, user), uploadid)
+        return response
+
+    @staticmethod
+    def fetchstate(project, state, http_code=200):
+        """Returns the state of a fetch of an input file from a URL in JSON. Once finished, it includes the response adding the file had (result, with http_code)"""
+        data = {
+            'id': state['id'],
+            'url': state['url'],
+            'filename': state['filename'],
+            'status': state['status'],
+            'received': state['received'],
+            'size': state['size'],
+            'error': state['error'],
+            'http_code': state['http_code'],
+            'result': state['result'],
+            'poll': getrooturl() + '/' + project + '/fetches/' + state['id'],
+        }
+        return withheaders(flask.make_response(json.dumps(data), http_code), 'application/json', {'Cache-Control': 'no-cache', 'allow_origin': settings.ALLOW_ORIGIN})
+
+    @staticmethod
+    def getfetch(project, fetchid, credentials=None):
+        """Returns the state of a fetch of an input file from a URL"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        state = clam.common.fetch.load(Project.path(project, user), fetchid)
+        if state is None:
+            return withheaders(flask.make_response("No such fetch",404),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        return Project.fetchstate(project, state)
+
+    @staticmethod
+    def cancelupload(project, uploadid, credentials=None):
+        """Cancels a resumable upload, removing what has been received"""
+        user, oauth_access_token = parsecredentials(credentials) #pylint: disable=unused-variable
+        if not clam.common.resumable.validid(uploadid) or not clam.common.resumable.remove(Project.path(project, user), uploadid):
+            return withheaders(flask.make_response("No such upload",404),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+        printlog("Cancelled resumable upload " + uploadid)
+        return withheaders(flask.make_response("Upload cancelled"),"text/plain", headers={'allow_origin': settings.ALLOW_ORIGIN})
+
+
+def isarchive(filename):
+    """Returns True if the filename is that of an archive that can be extracted upon upload"""
+    filename = filename.lower()
+    return filename[-7:] == '.tar.gz' or filename[-8:] == '.tar.bz2' or filename[-4:] == '.zip'
+
+def inputfilename(inputtemplate, filename, nextseq):
+    """Determines the filename an input file is stored under, given the filename it was uploaded with, as dictated by the input template"""
+    if not filename: #Actually, I don't think this can occur at this stage, but we'll leave it in to be sure (yes it can, when the entry shortcut is used!)
+        if inputtemplate.filename:
+            filename = inputtemplate.filename
+        elif inputtemplate.extension:
+            filename = str(nextseq) +'-' + str("%034x" % random.getrandbits(128)) + '.' + inputtemplate.extension
+        else:
+            filename = str(nextseq) +'-' + str("%034x" % random.getrandbits(128))
+
+    #Make sure filename matches (only if not an archive)
+    if inputtemplate.acceptarchive and isarchive(filename):
+        pass
+    else:
+        if inputtemplate.filename:
+            if filename != inputtemplate.filename:
+                filename = inputtemplate.filename
+                #return flask.make_response("Specified filename must the filename dictated by the inputtemplate, which is " + inputtemplate.filename)
+            #TODO LATER: add support for calling this with an actual number instead of #
+        if inputtemplate.extension:
+            if filename[-len(inputtemplate.extension) - 1:].lower() == '.' + inputtemplate.extension.lower():
+                #good, extension matches (case independent). Let's just make sure the case is as defined exactly by the inputtemplate
+                if not filename[:-len(inputtemplate.extension) - 1]:
+                    #file name is only an extension! add random component
+                    filename = "input-" + str("%x" % random.getrandbits(64)) + filename
+                filename = filename[:-len(inputtemplate.extension) - 1] +  '.' + inputtemplate.extension
+            else:
+                if not filename:
+                    #no file name specified, add a random component
+                    filename = "input-" + str("%x" % random.getrandbits(64))
+                filename = filename +  '.' + inputtemplate.extension
+                #return flask.make_response("Specified filename does not have the extension dictated by the inputtemplate ("+inputtemplate.extension+")") #403
+    return filename
+
+def safefilename(filename):
+    """Checks that the filename contains no symbols that are disallowed for input files"""
+    DISALLOWED = ('/','&','|','<','>',';','"',"'","`","{","}","\n","\r","\b","\t")
+    for c in filename:
+        if c in DISALLOWED:
+            return False
+    return True
+
+def acceptinputfile(project, user, inputtemplate, filename, seq, validatedata, metadata=None, converter=None):
+    """Completes the addition of an input file that has already been stored in the input directory: generates its metadata (unless explicitly provided) from the earlier validation results, converts and validates the file, and on success saves the metadata and links it to the input template with the given sequence number. Rejected files are removed. Returns a (valid, error, size) tuple, size being the disk usage of the accepted file in MB"""
+    inputdir = Project.path(project, user) + 'input/'
+
+    #Create a file object
+    file = clam.common.data.CLAMInputFile(Project.path(project, user), filename, False) #get CLAMInputFile without metadata (chicken-egg problem, this does not read the actual file contents!
+
+    #============== Generate metadata ==============
+
+    metadataerror = None
+    if not metadata: #check if it has not already been set in another stage
+        printdebug('(Generating metadata)')
+        #for newly generated metadata
+        try:
+            #Now we generate the actual metadata object (unsaved yet though). We pass our earlier validation results to prevent computing it again
+            validmeta, metadata, _ = inputtemplate.generate(file, validatedata)
+            if validmeta:
+                #And we tie it to the CLAMFile object
+                file.metadata = metadata
+                #Add inputtemplate ID to metadata
+                metadata.inputtemplate = inputtemplate.id
+            elif metadata is not None and 'validation_error' in metadata:
+                metadataerror = metadata['validation_error']
+            else:
+                metadataerror = "Undefined error"
+        except ValueError as msg:
+            metadataerror = msg
+        except KeyError as msg:
+            metadataerror = msg
+    else:
+        #for explicitly uploaded metadata
+        metadata.file = file
+        file.metadata = metadata
+        metadata.inputtemplate = inputtemplate.id
+
+    if metadata is not None and 'validation_error' in metadata:
+        printdebug('(Metadata could not be generated, ' + str(metadataerror) + ') due to validation error')
+        os.unlink(inputdir + filename) #remove upload
+        return False, "Input not accepted (validation failed): " + str(metadataerror), 0
+    elif metadataerror:
+        printdebug('(Metadata could not be generated, ' + str(metadataerror) + ',  this usually indicated an error in service configuration)')
+        os.unlink(inputdir + filename) #remove upload
+        return False, "Metadata could not be generated! " + str(metadataerror) + "  (this usually indicates an error in service configuration!)", 0
+
+    #=========== Convert the uploaded file (if requested) ==============
+    if converter:
+        printdebug('(Invoking converter)')
+        try:
+            success = converter.convertforinput(inputdir + filename, metadata)
+        except: #pylint: disable=bare-except
+            success = False
+        if not success:
+            return False, "Unable to convert", 0
+
+    #====================== Validate the file itself ====================
+    if not file.validate():
+        printdebug('(Validation error)')
+        #Too bad, everything worked out but the file itself doesn't validate.
+        os.unlink(inputdir + filename) #remove upload
+        return False, "The file did not validate, it is not in the proper expected format.", 0
+
+    printdebug('(Validation ok)')
+    #Great! Everything ok, save metadata
+    metadata.save(inputdir + file.metafilename())
+
+    #And create symbolic link for inputtemplates
+    linkfilename = os.path.dirname(filename)
+    if linkfilename: linkfilename += '/'
+    linkfilename += '.' + os.path.basename(filename) + '.INPUTTEMPLATE' + '.' + inputtemplate.id + '.' + str(seq)
+    os.symlink(inputdir + filename, inputdir + linkfilename)
+    invalidatesymlinkindex(inputdir)
+    return True, None, filesize(inputdir + filename, inputdir + file.metafilename())
+
+
+def addfile(project, filename, user, postdata, inputsource=None,returntype='xml', uploadpath=None):
+    """Add a new input file from the current request, this invokes the actual uploader (storeinputfile) with the uploaded file, metadata file and body of the request. If uploadpath is set, the file has already been received (a resumable upload) and is moved into place from there. Files to be downloaded from a URL are fetched in the background if enabled"""
+    fetch = None
+    if not uploadpath and 'url' in postdata and postdata['url'] and settings.FETCHTHREADS > 0 and returntype in ('xml','jsonapi'):
+        def fetch(inputtemplate, filename):
+            return fetchfile(project, filename, user, inputtemplate, postdata, flask.request.files.get('metafile'), returntype)
+    return storeinputfile(project, filename, user, postdata, inputsource, returntype, uploadpath, flask.request.headers.get('Inputtemplate',''), flask.request.files.get('file'), flask.request.files.get('metafile'), flask.request.stream, fetch)
+
+def storeinputfile(project, filename, user, postdata, inputsource=None, returntype='xml', sourcepath=None, inputtemplate_id='', uploadedfile=None, metafile=None, stream=None, fetch=None): #pylint: disable=too-many-return-statements
+    """Add a new input file, independent of any request: postdata holds the fields (input template, metadata parameters, url, contents or inputsource). If sourcepath is set, the file has already been received (a resumable upload or a fetch) and is moved into place from there. Otherwise the file is taken from uploadedfile (a file uploaded with the request) or read from stream (the body of an XHR POST). Metafile is an uploaded metadata file, if any. If fetch is set, a file to be downloaded from a URL is handed to it (called with the input template and filename) rather than downloaded right away"""
+
+
+    uploads = [] #descriptions of the uploaded files for the JSON representation
+    reservedseqs = [] #sequence numbers reserved for this upload and not used (yet)
+
+    def uploadfields(success, error=None):
+        return {
+            'success': lambda: success,
+            'error': lambda: error,
+            'uploads': lambda: uploads,
+        }
+
+    def releaseseqs():
+        for seq in reversed(reservedseqs):
+            Project.releaseseq(project, user, inputtemplate, seq)
+        del reservedseqs[:]
 
     def errorresponse(msg, code=403, xml=""):
-        if returntype == 'json':
+        releaseseqs()
+        if returntype == 'jsonapi':
+            return jsonresponse(uploadfields(False, msg), code)
+        elif returntype == 'json':
             return withheaders(flask.make_response(json.dumps({
                 "success": False,
                 "error": msg,
@@ -1777,7 +2390,6 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
                 #ignore msg, send only xml
                 return withheaders(flask.make_response(xml,403),headers={'allow_origin': settings.ALLOW_ORIGIN})
 
-    inputtemplate_id = flask.request.headers.get('Inputtemplate','')
     inputtemplate = None
     metadata = None
 
@@ -1832,47 +2444,8 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
     #See if other previously uploaded input files use this inputtemplate
     if inputtemplate.unique:
         nextseq = 0 #unique
-    else:
-        nextseq = 1 #will hold the next sequence number for this inputtemplate (in multi-mode only)
-
-    for seq, inputfile in Project.inputindexbytemplate(project, user, inputtemplate): #pylint: disable=unused-variable
-        if inputtemplate.unique:
+        for seq, inputfile in Project.inputindexbytemplate(project, user, inputtemplate): #pylint: disable=unused-variable
             return errorresponse("You have already submitted a file of this type, you can only submit one. Delete it first. (Inputtemplate=" + inputtemplate.id + ", unique=True)")
-        else:
-            if seq >= nextseq:
-                nextseq = seq + 1 #next available sequence number
-
-
-    if not filename: #Actually, I don't think this can occur at this stage, but we'll leave it in to be sure (yes it can, when the entry shortcut is used!)
-        if inputtemplate.filename:
-            filename = inputtemplate.filename
-        elif inputtemplate.extension:
-            filename = str(nextseq) +'-' + str("%034x" % random.getrandbits(128)) + '.' + inputtemplate.extension
-        else:
-            filename = str(nextseq) +'-' + str("%034x" % random.getrandbits(128))
-
-    #Make sure filename matches (only if not an archive)
-    if inputtemplate.acceptarchive and (filename[-7:].lower() == '.tar.gz' or filename[-8:].lower() == '.tar.bz2' or filename[-4:].lower() == '.zip'):
-        pass
-    else:
-        if inputtemplate.filename:
-            if filename != inputtemplate.filename:
-                filename = inputtemplate.filename
-                #return flask.make_response("Specified filename must the filename dictated by the inputtemplate, which is " + inputtemplate.filename)
-            #TODO LATER: add support for calling this with an actual number instead of #
-        if inputtemplate.extension:
-            if filename[-len(inputtemplate.extension) - 1:].lower() == '.' + inputtemplate.extension.lower():
-                #good, extension matches (case independent). Let's just make sure the case is as defined exactly by the inputtemplate
-                if not filename[:-len(inputtemplate.extension) - 1]:
-                    #file name is only an extension! add random component
-                    filename = "input-" + str("%x" % random.getrandbits(64)) + filename
-                filename = filename[:-len(inputtemplate.extension) - 1] +  '.' + inputtemplate.extension
-            else:
-                if not filename:
-                    #no file name specified, add a random component
-                    filename = "input-" + str("%x" % random.getrandbits(64))
-                filename = filename +  '.' + inputtemplate.extension
-                #return flask.make_response("Specified filename does not have the extension dictated by the inputtemplate ("+inputtemplate.extension+")") #403
 
     if inputtemplate.onlyinputsource and (not 'inputsource' in postdata or not postdata['inputsource']):
         return errorresponse("Adding files for this inputtemplate must proceed through inputsource")
@@ -1881,14 +2454,7 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
         return errorresponse("Invalid converter specified: " + postdata['converter'])
 
     #Make sure the filename is secure
-    validfilename = True
-    DISALLOWED = ('/','&','|','<','>',';','"',"'","`","{","}","\n","\r","\b","\t")
-    for c in filename:
-        if c in DISALLOWED:
-            validfilename = False
-            break
-
-    if not validfilename:
+    if not safefilename(filename):
         return errorresponse("Filename contains invalid symbols! Do not use /,&,|,<,>,',`,\",{,} or ;")
 
 
@@ -1897,13 +2463,30 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
     if response is not None:
         return response
 
+    if fetch is not None:
+        #Download from URL in the background
+        return fetch(inputtemplate, filename)
+
+    if not inputtemplate.unique:
+        #reserve the next sequence number for this inputtemplate (in multi-mode only)
+        nextseq = Project.allocateseq(project, user, inputtemplate)
+        reservedseqs.append(nextseq)
+
+    filename = inputfilename(inputtemplate, filename, nextseq)
+
 
     printdebug("(Obtaining filename for uploaded file)")
     head = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
     head += "<clamupload>\n"
-    if 'file' in flask.request.files:
-        printlog("Adding client-side file " + flask.request.files['file'].filename + " to input files")
-        sourcefile = flask.request.files['file'].filename
+    if sourcepath:
+        if 'url' in postdata and postdata['url']:
+            printlog("Adding file " + filename + " fetched from " + postdata['url'] + " to input files")
+        else:
+            printlog("Adding client-side file " + filename + " to input files. Uploaded in chunks")
+        sourcefile = filename
+    elif uploadedfile is not None:
+        printlog("Adding client-side file " + uploadedfile.filename + " to input files")
+        sourcefile = uploadedfile.filename
     elif 'url' in postdata and postdata['url']:
         #Download from URL
         printlog("Adding web-based URL " + postdata['url'] + " to input files")
@@ -1932,14 +2515,14 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
 
     #============================ Generate metadata ========================================
     printdebug('(Generating and validating metadata)')
-    if 'metafile' in flask.request.files:  #and (not isinstance(postdata['metafile'], dict) or len(postdata['metafile']) > 0)):
+    if metafile is not None:
         #an explicit metadata file was provided, upload it:
         printlog("Metadata explicitly provided in file, uploading...")
         #Upload file from client to server
-        metafile = Project.path(project, user) + 'input/.' + filename + '.METADATA'
-        flask.request.files['metafile'].save(metafile)
+        metapath = Project.path(project, user) + 'input/.' + filename + '.METADATA'
+        metafile.save(metapath)
         try:
-            with io.open(metafile,'r',encoding='utf-8') as f:
+            with io.open(metapath,'r',encoding='utf-8') as f:
                 metadata = clam.common.data.CLAMMetaData.fromxml(f.read())
             errors, parameters = inputtemplate.validate(metadata, user)
             validmeta = True
@@ -1994,11 +2577,12 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
     #  ----------- Check if archive are allowed -------------
     archive = False
     addedfiles = []
+    addedseqs = [] #sequence numbers of the added files
     if not errors and inputtemplate.acceptarchive: #pylint: disable=too-many-nested-blocks
         printdebug('(Archive test)')
         # -------- Are we an archive? If so, determine what kind
         archivetype = None
-        if 'file' in flask.request.files:
+        if sourcepath or uploadedfile is not None:
             uploadname = sourcefile.lower()
             archivetype = None
             if uploadname[-4:] == '.zip':
@@ -2026,93 +2610,88 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
                 archivetype = 'zip'
 
         if archivetype:
-            # =============== upload archive ======================
-            #random name
-            archive = "%032x" % random.getrandbits(128) + '.' + archivetype
-
-            #Upload file from client to server
-            printdebug('(Archive transfer starting)')
-            if not xhrpost:
-                flask.request.files['file'].save(Project.path(project,user) + archive)
-            elif xhrpost:
-                with open(Project.path(project,user) + archive,'wb') as f:
-                    while True:
-                        chunk = flask.request.stream.read(16384)
-                        if chunk:
-                            f.write(chunk)
-                        else:
-                            break
-            printdebug('(Archive transfer completed)')
             # =============== Extract archive ======================
-
-            #Determine extraction command
-            if archivetype == 'zip':
-                cmd = 'unzip -u'
-            elif archivetype == 'tar':
-                cmd = 'tar -xvf'
-            elif archivetype == 'tar.gz':
-                cmd = 'tar -xvzf'
-            elif archivetype == 'tar.bz2':
-                cmd = 'tar -xvjf'
+            #Members are streamed straight into the input directory. The archive itself is only stored if it needs to be seekable (zip) and is not on disk already
+            archive = True
+            tmparchive = None
+            if sourcepath:
+                source = sourcepath
+            elif not xhrpost:
+                source = uploadedfile.stream
+            elif archivetype == 'zip':
+                tmparchive = Project.path(project,user) + "%032x" % random.getrandbits(128) + '.zip'
+                with open(tmparchive,'wb') as f:
+                    shutil.copyfileobj(stream, f, 16384)
+                source = tmparchive
             else:
-                raise Exception("Invalid archive format: " + archivetype) #invalid archive, shouldn't happen
+                source = stream
 
-            #invoke extractor
-            printlog("Extracting '" + archive + "'" )
+            extractednames = set()
+            def target(name):
+                if inputtemplate.unique or not addedfiles:
+                    seq = nextseq + len(addedfiles)
+                else:
+                    seq = Project.allocateseq(project, user, inputtemplate)
+                    reservedseqs.append(seq)
+                newname = clam.common.data.resolveinputfilename(name, parameters, inputtemplate, seq, project)
+                if not safefilename(newname) or newname in extractednames:
+                    printlog("Skipping " + name + " in archive, its filename is invalid or not unique")
+                    if seq != nextseq and not inputtemplate.unique:
+                        reservedseqs.remove(seq)
+                        Project.releaseseq(project, user, inputtemplate, seq)
+                    return None
+                extractednames.add(newname)
+                addedfiles.append(newname)
+                addedseqs.append(seq)
+                return Project.path(project, user) + 'input/' + newname
+
+            printlog("Extracting archive " + sourcefile)
             try:
-                process = subprocess.Popen(cmd + " " + archive, cwd=Project.path(project,user), stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-            except: #pylint: disable=bare-except
-                return withheaders(flask.make_response("Unable to extract archive",500),headers={'allow_origin': settings.ALLOW_ORIGIN})
-            out, _ = process.communicate() #waits for process to end
-
-            if isinstance(out, bytes):
-                out = str(out,'utf-8')
-
-            #Read filename results
-
-            firstline = True
-            for line in out.split("\n"):
-                line = line.strip()
-                if line:
-                    printdebug('(Extraction output: ' + line+')')
-                    subfile = None
-                    if archivetype[0:3] == 'tar':
-                        subfile = line
-                    elif archivetype == 'zip' and not firstline: #firstline contains archive name itself, skip it
-                        colon = line.find(":")
-                        if colon:
-                            subfile =  line[colon + 1:].strip()
-                    if subfile and os.path.isfile(Project.path(project, user) + subfile):
-                        subfile_newname = clam.common.data.resolveinputfilename(os.path.basename(subfile), parameters, inputtemplate, nextseq+len(addedfiles), project)
-                        printdebug('(Extracted file ' + subfile + ', moving to input/' + subfile_newname+')')
-                        os.rename(Project.path(project, user) + subfile, Project.path(project, user) + 'input/' +  subfile_newname)
-                        addedfiles.append(subfile_newname)
-                firstline = False
-
-            #all done, remove archive
-            os.unlink(Project.path(project, user) + archive)
+                clam.common.archive.extract(source, archivetype, target, printlog)
+            except Exception as e: #pylint: disable=broad-except
+                printlog("Unable to extract archive " + sourcefile + ": " + str(e))
+                for extractedfile in addedfiles:
+                    if os.path.exists(Project.path(project, user) + 'input/' + extractedfile):
+                        os.unlink(Project.path(project, user) + 'input/' + extractedfile)
+                return errorresponse("Unable to extract archive: " + str(e))
+            finally:
+                if tmparchive:
+                    os.unlink(tmparchive)
+                if sourcepath and os.path.exists(sourcepath):
+                    os.unlink(sourcepath)
+            printdebug('(Extracted ' + str(len(addedfiles)) + ' files)')
 
     if not archive:
         addedfiles = [clam.common.data.resolveinputfilename(filename, parameters, inputtemplate, nextseq, project)]
+        addedseqs = [nextseq]
+
+    converter = None
+    if 'converter' in postdata and postdata['converter']:
+        converter = [ c for c in inputtemplate.converters if c.id == postdata['converter'] ][0] #(should always be found, error already provided earlier if not)
 
     fatalerror = None
 
     jsonoutput = {'success': False if errors else True, 'isarchive': archive}
+    if errors:
+        jsonoutput['error'] = 'There were parameter errors, file not uploaded: ' + "".join( parameter.error + ". " for parameter in parameters if parameter.error )
 
+    results = None
+    if archive and not errors and len(addedfiles) > 1:
+        #generate metadata for and validate the extracted files in parallel, each gets its own copy of any explicitly provided metadata
+        printdebug('(Validating ' + str(len(addedfiles)) + ' files using ' + str(settings.UPLOADTHREADS) + ' threads)')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=settings.UPLOADTHREADS) as pool:
+            results = list(pool.map(lambda item: acceptinputfile(project, user, inputtemplate, item[1], addedseqs[item[0]], (errors, parameters), copy.deepcopy(metadata), converter), enumerate(addedfiles)))
+        invalidatesymlinkindex(Project.path(project, user) + 'input/') #links were added by other threads
 
     output = head
-    for filename in addedfiles: #pylint: disable=too-many-nested-blocks
+    uploadsize = 0.0 #disk usage of the accepted files, in MB
+    parametersxml = "<parameters errors=\"" + ("yes" if errors else "no") + "\">" + "".join( parameter.xml() for parameter in parameters ) + "</parameters>"
+    jsonparameters = clam.common.jsonapi.parameters([(None, parameters)])
+    for i, filename in enumerate(addedfiles): #pylint: disable=too-many-nested-blocks
         output += "<upload source=\""+sourcefile +"\" filename=\""+filename+"\" inputtemplate=\"" + inputtemplate.id + "\" templatelabel=\""+inputtemplate.label+"\" format=\""+inputtemplate.formatclass.__name__+"\">\n"
-        if not errors:
-            output += "<parameters errors=\"no\">"
-        else:
-            output += "<parameters errors=\"yes\">"
-            jsonoutput['error'] = 'There were parameter errors, file not uploaded: '
-        for parameter in parameters:
-            output += parameter.xml()
-            if parameter.error:
-                jsonoutput['error'] += parameter.error + ". "
-        output += "</parameters>"
+        upload = {'filename': filename, 'inputtemplate': inputtemplate.id, 'format': inputtemplate.formatclass.__name__, 'valid': False, 'error': None, 'parameters': jsonparameters}
+        uploads.append(upload)
+        output += parametersxml
 
 
 
@@ -2120,27 +2699,21 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
             if not archive:
                 #============================ Transfer file ========================================
                 printdebug('(Start file transfer: ' +  Project.path(project, user) + 'input/' + filename+' )')
-                if 'file' in flask.request.files:
+                if sourcepath:
+                    printdebug('(Moving received file into place)')
+                    os.rename(sourcepath, Project.path(project, user) + 'input/' + filename)
+                elif uploadedfile is not None:
                     printdebug('(Receiving data by uploading file)')
                     #Upload file from client to server
-                    flask.request.files['file'].save(Project.path(project, user) + 'input/' + filename)
+                    uploadedfile.save(Project.path(project, user) + 'input/' + filename)
                 elif 'url' in postdata and postdata['url']:
                     printdebug('(Receiving data via url)')
                     #Download file from 3rd party server to CLAM server
                     try:
-                        r = requests.get(postdata['url'])
-                    except:
-                        raise flask.abort(404)
-                    if not (r.status_code >= 200 and r.status_code < 300):
+                        getfetcher().download(postdata['url'], Project.path(project, user) + 'input/' + filename)
+                    except clam.common.fetch.FetchError as e:
+                        printlog(str(e))
                         raise flask.abort(404)
-
-                    CHUNK = 16 * 1024
-                    f = open(Project.path(project, user) + 'input/' + filename,'wb')
-                    for chunk in r.iter_content(chunk_size=CHUNK):
-                        if chunk: # filter out keep-alive new chunks
-                            f.write(chunk)
-                            f.flush()
-                    f.close()
                 elif 'inputsource' in postdata and postdata['inputsource']:
                     #Copy (symlink!) from preinstalled data
                     printdebug('(Creating symlink to file ' + inputsource.path + ' <- ' + Project.path(project,user) + '/input/ ' + filename + ')')
@@ -2163,7 +2736,7 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
                     printdebug('(Receiving data directly from post body)')
                     with open(Project.path(project,user) + 'input/' + filename,'wb') as f:
                         while True:
-                            chunk = flask.request.stream.read(16384)
+                            chunk = stream.read(16384)
                             if chunk:
                                 f.write(chunk)
                             else:
@@ -2173,107 +2746,29 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
 
 
 
-            #Create a file object
-            file = clam.common.data.CLAMInputFile(Project.path(project, user), filename, False) #get CLAMInputFile without metadata (chicken-egg problem, this does not read the actual file contents!
-
-
-
-            #============== Generate metadata ==============
-
-            metadataerror = None
-            if not metadata and not errors: #check if it has not already been set in another stage
-                printdebug('(Generating metadata)')
-                #for newly generated metadata
-                try:
-                    #Now we generate the actual metadata object (unsaved yet though). We pass our earlier validation results to prevent computing it again
-                    validmeta, metadata, parameters = inputtemplate.generate(file, (errors, parameters ))
-                    if validmeta:
-                        #And we tie it to the CLAMFile object
-                        file.metadata = metadata
-                        #Add inputtemplate ID to metadata
-                        metadata.inputtemplate = inputtemplate.id
-                    elif 'validation_error' in metadata:
-                        metadataerror = metadata['validation_error']
-                    else:
-                        metadataerror = "Undefined error"
-                except ValueError as msg:
-                    validmeta = False
-                    metadataerror = msg
-                except KeyError as msg:
-                    validmeta = False
-                    metadataerror = msg
-            elif validmeta:
-                #for explicitly uploaded metadata
-                metadata.file = file
-                file.metadata = metadata
-                metadata.inputtemplate = inputtemplate.id
-
-            if 'validation_error' in metadata:
-                printdebug('(Metadata could not be generated, ' + str(metadataerror) + ') due to validation error')
-                jsonoutput['error'] = fatalerror = "Input not accepted (validation failed): " + str(metadataerror)
-                output += "<error>" + xmlescape(fatalerror) + "</error>"
+            if results is not None:
+                valid, error, size = results[i]
+            else:
+                valid, error, size = acceptinputfile(project, user, inputtemplate, filename, addedseqs[i], (errors, parameters), metadata, converter)
+            if valid:
+                if addedseqs[i] in reservedseqs:
+                    reservedseqs.remove(addedseqs[i])
+                output += "<valid>yes</valid>"
+                upload['valid'] = True
+                uploadsize += size
+            else:
+                jsonoutput['error'] = fatalerror = error
                 jsonoutput['success'] = False
-                #remove upload
-                os.unlink(Project.path(project, user) + 'input/' + filename)
-            elif metadataerror:
-                printdebug('(Metadata could not be generated, ' + str(metadataerror) + ',  this usually indicated an error in service configuration)')
-                jsonoutput['error'] = fatalerror = "Metadata could not be generated! " + str(metadataerror) + "  (this usually indicates an error in service configuration!)"
                 output += "<error>" + xmlescape(fatalerror) + "</error>"
-                jsonoutput['success'] = False
-                #remove upload
-                os.unlink(Project.path(project, user) + 'input/' + filename)
-            elif validmeta:
-                #=========== Convert the uploaded file (if requested) ==============
-
-                conversionerror = False
-                if 'converter' in postdata and postdata['converter']:
-                    for c in inputtemplate.converters:
-                        if c.id == postdata['converter']:
-                            converter = c
-                            break
-                    if converter: #(should always be found, error already provided earlier if not)
-                        printdebug('(Invoking converter)')
-                        try:
-                            success = converter.convertforinput(Project.path(project, user) + 'input/' + filename, metadata)
-                        except: #pylint: disable=bare-except
-                            success = False
-                        if not success:
-                            conversionerror = True
-                            jsonoutput['error'] = fatalerror = "Unable to convert"
-                            output += "<error>" + xmlescape(fatalerror) + "</error>"
-                            jsonoutput['success'] = False
-
-                #====================== Validate the file itself ====================
-                if not conversionerror:
-                    valid = file.validate()
-
-                    if valid:
-                        printdebug('(Validation ok)')
-                        output += "<valid>yes</valid>"
-
-                        #Great! Everything ok, save metadata
-                        metadata.save(Project.path(project, user) + 'input/' + file.metafilename())
-
-                        #And create symbolic link for inputtemplates
-                        linkfilename = os.path.dirname(filename)
-                        if linkfilename: linkfilename += '/'
-                        linkfilename += '.' + os.path.basename(filename) + '.INPUTTEMPLATE' + '.' + inputtemplate.id + '.' + str(nextseq)
-                        os.symlink(Project.path(project, user) + 'input/' + filename, Project.path(project, user) + 'input/' + linkfilename)
-                    else:
-                        printdebug('(Validation error)')
-                        #Too bad, everything worked out but the file itself doesn't validate.
-                        #output += "<valid>no</valid>"
-                        jsonoutput['error'] = fatalerror = "The file did not validate, it is not in the proper expected format."
-                        jsonoutput['success'] = False
-                        output += "<error>" + xmlescape(fatalerror) + "</error>"
-                        #remove upload
-                        os.unlink(Project.path(project, user) + 'input/' + filename)
+                upload['error'] = fatalerror
 
 
         output += "</upload>\n"
 
     output += "</clamupload>"
 
+    Project.adjustdiskusage(project, user, uploadsize)
+    releaseseqs()
 
 
     if returntype == 'boolean':
@@ -2285,11 +2780,15 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
     elif errors:
         #parameter errors, return XML output with 403 code
         printdebug('There were parameter errors during upload!')
-        if returntype == 'json':
+        if returntype == 'jsonapi':
+            return jsonresponse(uploadfields(False, jsonoutput.get('error')), 403)
+        elif returntype == 'json':
             jsonoutput['xml'] = str(base64.b64encode(output.encode('utf-8')),'utf-8') #embed XML in JSON for complete client-side processing
             return withheaders(flask.make_response(json.dumps(jsonoutput)), 'application/json', {'allow_origin': settings.ALLOW_ORIGIN})
         else:
             return withheaders(flask.make_response(output,403),headers={'allow_origin': settings.ALLOW_ORIGIN})
+    elif returntype == 'jsonapi': #success
+        return jsonresponse(uploadfields(True))
     elif returntype == 'xml': #success
         printdebug('Returning xml')
         return withheaders(flask.make_response(output), 'text/xml', {'allow_origin': settings.ALLOW_ORIGIN})
@@ -2307,6 +2806,134 @@ def addfile(project, filename, user, postdata, inputsource=None,returntype='xml'
 
 
 
+def fetchfile(project, filename, user, inputtemplate, postdata, metafile=None, returntype='xml'):
+    """Hands the download of an input file from a URL off to the fetcher, responding right away with 202 and the state of the fetch, which the client polls (Project.getfetch). Once fetched, the file is added with the same parameters"""
+    fields = { key: value for key, value in postdata.items() if key != 'metafile' }
+    fields['inputtemplate'] = inputtemplate.id
+    if metafile is not None:
+        #the request (and the files with it) will be gone by the time the file is added, pass the metadata along instead
+        fields['metadata'] = str(metafile.read(),'utf-8')
+    projectpath = Project.path(project, user)
+    clam.common.fetch.expire(projectpath, settings.UPLOADEXPIRY)
+    state = clam.common.fetch.create(projectpath, postdata['url'], filename, fields)
+    app = flask.current_app._get_current_object() #pylint: disable=protected-access
+
+    def finish(state, datapath):
+        with app.app_context(): #there is no request here, the file is added from the fields and the downloaded file alone
+            if Project.simplestatus(project, user) != clam.common.status.READY:
+                return 403, "No input files accepted at this stage"
+            response = storeinputfile(project, state['filename'], user, state['fields'], None, returntype, datapath)
+            return response.status_code, response.get_data(as_text=True)
+
+    printlog("Fetching " + postdata['url'] + " in the background (" + state['id'] + ")")
+    getfetcher().submit(projectpath, state, finish)
+    response = Project.fetchstate(project, state, 202)
+    response.headers['Location'] = getrooturl() + '/' + project + '/fetches/' + state['id']
+    return response
+
+def addfiles(project, user, postdata, returntype='xml'): #pylint: disable=too-many-return-statements
+    """Add all files uploaded in the ``file`` fields of the request as input files for one input template, sharing the metadata parameters. The input template, parameters and sequence numbers are resolved only once for the whole batch. Returns one CLAM Upload document describing all files; files that are rejected do not prevent the others from being added"""
+
+    uploads = [] #descriptions of the uploaded files for the JSON representation
+
+    def errorresponse(msg, code=403):
+        if returntype == 'jsonapi':
+            return jsonresponse({'success': lambda: False, 'error': lambda: msg, 'uploads': lambda: uploads}, code)
+        return withheaders(flask.make_response(msg,code),'text/plain',headers={'allow_origin': settings.ALLOW_ORIGIN})
+
+    inputtemplate_id = postdata.get('inputtemplate', flask.request.headers.get('Inputtemplate',''))
+    inputtemplate = None
+    for profile in settings.PROFILES:
+        for t in profile.input:
+            if t.id == inputtemplate_id:
+                inputtemplate = t
+    if not inputtemplate:
+        printlog("Specified inputtemplate (" + inputtemplate_id + ") not found!")
+        return errorresponse("An existing inputtemplate must be specified when uploading multiple files!" if not inputtemplate_id else "Specified inputtemplate (" + inputtemplate_id + ") not found!", 404)
+
+    if inputtemplate.onlyinputsource:
+        return errorresponse("Adding files for this inputtemplate must proceed through inputsource")
+
+    converter = None
+    if 'converter' in postdata and postdata['converter']:
+        for c in inputtemplate.converters:
+            if c.id == postdata['converter']:
+                converter = c
+        if not converter:
+            return errorresponse("Invalid converter specified: " + postdata['converter'])
+
+    files = flask.request.files.getlist('file')
+    printlog("Adding " + str(len(files)) + " client-side files to input files (inputtemplate=" + inputtemplate.id + ")")
+
+    #Reserve the sequence numbers once for the whole batch
+    if inputtemplate.unique:
+        nextseq = firstseq = 0
+        for seq, _ in Project.inputindexbytemplate(project, user, inputtemplate):
+            return errorresponse("You have already submitted a file of this type, you can only submit one. Delete it first. (Inputtemplate=" + inputtemplate.id + ", unique=True)")
+        if len(files) > 1:
+            return errorresponse("You can only submit one file of this type. (Inputtemplate=" + inputtemplate.id + ", unique=True)")
+    else:
+        nextseq = firstseq = Project.allocateseq(project, user, inputtemplate, len(files))
+
+    #Validate the shared metadata parameters once for the whole batch
+    errors, parameters = inputtemplate.validate(postdata, user)
+    parametersxml = "<parameters errors=\"" + ("yes" if errors else "no") + "\">" + "".join( parameter.xml() for parameter in parameters ) + "</parameters>"
+    jsonparameters = clam.common.jsonapi.parameters([(None, parameters)])
+
+    inputdir = Project.path(project, user) + 'input/'
+    output = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<clamupload>\n"
+    uploadsize = 0.0 #disk usage of the accepted files, in MB
+    fatalerror = None
+    added = set() #filenames in this batch
+    for upload in files:
+        sourcefile = os.path.basename(upload.filename or "")
+        filename = inputfilename(inputtemplate, sourcefile, nextseq)
+        if not errors:
+            filename = clam.common.data.resolveinputfilename(filename, parameters, inputtemplate, nextseq, project)
+        output += "<upload source=\""+xmlescape(sourcefile) +"\" filename=\""+xmlescape(filename)+"\" inputtemplate=\"" + inputtemplate.id + "\" templatelabel=\""+inputtemplate.label+"\" format=\""+inputtemplate.formatclass.__name__+"\">\n" + parametersxml
+        result = {'filename': filename, 'inputtemplate': inputtemplate.id, 'format': inputtemplate.formatclass.__name__, 'valid': False, 'error': None, 'parameters': jsonparameters}
+        uploads.append(result)
+        error = None
+        if errors:
+            pass #parameter errors are reported for all files, none are added
+        elif inputtemplate.acceptarchive and isarchive(sourcefile):
+            error = "Archives can not be part of a batch upload, upload them separately"
+        elif not safefilename(filename):
+            error = "Filename contains invalid symbols! Do not use /,&,|,<,>,',`,\",{,} or ;"
+        elif filename in added:
+            error = "Another file in this upload already has the filename " + filename
+        else:
+            added.add(filename)
+            upload.save(inputdir + filename)
+            valid, error, size = acceptinputfile(project, user, inputtemplate, filename, nextseq, (errors, parameters), None, converter)
+            if valid:
+                output += "<valid>yes</valid>"
+                result['valid'] = True
+                uploadsize += size
+                nextseq += 1
+        if error:
+            output += "<error>" + xmlescape(error) + "</error>"
+            result['error'] = fatalerror = error
+        output += "</upload>\n"
+    output += "</clamupload>"
+
+    Project.adjustdiskusage(project, user, uploadsize)
+    if not inputtemplate.unique and nextseq < firstseq + len(files):
+        #return the sequence numbers of the files that were not accepted
+        Project.releaseseq(project, user, inputtemplate, nextseq, firstseq + len(files) - nextseq)
+
+    if errors or fatalerror:
+        printlog("Errors during batch upload: " + str(len([ result for result in uploads if not result['valid'] ])) + " of " + str(len(uploads)) + " files not added")
+    if returntype == 'jsonapi':
+        error = None
+        if errors:
+            error = 'There were parameter errors, files not uploaded: ' + " ".join( parameter.error + "." for parameter in parameters if parameter.error )
+        elif fatalerror:
+            error = fatalerror
+        return jsonresponse({'success': lambda: not error, 'error': lambda: error, 'uploads': lambda: uploads}, 403 if error else 200)
+    return withheaders(flask.make_response(output, 403 if errors or fatalerror else 200), 'text/xml', {'allow_origin': settings.ALLOW_ORIGIN})
+
+
 def interfacedata(): #no auth
     inputtemplates_mem = []
     inputtemplates = []
@@ -2316,7 +2943,7 @@ def interfacedata(): #no auth
                 inputtemplates_mem.append(inputtemplate)
                 inputtemplates.append( inputtemplate.json() )
 
-    return withheaders(flask.make_response("systemid = '"+ settings.SYSTEM_ID + "'; baseurl = '" + getrooturl() + "';\n inputtemplates = [ " + ",".join(inputtemplates) + " ];"), 'text/javascript', {'allow_origin': settings.ALLOW_ORIGIN})
+    return withheaders(flask.make_response("systemid = '"+ settings.SYSTEM_ID + "'; baseurl = '" + getrooturl() + "'; chunkeduploadthreshold = " + str(settings.CHUNKEDUPLOADTHRESHOLD * 1024 * 1024) + ";\n inputtemplates = [ " + ",".join(inputtemplates) + " ];"), 'text/javascript', {'allow_origin': settings.ALLOW_ORIGIN})
 
 def foliaxsl():
     if foliatools is not None:
@@ -2580,52 +3207,20 @@ class ActionHandler:
         return ActionHandler.run(actionid, 'DELETE', credentials)
 
 
-def sufficientresources(user, project):
+def sufficientresources(user, project, system=True):
+    """Checks whether a project may be started, returns a (bool, message) tuple. The available system resources (memory, load, disk space) are only checked if system is set, the scheduler checks these itself"""
     if not settings.ENABLED:
         return False, "Service is disabled for maintenance"
-    if settings.REQUIREMEMORY > 0:
-        if not os.path.exists('/proc/meminfo'):
-            printlog("WARNING: No /proc/meminfo available on your system! Not Linux? Skipping memory requirement check!")
-        else:
-            memavail = cached = 0.0
-            with open('/proc/meminfo') as f:
-                for line in f:
-                    if line[0:13] == "MemAvailable:":
-                        memavail = float(line[14:].replace('kB','').strip()) #in kB
-                    if line[0:7] == "Cached:":
-                        cached = float(line[14:].replace('kB','').strip()) #in kB
-            if settings.REQUIREMEMORY * 1024 > memavail + cached:
-                return False, str(settings.REQUIREMEMORY * 1024) + " kB memory is required but only " + str(memavail + cached) + " is available."
-    if settings.MAXLOADAVG > 0:
-        if not os.path.exists('/proc/loadavg'):
-            printlog("WARNING: No /proc/loadavg available on your system! Not Linux? Skipping load average check!")
-        else:
-            with open('/proc/loadavg') as f:
-                line = f.readline()
-                loadavg = float(line.split(' ')[0])
-            if settings.MAXLOADAVG < loadavg:
-                return False, "System load too high: " + str(loadavg) + ", max is " + str(settings.MAXLOADAVG)
-    if settings.MINDISKSPACE and settings.DISK:
-        dffile = '/tmp/df.' + str("%034x" % random.getrandbits(128))
-        ret = os.system('df -mP ' + settings.DISK + " | gawk '{ print $4; }'  > " + dffile)
-        if ret == 0:
-            try:
-                with open(dffile,'r') as f:
-                    free = int(f.readlines()[-1])
-                if free < settings.MINDISKSPACE:
-                    os.unlink(dffile)
-                    return False, "Not enough diskspace, " + str(free) + " MB free, need at least " + str(settings.MINDISKSPACE) + " MB"
-            except:
-                printlog("WARNING: df " + settings.DISK + " failed (unexpected format). Skipping disk space check!")
-                os.unlink(dffile)
-
-        else:
-            printlog("WARNING: df " + settings.DISK + " failed. Skipping disk space check!")
+    if system:
+        #answered from the latest snapshot of the resource sampler
+        sufresources, msg = getsampler().check(settings.REQUIREMEMORY, settings.MAXLOADAVG, settings.MINDISKSPACE)
+        if not sufresources:
+            return False, msg
     if user:
-        projects, totalsize = getprojects(user)
-        if settings.USERQUOTA > 0 and totalsize > settings.USERQUOTA:
+        if settings.USERQUOTA > 0 and getindex(user).totalsize(lambda: buildindex(user)) > settings.USERQUOTA:
             return False , "You exceeded your disk quota, refusing to start the project"
-        if settings.MAXCONCURRENTPROJECTSPERUSER > 0:
+        if settings.MAXCONCURRENTPROJECTSPERUSER > 0 and getscheduler() is None: #otherwise the scheduler queues the project until a slot is free
+            projects, _ = getprojects(user)
             running = 0
             for p in projects:
                 if p[3] == clam.common.status.RUNNING:
@@ -2633,10 +3228,9 @@ def sufficientresources(user, project):
             if running >= settings.MAXCONCURRENTPROJECTSPERUSER:
                 return False , "You may only run " + str(settings.MAXCONCURRENTPROJECTSPERUSER) + " project(s) simultaneously and you are already at this maximum. Refusing to start the project."
         if settings.PROJECTQUOTA > 0 and project:
-            for p in projects:
-                if p[0] == project:
-                    if p[2] > settings.PROJECTQUOTA:
-                        return False, "Your project is too large, to run. The input files exceed the maximum of "  + str(settings.PROJECTQUOTA) + " MB. Refusing to start the project."
+            projectsize = getindex(user).projectsize(project, lambda: buildindex(user))
+            if projectsize is not None and projectsize > settings.PROJECTQUOTA:
+                return False, "Your project is too large, to run. The input files exceed the maximum of "  + str(settings.PROJECTQUOTA) + " MB. Refusing to start the project."
     return True, ""
 
 
@@ -2739,11 +3333,16 @@ class CLAMService(object):
         printdebug("Full settings dump: " + repr(vars(settings)))
 
 
+        getsampler() #start sampling available system resources in the background
+
         printdebug("Initialising flask service")
         self.service = flask.Flask("clam")
         self.service.jinja_env.trim_blocks = True
         self.service.jinja_env.lstrip_blocks = True
         self.service.secret_key = settings.SECRET_KEY
+        #template links are indexed at most once per request (unless they change), by whichever part of the request needs them first
+        self.service.before_request(beginsymlinkindex)
+        self.service.teardown_request(endsymlinkindex)
         printdebug("Registering main entrypoint: " + settings.INTERNALURLPREFIX + "/")
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/', '', self.auth.require_login(mainentry, optional=True), methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/index/', 'index', self.auth.require_login(index), methods=['GET'] )
@@ -2752,6 +3351,8 @@ class CLAMService(object):
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/info/', 'info', info, methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/login/', 'login', Login.GET, methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/logout/', 'logout', self.auth.require_login(Logout.GET), methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/health/', 'health', health, methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/spec/', 'spec', spec, methods=['GET'] )
 
         #versions without trailing slash so no automatic 301 redirect is needed
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/index', 'index2', self.auth.require_login(index), methods=['GET'] )
@@ -2759,6 +3360,8 @@ class CLAMService(object):
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/info', 'info2', info, methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/login', 'login2', Login.GET, methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/logout', 'logout2', self.auth.require_login(Logout.GET), methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/health', 'health2', health, methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/spec', 'spec2', spec, methods=['GET'] )
         #Authentication for handler is handled deeper in the ActionHandler, depending on whether allowanonymous is set
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/actions/<actionid>', 'action_get2', self.auth.require_login(ActionHandler.GET, optional=True), methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/actions/<actionid>', 'action_post2', self.auth.require_login(ActionHandler.POST, optional=True), methods=['POST'] )
@@ -2766,7 +3369,9 @@ class CLAMService(object):
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/actions/<actionid>', 'action_delete2', self.auth.require_login(ActionHandler.DELETE, optional=True), methods=['DELETE'] )
 
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/status', 'project_status_json2', Project.status_json, methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/progress', 'project_progress2', self.auth.require_login(Project.progress), methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/upload', 'project_uploader2', uploader, methods=['POST'] ) #has it's own login mechanism
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/uploads', 'project_initupload2', self.auth.require_login(Project.initupload), methods=['POST'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>', 'project_get2', self.auth.require_login(Project.get), methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>', 'project_start2', self.auth.require_login(Project.start), methods=['POST'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>', 'project_new2', self.auth.require_login(Project.new), methods=['PUT'] )
@@ -2800,12 +3405,21 @@ class CLAMService(object):
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/input/<path:filename>', 'project_addinputfile', self.auth.require_login(Project.addinputfile), methods=['POST'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/input/', 'project_addinputfile2', self.auth.require_login(Project.addinputfile_nofile), methods=['POST','GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/status/', 'project_status_json', Project.status_json, methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/progress/', 'project_progress', self.auth.require_login(Project.progress), methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/upload/', 'project_uploader', uploader, methods=['POST'] ) #has it's own login mechanism
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/uploads/', 'project_initupload', self.auth.require_login(Project.initupload), methods=['POST'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/uploads/<uploadid>', 'project_getupload', self.auth.require_login(Project.getupload), methods=['GET'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/uploads/<uploadid>', 'project_uploadchunk', self.auth.require_login(Project.uploadchunk), methods=['PUT'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/uploads/<uploadid>', 'project_finishupload', self.auth.require_login(Project.finishupload), methods=['POST'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/uploads/<uploadid>', 'project_cancelupload', self.auth.require_login(Project.cancelupload), methods=['DELETE'] )
+        self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/fetches/<fetchid>', 'project_getfetch', self.auth.require_login(Project.getfetch), methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/', 'project_get', self.auth.require_login(Project.get), methods=['GET'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/', 'project_start', self.auth.require_login(Project.start), methods=['POST'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/', 'project_new', self.auth.require_login(Project.new), methods=['PUT'] )
         self.service.add_url_rule(settings.INTERNALURLPREFIX + '/<project>/', 'project_delete', self.auth.require_login(Project.delete), methods=['DELETE'] )
 
+        with self.service.app_context():
+            getspec() #render the static parts of the service specification once
 
         self.mode = mode
         if self.mode != 'wsgi' and (settings.OAUTH or settings.PREAUTHHEADER or settings.BASICAUTH):
@@ -2907,6 +3521,8 @@ def set_defaults():
         settings.USERQUOTA = 0
     if 'PROJECTQUOTA' not in settingkeys:
         settings.PROJECTQUOTA = 0 #unlimited
+    if 'DISKUSAGERECONCILE' not in settingkeys:
+        settings.DISKUSAGERECONCILE = 86400 #in seconds, 0 = never
     if 'PROFILES' not in settingkeys:
         settings.PROFILES = []
     if 'INPUTSOURCES' not in settingkeys:
@@ -2930,8 +3546,14 @@ def set_defaults():
             settings.MINDISKSPACE = 0
     if 'MAXCONCURRENTPROJECTSPERUSER' not in settingkeys:
         settings.MAXCONCURRENTPROJECTSPERUSER = 0 #unlimited
+    if 'MAXCONCURRENTPROJECTS' not in settingkeys:
+        settings.MAXCONCURRENTPROJECTS = 0 #unlimited
+    if 'PRIORITIES' not in settingkeys:
+        settings.PRIORITIES = {} #maps users to queue priorities (higher goes first, default 0)
     if 'DISK' not in settingkeys:
         settings.DISK = None
+    if 'RESOURCEPOLLINTERVAL' not in settingkeys:
+        settings.RESOURCEPOLLINTERVAL = 5 #interval (in seconds) at which available memory, load and disk space are sampled
     if 'STYLE' not in settingkeys:
         settings.STYLE = 'classic'
     if 'CLAMDIR' not in settingkeys:
@@ -2957,6 +3579,36 @@ def set_defaults():
         settings.ENABLEWEBAPP = True
     if 'ENABLED' not in settingkeys:
         settings.ENABLED = True
+    if 'ARCHIVECOMPRESSION' not in settingkeys:
+        settings.ARCHIVECOMPRESSION = 6 #compression level (0-9) for output archives, 0 stores files without compression
+    if 'MAXSTATUSLOG' not in settingkeys:
+        settings.MAXSTATUSLOG = 0 #maximum number of (most recent) status log entries to include in responses (0 = unlimited)
+    if settings.MAXSTATUSLOG:
+        STATUSLOGCACHE.maxentries = settings.MAXSTATUSLOG #no need to retain more entries in memory than are ever included
+    if 'LONGPOLLTIMEOUT' not in settingkeys:
+        settings.LONGPOLLTIMEOUT = 60 #maximum number of seconds a long polling request (or event stream) for the progress of a project may last
+    if 'ALLOWCALLBACKS' not in settingkeys:
+        settings.ALLOWCALLBACKS = False #allow clients to pass a callback URL when starting a project, True for any URL or a list of allowed URLs (see clam.common.callback.allowed)
+    if 'CALLBACKRETRIES' not in settingkeys:
+        settings.CALLBACKRETRIES = 5
+    if 'CALLBACKTIMEOUT' not in settingkeys:
+        settings.CALLBACKTIMEOUT = 10
+    if 'CALLBACKSECRET' not in settingkeys:
+        settings.CALLBACKSECRET = None #if set, callbacks are signed with this secret (X-CLAM-Signature header)
+    if 'CHUNKEDUPLOADTHRESHOLD' not in settingkeys:
+        settings.CHUNKEDUPLOADTHRESHOLD = 64 #files larger than this (in MB) are uploaded in chunks by the web interface (resumable uploads), 0 to disable
+    if 'UPLOADEXPIRY' not in settingkeys:
+        settings.UPLOADEXPIRY = 86400 #resumable uploads that are not finalised are removed after this many seconds
+    if 'UPLOADTHREADS' not in settingkeys:
+        settings.UPLOADTHREADS = 4 #number of threads generating metadata for and validating the files extracted from an uploaded archive
+    if 'FETCHTHREADS' not in settingkeys:
+        settings.FETCHTHREADS = 4 #number of threads downloading input files from URLs in the background, 0 downloads them within the request instead
+    if 'FETCHMAXSIZE' not in settingkeys:
+        settings.FETCHMAXSIZE = 0 #maximum size (in MB) of an input file downloaded from a URL, 0 = unlimited
+    if 'FETCHTIMEOUT' not in settingkeys:
+        settings.FETCHTIMEOUT = 300 #maximum time (in seconds) downloading an input file from a URL may take
+    if 'PROJECTREGISTRY' not in settingkeys:
+        settings.PROJECTREGISTRY = True #keep the state of all projects in a shared registry (ROOT/projects/.registry.sqlite) rather than probing marker files on each request
     if 'QUICKTIMEOUT' not in settingkeys:
         settings.QUICKTIMEOUT = 90 #after loading output files for this many seconds, quick mode will be enabled and files will be loaded without metadata
     if 'REMOTEHOST' not in settingkeys:
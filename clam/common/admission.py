@@ -0,0 +1,101 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Resource admission --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Samples the available system resources (memory, load, disk space) in a background thread at a fixed interval, so admission checks can be answered from the latest snapshot without touching the system. Short-lived processes, such as dispatchers, can sample on demand instead"""
+
+import os
+import time
+import threading
+
+class ResourceSampler:
+    def __init__(self, path, interval=5, background=True, onsample=None):
+        self.path = path #a path on the disk that is monitored (normally ROOT)
+        self.interval = interval
+        self.background = background #sample in a background thread, otherwise a new snapshot is taken when the latest is older than the interval
+        self.onsample = onsample #function called (without arguments) by the background thread after every snapshot
+        self.snapshot = {}
+        self.pid = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def sample(self):
+        """Takes a new snapshot of the system resources"""
+        snapshot = {'time': time.time()}
+        try:
+            with open('/proc/meminfo','r') as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        snapshot['memavailable'] = int(line.split()[1]) #in kB
+                    elif line.startswith("Cached:"):
+                        snapshot['memcached'] = int(line.split()[1]) #in kB
+                    elif line.startswith("MemTotal:"):
+                        snapshot['memtotal'] = int(line.split()[1]) #in kB
+        except IOError:
+            pass #not Linux, memory checks will be skipped
+        try:
+            snapshot['loadavg'] = os.getloadavg()
+        except OSError:
+            pass
+        try:
+            st = os.statvfs(self.path)
+            snapshot['diskfree'] = st.f_bavail * st.f_frsize // (1024 * 1024) #in MB
+            snapshot['disktotal'] = st.f_blocks * st.f_frsize // (1024 * 1024) #in MB
+        except OSError:
+            pass
+        self.snapshot = snapshot
+        return snapshot
+
+    def run(self):
+        while True:
+            self.sample()
+            if self.onsample:
+                self.onsample()
+            time.sleep(self.interval)
+
+    def start(self):
+        """Starts the background sampling thread, if it is not running already in this process (threads do not survive a fork, as done by preforking WSGI servers)"""
+        with self.lock:
+            if self.pid != os.getpid() or self.thread is None or not self.thread.is_alive():
+                self.sample()
+                self.thread = threading.Thread(target=self.run, name="ResourceSampler", daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+
+    def get(self):
+        """Returns the latest snapshot, takes a new one if the sampler is not (or no longer) running"""
+        snapshot = self.snapshot
+        if not self.background:
+            if not snapshot or time.time() - snapshot['time'] > self.interval:
+                snapshot = self.sample()
+            return snapshot
+        if self.pid != os.getpid() or not snapshot or time.time() - snapshot['time'] > self.interval * 3:
+            self.start()
+            snapshot = self.snapshot
+        return snapshot
+
+    def check(self, requirememory=0, maxloadavg=0, mindiskspace=0):
+        """Checks the latest snapshot against the requirements (memory and disk space in MB, 0 disables a check). Returns a (bool, message) tuple"""
+        snapshot = self.get()
+        if requirememory > 0 and 'memavailable' in snapshot:
+            available = snapshot['memavailable'] + snapshot.get('memcached', 0)
+            if requirememory * 1024 > available:
+                return False, str(requirememory * 1024) + " kB memory is required but only " + str(available) + " is available."
+        if maxloadavg > 0 and 'loadavg' in snapshot:
+            if maxloadavg < snapshot['loadavg'][0]:
+                return False, "System load too high: " + str(snapshot['loadavg'][0]) + ", max is " + str(maxloadavg)
+        if mindiskspace > 0 and 'diskfree' in snapshot:
+            if snapshot['diskfree'] < mindiskspace:
+                return False, "Not enough diskspace, " + str(snapshot['diskfree']) + " MB free, need at least " + str(mindiskspace) + " MB"
+        return True, ""
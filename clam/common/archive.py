@@ -0,0 +1,209 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Archive generation --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Generates zip and tar archives of a directory on the fly, so they can be streamed to the client while they are being built, without writing them to disk. Also extracts uploaded archives in-process"""
+
+import os
+import bz2
+import stat
+import shutil
+import zlib
+import queue
+import hashlib
+import tarfile
+import zipfile
+import threading
+
+FORMATS = ('zip','tar.gz','tar.bz2')
+
+CHUNKSIZE = 64 * 1024
+
+#files with these extensions are already compressed and are stored as-is in zip archives
+COMPRESSEDEXTENSIONS = ('.zip','.gz','.tgz','.bz2','.xz','.lzma','.zst','.7z','.rar','.jpg','.jpeg','.png','.gif','.webp','.mp3','.ogg','.oga','.opus','.flac','.mp4','.webm','.mkv','.docx','.xlsx','.pptx','.odt','.epub')
+
+def listfiles(path):
+    """Returns a sorted list of (archivename, filename, stat) tuples for all files under the path that are to be included in an archive. Hidden entries at the top level are excluded"""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        if dirpath == path:
+            dirnames[:] = [ d for d in dirnames if d[0] != '.' ]
+            filenames = [ f for f in filenames if f[0] != '.' ]
+        for f in filenames:
+            filename = os.path.join(dirpath, f)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue #dangling symlink or removed in the meantime
+            files.append( (os.path.relpath(filename, path), filename, st) )
+    files.sort()
+    return files
+
+def etag(files, format, compresslevel):
+    """Computes an entity tag for the archive of the specified files, it changes whenever any file is added, removed or modified"""
+    h = hashlib.md5()
+    h.update((format + "\0" + str(compresslevel) + "\n").encode('utf-8'))
+    for archivename, _, st in files:
+        h.update((archivename + "\0" + str(st.st_size) + "\0" + str(st.st_mtime_ns) + "\n").encode('utf-8','surrogateescape'))
+    return h.hexdigest()
+
+
+class Pipe:
+    """Write-only file-like object that passes the data written to it on to a queue, in chunks, optionally compressing it"""
+
+    def __init__(self, q, compressor=None):
+        self.queue = q
+        self.compressor = compressor
+        self.buffer = []
+        self.size = 0
+        self.aborted = False
+
+    def write(self, data):
+        length = len(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if data:
+            self.buffer.append(bytes(data))
+            self.size += len(data)
+            if self.size >= CHUNKSIZE:
+                self.flush()
+        return length
+
+    def flush(self):
+        if self.buffer:
+            self.put(b"".join(self.buffer))
+            self.buffer = []
+            self.size = 0
+
+    def put(self, data):
+        while True:
+            if self.aborted:
+                raise IOError("Archive download aborted")
+            try:
+                self.queue.put(data, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        if self.compressor is not None:
+            data = self.compressor.flush()
+            if data:
+                self.buffer.append(data)
+        self.flush()
+
+
+def write(pipe, files, format, compresslevel):
+    if format == 'zip':
+        with zipfile.ZipFile(pipe, 'w', allowZip64=True) as archive:
+            #not passed to the constructor as the compresslevel argument requires Python 3.7, which applies the attribute to every member written; older versions ignore it and use the default level
+            archive.compresslevel = compresslevel if compresslevel > 0 else None
+            for archivename, filename, _ in files:
+                if compresslevel > 0 and not archivename.lower().endswith(COMPRESSEDEXTENSIONS):
+                    archive.write(filename, archivename, compress_type=zipfile.ZIP_DEFLATED)
+                else:
+                    archive.write(filename, archivename, compress_type=zipfile.ZIP_STORED)
+    else:
+        #compression is handled by the pipe, tarfile's own stream mode does not allow setting the compression level
+        with tarfile.open(fileobj=pipe, mode='w|', dereference=True) as archive:
+            for archivename, filename, _ in files:
+                archive.add(filename, archivename, recursive=False)
+    pipe.close()
+
+def stream(files, format, compresslevel=6, log=None):
+    """Generator yielding an archive (zip, tar.gz or tar.bz2) of the specified files (as returned by listfiles()) in chunks, while it is being built. A compression level of 0 stores the files without compression"""
+    if format == 'tar.gz':
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31) #gzip container
+    elif format == 'tar.bz2':
+        compressor = bz2.BZ2Compressor(max(1, compresslevel)) #bzip2 has no store-only level
+    elif format == 'zip':
+        compressor = None
+    else:
+        raise ValueError("Invalid archive format: " + format)
+
+    q = queue.Queue(maxsize=16) #bounds the amount of data buffered if the client is slower than we are
+    pipe = Pipe(q, compressor)
+
+    def run():
+        try:
+            write(pipe, files, format, compresslevel)
+        except Exception as e: #pylint: disable=broad-except
+            if log and not pipe.aborted:
+                log("Error whilst generating archive: " + str(e))
+        finally:
+            try:
+                pipe.put(None)
+            except IOError:
+                pass
+
+    thread = threading.Thread(target=run, name="ArchiveWriter", daemon=True)
+    thread.start()
+    try:
+        while True:
+            data = q.get()
+            if data is None:
+                break
+            yield data
+    finally:
+        #the client may have disconnected, stop the writer
+        pipe.aborted = True
+        thread.join()
+
+
+def membername(name):
+    """Returns the base name of an archive member that may be extracted, or None if it is to be skipped: absolute names, names with parent directory components and hidden files (such as __MACOSX/._*) are"""
+    name = name.replace('\\','/')
+    parts = name.split('/')
+    if name.startswith('/') or '..' in parts or not parts[-1] or parts[-1][0] == '.' or '__MACOSX' in parts:
+        return None
+    return parts[-1]
+
+def extract(source, format, target, log=None):
+    """Extracts the regular files from a zip or tar archive (tar, tar.gz or tar.bz2) in-process. Source is a filename or file object, it only needs to be seekable for zip archives as tar archives are read as a stream. Each member is written to the path returned by target(basename), in archive order, members are skipped if it returns None. Only the base names of members are used, directories, links and other special members are skipped, so nothing is written outside the paths target returns. Returns the list of (basename, path) tuples of the extracted files"""
+    extracted = []
+    if format == 'zip':
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                name = membername(info.filename)
+                mode = info.external_attr >> 16 #unix mode, if any; symbolic links are stored as members with S_IFLNK
+                if info.filename.endswith('/') or name is None or (stat.S_IFMT(mode) and not stat.S_ISREG(mode)):
+                    if log and not info.filename.endswith('/'): log("Skipping archive member " + info.filename)
+                    continue
+                path = target(name)
+                if path is None:
+                    continue
+                with archive.open(info) as src, open(path,'wb') as dst:
+                    shutil.copyfileobj(src, dst, CHUNKSIZE)
+                extracted.append( (name, path) )
+    elif format in ('tar','tar.gz','tar.bz2'):
+        mode = 'r|' + { 'tar': '', 'tar.gz': 'gz', 'tar.bz2': 'bz2' }[format]
+        if isinstance(source, str):
+            archive = tarfile.open(source, mode=mode)
+        else:
+            archive = tarfile.open(fileobj=source, mode=mode)
+        with archive:
+            for member in archive:
+                name = membername(member.name)
+                if not member.isfile() or name is None:
+                    if log and not member.isdir(): log("Skipping archive member " + member.name)
+                    continue
+                path = target(name)
+                if path is None:
+                    continue
+                with archive.extractfile(member) as src, open(path,'wb') as dst:
+                    shutil.copyfileobj(src, dst, CHUNKSIZE)
+                extracted.append( (name, path) )
+    else:
+        raise ValueError("Invalid archive format: " + format)
+    return extracted
@@ -0,0 +1,310 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- CLAM Asynchronous Client  --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Asynchronous counterpart of the CLAM Client API, based on asyncio and aiohttp (install with ``pip install clam[async]``). Useful for clients that drive many projects at once: all requests share one connection pool and the number of concurrent requests is bounded. Responses are parsed exactly as in the synchronous client, into ``CLAMData`` instances."""
+
+import os
+import ssl
+import json
+import time
+import hashlib
+import asyncio
+import urllib.request
+from urllib.parse import urlsplit
+import certifi
+import aiohttp
+
+import clam.common.status
+import clam.common.data
+import clam.common.jsonapi
+from clam.common.client import CLAMClient
+
+CHUNKSIZE = 64 * 1024
+
+class DigestAuth:
+    """HTTP digest access authentication (RFC 7616, qop=auth or none) for the asynchronous client. The challenge is kept, so subsequent requests authenticate right away with an increasing nonce count"""
+
+    HASHES = {'MD5': hashlib.md5, 'SHA-256': hashlib.sha256}
+
+    def __init__(self, user, password):
+        self.user = user
+        self.password = password
+        self.challenge = None
+        self.nc = 0 #nonce count, for the nonce of the current challenge
+
+    def challenged(self, challenge):
+        """Takes a digest challenge (the value of a WWW-Authenticate header, starting with 'Digest'), returns False if it is not supported"""
+        challenge = urllib.request.parse_keqv_list(urllib.request.parse_http_list(challenge[7:]))
+        if 'nonce' not in challenge or challenge.get('algorithm','MD5').upper().replace('-SESS','') not in self.HASHES:
+            return False
+        if 'qop' in challenge and 'auth' not in [ qop.strip() for qop in challenge['qop'].split(',') ]:
+            return False #only auth-int is offered
+        if self.challenge is None or challenge['nonce'] != self.challenge['nonce']:
+            self.nc = 0
+        self.challenge = challenge
+        return True
+
+    def header(self, method, url, cnonce=None):
+        """Returns the value of the Authorization header for a request, the current challenge must be set"""
+        algorithm = self.challenge.get('algorithm','MD5')
+        def h(data):
+            return self.HASHES[algorithm.upper().replace('-SESS','')](data.encode('utf-8')).hexdigest()
+        url = urlsplit(url)
+        uri = (url.path or '/') + ('?' + url.query if url.query else '')
+        nonce = self.challenge['nonce']
+        self.nc += 1
+        nc = "%08x" % self.nc
+        if cnonce is None:
+            cnonce = os.urandom(16).hex()
+        ha1 = h(self.user + ':' + self.challenge.get('realm','') + ':' + self.password)
+        if algorithm.upper().endswith('-SESS'):
+            ha1 = h(ha1 + ':' + nonce + ':' + cnonce)
+        ha2 = h(method + ':' + uri)
+        fields = [('username', self.user), ('realm', self.challenge.get('realm','')), ('nonce', nonce), ('uri', uri)]
+        if 'qop' in self.challenge:
+            fields.append(('response', h(ha1 + ':' + nonce + ':' + nc + ':' + cnonce + ':auth:' + ha2)))
+        else:
+            fields.append(('response', h(ha1 + ':' + nonce + ':' + ha2)))
+        if 'opaque' in self.challenge:
+            fields.append(('opaque', self.challenge['opaque']))
+        header = 'Digest ' + ', '.join( key + '="' + value.replace('\\','\\\\').replace('"','\\"') + '"' for key, value in fields )
+        header += ', algorithm=' + algorithm
+        if 'qop' in self.challenge:
+            header += ', qop=auth, nc=' + nc + ', cnonce="' + cnonce + '"'
+        return header
+
+class AsyncCLAMClient:
+    def __init__(self, url, user=None, password=None, oauth=False, oauth_access_token=None, verify=None, basicauth=False, jsonapi=True, concurrency=10, timeout=None):
+        """Initialise the asynchronous CLAM client (does not actually connect yet). Use it as an asynchronous context manager, or call ``close()`` when done::
+
+            async with AsyncCLAMClient("http://localhost:8080") as client:
+                await client.create("myprojectname")
+
+        The arguments are as for ``CLAMClient``, in addition:
+
+        * ``concurrency`` - Maximum number of requests in progress at the same time (int)
+        * ``timeout`` - Total timeout in seconds for a single request, None waits indefinitely
+
+        The ``CLAMData`` instances returned do not load file metadata. Their ``CLAMFile`` instances use a synchronous ``CLAMClient`` (``self.client``) with the same configuration, should you want to use them directly.
+        """
+        self.client = CLAMClient(url, user, password, oauth, oauth_access_token, verify, False, basicauth, jsonapi) #used for parsing responses, does not connect unless used directly
+        self.url = self.client.url
+        self.jsonapi = jsonapi
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.session = None #created on first use, as it needs to be bound to the running event loop
+        #aiohttp can't choose digest authentication when a service offers multiple schemes, we handle the challenges ourselves
+        self.digest = DigestAuth(self.client.user, self.client.password) if self.client.authenticated and not self.client.basicauth else None
+
+    def _getsession(self):
+        """Returns the HTTP session, created on first use. For internal use"""
+        if self.session is None:
+            verify = self.client.verify
+            if verify is False:
+                sslcontext = False
+            elif os.path.isdir(verify):
+                sslcontext = ssl.create_default_context(capath=verify)
+            else:
+                sslcontext = ssl.create_default_context(cafile=verify if isinstance(verify, str) else certifi.where())
+            auth = None
+            if self.client.authenticated and self.client.basicauth:
+                auth = aiohttp.BasicAuth(self.client.user, self.client.password)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, ssl=sslcontext),
+                auth=auth,
+                headers=self.client.initauth(),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self.session
+
+    async def _send(self, method, url, data=None, headers=None):
+        """Sends a request to the service and returns the response, to be used as an asynchronous context manager. Handles digest authentication challenges, data may be a function producing the request body so it can be sent again after a challenge. For internal use"""
+        headers = dict(headers) if headers else {}
+        for attempt in range(2):
+            if self.digest is not None and self.digest.challenge is not None:
+                headers['Authorization'] = self.digest.header(method, self.url + url)
+            r = await self._getsession().request(method, self.url + url, data=data() if callable(data) else data, headers=headers)
+            if r.status != 401 or self.digest is None or attempt > 0:
+                return r
+            if not any( self.digest.challenged(value) for value in r.headers.getall('WWW-Authenticate', []) if value[:7].lower() == 'digest ' ):
+                return r #no (supported) digest challenge
+            r.release()
+        return r
+
+    async def close(self):
+        """Closes all connections to the service"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def request(self, url='', method='GET', data=None, parse=True):
+        """Issue a HTTP request and parse the response, this is a low-level function called by all of the higher-level communication methods in this class, use those instead"""
+        headers = {}
+        if parse and self.jsonapi:
+            headers['Accept'] = clam.common.jsonapi.MIMETYPE + ', application/xml;q=0.9, text/xml;q=0.9'
+        async with self.semaphore:
+            async with await self._send(method, url, data, headers) as r:
+                content = await r.text()
+                contenttype = r.headers.get('Content-Type')
+                statuscode = r.status
+        if parse:
+            await self.getspec(contenttype)
+        self.client._checkstatus(statuscode, content, contenttype, parse, method, url, data) #pylint: disable=protected-access
+        if parse:
+            return self.client._parse(content, contenttype) #pylint: disable=protected-access
+        return content
+
+    async def getspec(self, contenttype=None):
+        """Returns a ``CLAMData`` instance holding the specification of the service, which the JSON representation does not include. It is retrieved only once, and only if a JSON response (with the specified content type) is to be parsed"""
+        if self.client.spec is None and (contenttype is None or contenttype.startswith(clam.common.jsonapi.MIMETYPE)):
+            try:
+                content = await self.request('spec/', parse=False)
+            except clam.common.data.NotFound:
+                #older services do not offer the specification separately
+                content = await self.request('porch/', parse=False)
+            self.client.spec = self.client._parse(content) #pylint: disable=protected-access
+        return self.client.spec
+
+    async def index(self):
+        """Get index of projects. Returns a ``CLAMData`` instance. Use CLAMData.projects for the index of projects."""
+        return await self.request('index/')
+
+    async def porch(self):
+        """Get the porch page, basically a stripped-down response that works without authentication."""
+        return await self.request('porch/')
+
+    async def get(self, project):
+        """Query the project status. Returns a ``CLAMData`` instance or raises an exception according to the returned HTTP Status code"""
+        data = await self.request(project + '/')
+        if not isinstance(data, clam.common.data.CLAMData):
+            raise Exception("Unable to retrieve CLAM Data")
+        return data
+
+    async def progress(self, project, since=0, wait=0):
+        """Query the progress of a project, see ``CLAMClient.progress()``"""
+        return json.loads(await self.request(project + '/progress/?since=' + str(since) + '&wait=' + str(wait), parse=False))
+
+    async def wait(self, project, interval=30, mininterval=1):
+        """Waits until the project has finished, see ``CLAMClient.wait()``. Returns a ``CLAMData`` instance with the final state of the project, or with its current state if it is not running or queued"""
+        progress = await self.progress(project)
+        while progress['status'] in (clam.common.status.RUNNING, clam.common.status.QUEUED):
+            begintime = time.time()
+            progress = await self.progress(project, progress['offset'], wait=interval)
+            if progress['status'] in (clam.common.status.RUNNING, clam.common.status.QUEUED): #the service may have responded without waiting
+                await asyncio.sleep(max(0, mininterval - (time.time() - begintime)))
+        return await self.get(project)
+
+    async def create(self, project):
+        """Create a new project"""
+        return await self.request(project + '/', 'PUT')
+
+    async def start(self, project, **parameters):
+        """Start a run, see ``CLAMClient.start()``. Note that no exceptions are raised on parameter errors, use ``startsafe()`` for that"""
+        for key in parameters:
+            if isinstance(parameters[key],list) or isinstance(parameters[key],tuple):
+                parameters[key] = ",".join(parameters[key])
+        return await self.request(project + '/', 'POST', parameters)
+
+    async def startsafe(self, project, **parameters):
+        """Start a run, raises ``ParameterError`` on parameter errors"""
+        data = await self.start(project, **parameters)
+        for _, paramlist in data.parameters:
+            for parameter in paramlist:
+                if parameter.error:
+                    raise clam.common.data.ParameterError(parameter.error)
+        return data
+
+    async def delete(self, project):
+        """Aborts and deletes a project"""
+        return await self.request(project + '/', 'DELETE')
+
+    async def abort(self, project):
+        """Aborts and deletes a project (alias of delete())"""
+        return await self.delete(project)
+
+    async def _inputtemplate(self, project, inputtemplate):
+        """Returns the InputTemplate instance, given an instance or its ID. For internal use"""
+        if isinstance(inputtemplate, str):
+            data = await self.get(project) #causes an extra query to server
+            return data.inputtemplate(inputtemplate)
+        elif not isinstance(inputtemplate, clam.common.data.InputTemplate):
+            raise Exception("inputtemplate must be instance of InputTemplate. Get from CLAMData.inputtemplate(id)")
+        return inputtemplate
+
+    async def _upload(self, project, inputtemplate, filename, fields, kwargs):
+        """Posts an input file, given a list of (name, value, options) tuples for the form fields, along with the metadata from the keyword arguments. Files are passed as functions opening them, as they are closed once sent and the form may have to be sent again after an authentication challenge. For internal use"""
+        fields.append( ('inputtemplate', inputtemplate.id, {}) )
+        for key, value in kwargs.items():
+            if key == 'filename':
+                pass #nothing to do
+            elif key == 'metadata':
+                assert isinstance(value, clam.common.data.CLAMMetaData)
+                fields.append( ('metadata', value.xml(), {}) )
+            elif key == 'metafile':
+                fields.append( ('metafile', lambda metafile=value: open(metafile,'rb'), {'filename': '.' + filename + '.METADATA', 'content_type': 'text/xml'}) )
+            else:
+                fields.append( (key, str(value), {}) )
+
+        def formdata():
+            data = aiohttp.FormData()
+            for name, value, options in fields:
+                data.add_field(name, value() if callable(value) else value, **options)
+            return data
+
+        url = project + '/input/' + filename
+        async with self.semaphore:
+            async with await self._send('POST', url, formdata) as r:
+                content = await r.text()
+                statuscode = r.status
+        return self.client._processupload(statuscode, content, url) #pylint: disable=protected-access
+
+    async def addinputfile(self, project, inputtemplate, sourcefile, **kwargs):
+        """Add/upload an input file to the CLAM service, see ``CLAMClient.addinputfile()``. The file is streamed"""
+        inputtemplate = await self._inputtemplate(project, inputtemplate)
+        filename = self.client.getinputfilename(inputtemplate, kwargs.get('filename', os.path.basename(sourcefile)))
+        return await self._upload(project, inputtemplate, filename, [('file', lambda: open(sourcefile,'rb'), {'filename': filename, 'content_type': inputtemplate.formatclass.mimetype})], kwargs)
+
+    async def addinput(self, project, inputtemplate, contents, **kwargs):
+        """Add an input file to the CLAM service, explicitly providing the contents as a string, see ``CLAMClient.addinput()``"""
+        inputtemplate = await self._inputtemplate(project, inputtemplate)
+        if 'filename' not in kwargs:
+            raise Exception("No filename provided!")
+        filename = self.client.getinputfilename(inputtemplate, kwargs['filename'])
+        return await self._upload(project, inputtemplate, filename, [('contents', contents, {})], kwargs)
+
+    async def _copy(self, url, targetfilename):
+        """Downloads the specified URL (relative to the service) to a local file, in chunks. For internal use"""
+        async with self.semaphore:
+            async with await self._send('GET', url) as r:
+                if r.status != 200:
+                    self.client._checkstatus(r.status, await r.text(), r.headers.get('Content-Type'), False, 'GET', url, True) #pylint: disable=protected-access
+                with open(targetfilename,'wb') as f:
+                    async for chunk in r.content.iter_chunked(CHUNKSIZE):
+                        f.write(chunk)
+
+    async def download(self, project, filename, targetfilename):
+        """Download an output file"""
+        await self._copy(project + '/output/' + filename, targetfilename)
+
+    async def downloadarchive(self, project, targetfilename, archiveformat='zip'):
+        """Download all output files as a single archive (zip, tar.gz or tar.bz2)"""
+        await self._copy(project + '/output/' + archiveformat, targetfilename)
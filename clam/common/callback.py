@@ -0,0 +1,138 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Completion callbacks --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Completion callbacks. When a project is started with a callback URL, the dispatcher posts the final state of the project (status, exit code and output files) to that URL once the project has finished, so clients need not poll for it. The callback URL is stored in the project directory, as the dispatcher may run on another host than the webservice."""
+
+import os
+import json
+import time
+import hmac
+import hashlib
+import urllib.parse
+import urllib.request
+import urllib.error
+
+import clam.common.status
+import clam.common.manifest
+import clam.common.jsonapi
+
+CALLBACKFILE = '.callback'
+
+def splitorigin(url):
+    """Splits a URL into its scheme, host name, port (None if the URL has an empty port, standing for any port) and path. Returns None if the URL is not an HTTP(S) URL with a host name, or carries user information (user@host), which could be used to disguise the actual host"""
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    if parts.scheme not in ('http','https') or not parts.hostname or '@' in parts.netloc:
+        return None
+    if port is None and not parts.netloc.endswith(':'):
+        port = 443 if parts.scheme == 'https' else 80
+    return parts.scheme, parts.hostname, port, parts.path
+
+def allowed(url, allow):
+    """Checks whether a callback may be posted to the specified URL, allow is the ALLOWCALLBACKS setting: True to allow any HTTP(S) URL, or a list of allowed URLs. The URL has to have the scheme, host and port of one of them (any port if its port is empty, e.g. http://localhost:), and its path has to start with the path of that URL"""
+    if not allow or not isinstance(url, str):
+        return False
+    origin = splitorigin(url)
+    if origin is None or origin[2] is None:
+        return False
+    if allow is True:
+        return True
+    for allowedurl in allow:
+        allowedorigin = splitorigin(allowedurl)
+        if allowedorigin is not None and origin[:2] == allowedorigin[:2] and allowedorigin[2] in (None, origin[2]) and origin[3].startswith(allowedorigin[3]):
+            return True
+    return False
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Refuses to follow redirects, so a callback can not be redirected to a URL that is not allowed"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+def register(projectpath, url, projecturl):
+    """Stores the callback URL for the project, replacing any previous one. If url is None, the callback is removed"""
+    filename = os.path.join(projectpath, CALLBACKFILE)
+    if url is None:
+        if os.path.exists(filename):
+            os.unlink(filename)
+        return
+    with open(filename,'w',encoding='utf-8') as f:
+        json.dump({'url': url, 'project': projecturl}, f)
+
+def load(projectpath):
+    """Returns the stored callback (a dictionary with the callback url and project url), or None if there is none"""
+    try:
+        with open(os.path.join(projectpath, CALLBACKFILE),'r',encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def signature(data, secret):
+    """Computes the signature of the callback body, allowing the receiver to verify the callback originates from the service"""
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), data, hashlib.sha256).hexdigest()
+
+def payload(projectpath, projecturl, exitcode, profiles=None):
+    """Returns the body of the callback, describing the final state of the project"""
+    statuslog, completion = clam.common.status.StatusLogCache(1).read(os.path.join(projectpath, '.status'), 1)
+    data = {
+        'version': clam.common.jsonapi.VERSION,
+        'project': os.path.basename(projectpath.rstrip('/')),
+        'url': projecturl,
+        'status': clam.common.status.DONE,
+        'statusmessage': statuslog[0][0] if statuslog else "",
+        'completion': completion,
+        'exitcode': exitcode,
+        'aborted': os.path.exists(os.path.join(projectpath, '.aborted')),
+    }
+    if profiles is not None:
+        data['outputfiles'] = clam.common.jsonapi.files(clam.common.manifest.get(projectpath, 'output', profiles, settle=0))
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+def post(url, data, retries=5, timeout=10, secret=None, backoff=1.0, log=None):
+    """Posts the callback body (JSON) to the URL. Failed attempts (connection errors, server errors and rate limiting) are retried up to the specified number of times, with exponential backoff. Returns True if the callback was accepted"""
+    headers = {'Content-Type': clam.common.jsonapi.MIMETYPE, 'User-Agent': 'CLAM'}
+    if secret:
+        headers['X-CLAM-Signature'] = signature(data, secret)
+    opener = urllib.request.build_opener(NoRedirectHandler)
+    attempt = 0
+    while True:
+        try:
+            with opener.open(urllib.request.Request(url, data=data, headers=headers, method='POST'), timeout=timeout) as response:
+                response.read()
+            return True
+        except urllib.error.HTTPError as e:
+            if e.code < 500 and e.code != 429: #redirects (3xx) end up here as well
+                if log: log("Callback to " + url + " refused: HTTP " + str(e.code))
+                return False
+            error = "HTTP " + str(e.code)
+        except (urllib.error.URLError, OSError) as e:
+            error = str(e)
+        if attempt >= retries:
+            if log: log("Callback to " + url + " failed, giving up after " + str(attempt+1) + " attempts: " + error)
+            return False
+        delay = backoff * 2 ** attempt
+        if log: log("Callback to " + url + " failed (" + error + "), retrying in " + str(delay) + "s")
+        time.sleep(delay)
+        attempt += 1
+
+def notify(projectpath, exitcode, profiles=None, retries=5, timeout=10, secret=None, log=None):
+    """Posts the final state of the project to its callback URL, if one was registered. Returns None if there is no callback, otherwise whether it succeeded"""
+    callback = load(projectpath)
+    if callback is None:
+        return None
+    return post(callback['url'], payload(projectpath, callback.get('project'), exitcode, profiles), retries, timeout, secret, log=log)
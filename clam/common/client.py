@@ -18,8 +18,12 @@
 
 import os.path
 import sys
+import json
+import time
 import requests
+import requests.adapters
 import certifi
+from urllib3.util.retry import Retry
 from requests_toolbelt import MultipartEncoder #pylint: disable=import-error
 from lxml import etree as ElementTree
 from io import StringIO, IOBase, BytesIO  #pylint: disable=import-error,unused-import
@@ -28,6 +32,7 @@ import clam.common.status
 import clam.common.parameters
 import clam.common.formats
 import clam.common.data
+import clam.common.jsonapi
 
 
 #for debug of requests:
@@ -40,7 +45,7 @@ def donereadingupload(encoder):
     pass
 
 class CLAMClient:
-    def __init__(self, url, user=None, password=None, oauth=False, oauth_access_token=None,verify=None, loadmetadata=False, basicauth=False):
+    def __init__(self, url, user=None, password=None, oauth=False, oauth_access_token=None,verify=None, loadmetadata=False, basicauth=False, jsonapi=True, poolsize=10, retries=3, timeout=None, chunkthreshold=64, chunksize=8):
         """Initialise the CLAM client (does not actually connect yet)
 
         * ``url`` - URL of the webservice
@@ -56,6 +61,14 @@ class CLAMClient:
            Follows the syntax of the requests library (http://docs.python-requests.org/en/master/user/advanced/#ssl-cert-verification)
         * ``loadmetadata`` - Automatically download and load all relevant metadata
         * ``basicauth`` - Do HTTP Basic Authentication instead of HTTP Digest Authentication (boolean)
+        * ``jsonapi`` - Ask the service for the JSON representation rather than CLAM XML, services that do not offer it respond with CLAM XML as before (boolean)
+        * ``poolsize`` - Maximum number of connections to the service that are kept open for reuse (int)
+        * ``retries`` - Number of times requests that can safely be repeated (not uploads or starting a project) are retried on connection errors and temporary server errors, with backoff (int)
+        * ``timeout`` - Timeout in seconds for connecting and for waiting on the service, either a single number or a (connect, read) tuple. None waits indefinitely
+        * ``chunkthreshold`` - Input files larger than this (in MB) are uploaded in chunks, so an interrupted upload resumes where it left off rather than starting over, 0 to disable (int)
+        * ``chunksize`` - Size of the chunks (in MB) (int)
+
+        All requests, including those by the ``CLAMFile`` instances the client creates, share a single session, so connections (and digest authentication) are reused rather than renegotiated for every request. Use ``close()``, or the client as a context manager, to close them.
         """
 
         #self.http = httplib2.Http()
@@ -68,26 +81,51 @@ class CLAMClient:
             self.verify = certifi.where()
         else:
             self.verify = verify
+        self.timeout = timeout
+        self.retries = retries
+        self.chunkthreshold = chunkthreshold
+        self.chunksize = chunksize
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=poolsize, pool_maxsize=poolsize, max_retries=Retry(total=retries, backoff_factor=0.5, status_forcelist=(502, 503, 504), raise_on_status=False))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.auth = None
         if user and password:
             self.authenticated = True
             self.user = user
             self.password = password
             self.oauth = False
             self.initauth()
+            #a single authentication object is reused for all requests, so digest authentication need not be renegotiated each time
+            if self.basicauth:
+                self.auth = requests.auth.HTTPBasicAuth(self.user, self.password)
+            else:
+                self.auth = requests.auth.HTTPDigestAuth(self.user, self.password)
         else:
             self.authenticated = False
             self.user = None
             self.password = None
             self.initauth()
         self.loadmetadata = loadmetadata
+        self.jsonapi = jsonapi
+        self.spec = None #service specification, retrieved once when needed for the JSON representation
+
+    def close(self):
+        """Closes all connections to the service"""
+        self.session.close()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def initauth(self):
         """Initialise authentication, for internal use"""
         headers = {'User-agent': 'CLAMClientAPI-' + clam.common.data.VERSION}
         if self.oauth:
             if not self.oauth_access_token:
-                r = requests.get(self.url,headers=headers, verify=self.verify)
+                r = self.session.get(self.url,headers=headers, verify=self.verify, timeout=self.timeout)
                 if r.status_code == 404:
                     raise clam.common.data.NotFound("Authorization provider not found")
                 elif r.status_code == 403:
@@ -117,43 +155,50 @@ class CLAMClient:
 
     def initrequest(self, data=None):
         params = {'headers': self.initauth() }
-        if self.authenticated and not self.oauth:
-            if self.basicauth:
-                params['auth'] = requests.auth.HTTPBasicAuth(self.user, self.password)
-            else:
-                params['auth'] = requests.auth.HTTPDigestAuth(self.user, self.password)
+        if self.auth is not None:
+            params['auth'] = self.auth
         if data:
             params['data'] = data
         params['verify'] = self.verify
+        params['timeout'] = self.timeout
         return params
 
     def request(self, url='', method = 'GET', data = None, parse=True, encoding=None):
         """Issue a HTTP request and parse CLAM XML response, this is a low-level function called by all of the higher-level communication methods in this class, use those instead"""
 
         requestparams = self.initrequest(data)
-
+        if parse and self.jsonapi:
+            requestparams['headers']['Accept'] = clam.common.jsonapi.MIMETYPE + ', application/xml;q=0.9, text/xml;q=0.9'
 
         if method == 'POST':
-            request = requests.post
+            request = self.session.post
         elif method == 'DELETE':
-            request = requests.delete
+            request = self.session.delete
         elif method == 'PUT':
-            request = requests.put
+            request = self.session.put
         else:
-            request = requests.get
+            request = self.session.get
 
         r = request(self.url + url,**requestparams)
         if encoding is not None:
             r.encoding = encoding
 
-        if r.status_code == 400:
+        self._checkstatus(r.status_code, r.text, r.headers.get('Content-Type'), parse, method, url, data)
+
+        if parse:
+            return self._parse(r.text, r.headers.get('Content-Type'))
+        else:
+            return r.text
+
+    def _checkstatus(self, statuscode, content, contenttype=None, parse=True, method='GET', url='', data=None):
+        """Raises the appropriate exception if the HTTP status code of a response indicates an error. For internal use"""
+        if statuscode == 400:
             raise clam.common.data.BadRequest()
-        elif r.status_code == 401:
+        elif statuscode == 401:
             raise clam.common.data.AuthRequired()
-        elif r.status_code == 403: #pylint: disable=too-many-nested-blocks
-            content = r.text
+        elif statuscode == 403: #pylint: disable=too-many-nested-blocks
             if parse:
-                data = self._parse(content)
+                data = self._parse(content, contenttype)
                 if data is True:
                     #response is not XML
                     raise clam.common.data.PermissionDenied(content)
@@ -172,26 +217,28 @@ class CLAMClient:
                     raise clam.common.data.PermissionDenied(content)
             else:
                 raise clam.common.data.PermissionDenied(content)
-        elif r.status_code == 404 and data:
-            raise clam.common.data.NotFound(r.text)
-        elif r.status_code == 500:
-            raise clam.common.data.ServerError(r.text)
-        elif r.status_code == 405:
+        elif statuscode == 404 and data:
+            raise clam.common.data.NotFound(content)
+        elif statuscode == 500:
+            raise clam.common.data.ServerError(content)
+        elif statuscode == 405:
             raise clam.common.data.ServerError("Server returned 405: Method not allowed for " + method + " on " + self.url + url)
-        elif r.status_code == 408:
+        elif statuscode == 408:
             raise clam.common.data.TimeOut()
-        elif not (r.status_code >= 200 and r.status_code <= 299):
-            raise Exception("An error occured, return code " + str(r.status_code))
+        elif not (statuscode >= 200 and statuscode <= 299):
+            raise Exception("An error occured, return code " + str(statuscode))
 
-        if parse:
-            return self._parse(r.text)
-        else:
-            return r.text
 
-
-    def _parse(self, content):
-        """Parses CLAM XML data and returns a ``CLAMData`` object. For internal use. Raises `ParameterError` exception on parameter errors."""
-        if content.lower().find('<clam') != -1:
+    def _parse(self, content, contenttype=None):
+        """Parses CLAM XML data or its JSON representation and returns a ``CLAMData`` object. For internal use. Raises `ParameterError` exception on parameter errors."""
+        if contenttype and contenttype.startswith(clam.common.jsonapi.MIMETYPE):
+            data = clam.common.data.CLAMData(json.loads(content), self, loadmetadata=self.loadmetadata, spec=self.getspec())
+            if data.errors:
+                error = data.parametererror()
+                if error:
+                    raise clam.common.data.ParameterError(error)
+            return data
+        elif content.lower().find('<clam') != -1:
             data = clam.common.data.CLAMData(content,self, loadmetadata=self.loadmetadata)
             if data.errors:
                 error = data.parametererror()
@@ -201,6 +248,16 @@ class CLAMClient:
         else:
             return True
 
+    def getspec(self):
+        """Returns a ``CLAMData`` instance holding the specification of the service (profiles, parameters, formats), which the JSON representation does not include. It is retrieved only once."""
+        if self.spec is None:
+            try:
+                self.spec = self.request('spec/')
+            except clam.common.data.NotFound:
+                #older services do not offer the specification separately
+                self.spec = self.request('porch/')
+        return self.spec
+
     def getroot(self):
         """This calls the root of the webservice, providing either the index or the porch, depending whether or not authentication is necessary and credentials are passed.
 
@@ -228,6 +285,31 @@ class CLAMClient:
             return data
 
 
+    def progress(self, project, since=0, wait=0):
+        """Query the progress of a project, this is much cheaper than ``get()``. Returns a dictionary with the ``status``, ``statusmessage``, ``completion``,
+        the status ``log`` entries ([message, time, completion], oldest first) following the first ``since`` ones, and the ``offset`` to pass as ``since`` on the next call to obtain only new entries.
+        If ``wait`` is set, the service waits up to that many seconds for new entries or a change of status before responding::
+
+            progress = client.progress("myprojectname")
+            while progress['status'] != clam.common.status.DONE:
+                progress = client.progress("myprojectname", progress['offset'], wait=30)
+        """
+        return json.loads(self.request(project + '/progress/?since=' + str(since) + '&wait=' + str(wait), parse=False))
+
+    def wait(self, project, interval=30, mininterval=1):
+        """Waits until the project has finished, following its progress by long polling (``interval`` is the maximum number of seconds per request, ``mininterval`` the minimum number of seconds between requests, in case the service responds without waiting). Returns a ``CLAMData`` instance with the final state of the project, or with its current state if it is not running or queued (it was never started)::
+
+            client.start("myprojectname")
+            data = client.wait("myprojectname")
+        """
+        progress = self.progress(project)
+        while progress['status'] in (clam.common.status.RUNNING, clam.common.status.QUEUED):
+            begintime = time.time()
+            progress = self.progress(project, progress['offset'], wait=interval)
+            if progress['status'] in (clam.common.status.RUNNING, clam.common.status.QUEUED): #the service may have responded without waiting
+                time.sleep(max(0, mininterval - (time.time() - begintime)))
+        return self.get(project)
+
     def create(self,project):
         """Create a new project::
 
@@ -319,7 +401,7 @@ class CLAMClient:
         """
         if isinstance(targetfile,str): #pylint: disable=undefined-variable
             targetfile = open(targetfile,'wb')
-        r = requests.get(self.url + project + '/output/' + archiveformat,**self.initrequest())
+        r = self.session.get(self.url + project + '/output/' + archiveformat, stream=True, **self.initrequest())
         CHUNK = 16 * 1024
         for chunk in r.iter_content(chunk_size=CHUNK):
             if chunk: # filter out keep-alive new chunks
@@ -372,6 +454,31 @@ class CLAMClient:
         return True
 
 
+    def _processupload(self, statuscode, content, url):
+        """Processes the response to an upload, raises the appropriate exception on errors. For internal use"""
+        if statuscode == 400:
+            raise clam.common.data.BadRequest()
+        elif statuscode == 401:
+            raise clam.common.data.AuthRequired()
+        elif statuscode == 403:
+            if content[0] == '<':
+                #XML response
+                return self._parseupload(content)
+            else:
+                raise clam.common.data.PermissionDenied(content)
+        elif statuscode == 404:
+            raise clam.common.data.NotFound(content)
+        elif statuscode == 500:
+            raise clam.common.data.ServerError(content)
+        elif statuscode == 405:
+            raise clam.common.data.ServerError("Server returned 405: Method not allowed for POST on " + self.url + url)
+        elif statuscode == 408:
+            raise clam.common.data.TimeOut()
+        elif not (statuscode >= 200 and statuscode <= 299):
+            raise Exception("An error occured, return code " + str(statuscode))
+
+        return self._parseupload(content)
+
     def addinputfile(self, project, inputtemplate, sourcefile, **kwargs):
         """Add/upload an input file to the CLAM service. Supports proper file upload streaming.
 
@@ -386,6 +493,8 @@ class CLAMClient:
 
         Any other keyword arguments will be passed as metadata and matched with the input template's parameters.
 
+        Files larger than ``chunkthreshold`` (see the constructor) are uploaded in chunks, if the service supports it. Chunks that fail to be sent are sent again, so the upload survives connection problems.
+
         Example::
 
             client.addinputfile("myproject", "someinputtemplate", "/path/to/local/file")
@@ -402,11 +511,15 @@ class CLAMClient:
             raise Exception("inputtemplate must be instance of InputTemplate. Get from CLAMData.inputtemplate(id)")
 
         if not isinstance(sourcefile, IOBase):
-            sourcefile = open(sourcefile,'rb')
             if 'filename' in kwargs:
                 filename = self.getinputfilename(inputtemplate, kwargs['filename'])
             else:
-                filename = self.getinputfilename(inputtemplate, os.path.basename(sourcefile.name) )
+                filename = self.getinputfilename(inputtemplate, os.path.basename(sourcefile) )
+            if self.chunkthreshold and os.path.getsize(sourcefile) > self.chunkthreshold * 1024 * 1024:
+                result = self._addinputfilechunked(project, inputtemplate, sourcefile, filename, kwargs)
+                if result is not None:
+                    return result
+            sourcefile = open(sourcefile,'rb')
 
         data = {"file": (filename,sourcefile,inputtemplate.formatclass.mimetype), 'inputtemplate': inputtemplate.id}
         for key, value in kwargs.items():
@@ -435,32 +548,104 @@ class CLAMClient:
             encodeddata = MultipartEncoder(fields=requestparams['data']) #from requests-toolbelt, necessary for streaming support
             requestparams['data'] = encodeddata
             requestparams['headers']['Content-Type'] = encodeddata.content_type
-        r = requests.post(self.url + project + '/input/' + filename,**requestparams)
+        r = self.session.post(self.url + project + '/input/' + filename,**requestparams)
         sourcefile.close()
 
-        if r.status_code == 400:
-            raise clam.common.data.BadRequest()
-        elif r.status_code == 401:
-            raise clam.common.data.AuthRequired()
-        elif r.status_code == 403:
-            if r.text[0] == '<':
-                #XML response
-                return self._parseupload(r.text)
-            else:
-                raise clam.common.data.PermissionDenied(r.text)
-        elif r.status_code == 404:
-            raise clam.common.data.NotFound(r.text)
-        elif r.status_code == 500:
-            raise clam.common.data.ServerError(r.text)
-        elif r.status_code == 405:
-            raise clam.common.data.ServerError("Server returned 405: Method not allowed for POST on " + self.url + project + '/input/' + filename)
-        elif r.status_code == 408:
-            raise clam.common.data.TimeOut()
-        elif not (r.status_code >= 200 and r.status_code <= 299):
-            raise Exception("An error occured, return code " + str(r.status_code))
+        return self._processupload(r.status_code, r.text, project + '/input/' + filename)
 
-        return self._parseupload(r.text)
+    def _addinputfilechunked(self, project, inputtemplate, sourcefile, filename, kwargs):
+        """Uploads an input file in chunks using the resumable upload API of the service. When sending a chunk fails, the service is asked what it has received and the upload continues from there. Returns None if the service does not offer resumable uploads. For internal use"""
+        data = {'filename': filename, 'size': os.path.getsize(sourcefile), 'inputtemplate': inputtemplate.id}
+        for key, value in kwargs.items():
+            if key == 'metadata':
+                assert isinstance(value, clam.common.data.CLAMMetaData)
+                data['metadata'] = value.xml()
+            elif key not in ('filename', 'metafile'): #the metafile is sent when finalising
+                data[key] = value
+        r = self.session.post(self.url + project + '/uploads/', **self.initrequest(data))
+        if r.status_code in (404, 405):
+            return None #service does not offer resumable uploads
+        self._checkstatus(r.status_code, r.text, parse=False, method='POST', url=project + '/uploads/', data=data)
+        state = r.json()
+        url = project + '/uploads/' + state['id']
+
+        failures = 0
+        with open(sourcefile,'rb') as f:
+            while state['missing']:
+                begin, end = state['missing'][0]
+                end = min(end, begin + self.chunksize * 1024 * 1024)
+                f.seek(begin)
+                try:
+                    r = self.session.put(self.url + url, params={'offset': begin}, data=f.read(end - begin), **self.initrequest())
+                    if r.status_code == 200:
+                        state = r.json()
+                        failures = 0
+                        continue
+                    elif r.status_code < 500:
+                        self._checkstatus(r.status_code, r.text, parse=False, method='PUT', url=url, data=True)
+                    error = "HTTP " + str(r.status_code)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = str(e)
+                failures += 1
+                if failures > self.retries:
+                    raise clam.common.data.ServerError("Uploading " + filename + " failed: " + error)
+                time.sleep(0.5 * 2 ** failures)
+                try:
+                    #ask the service what it has received, other chunks may have come through after all
+                    r = self.session.get(self.url + url, **self.initrequest())
+                    if r.status_code == 200:
+                        state = r.json()
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    pass
+
+        requestparams = self.initrequest()
+        if 'metafile' in kwargs:
+            requestparams['files'] = [('metafile',('.'+ filename + '.METADATA', open(kwargs['metafile'],'rb'), 'text/xml'))]
+        r = self.session.post(self.url + url, **requestparams)
+        if not (r.status_code >= 200 and r.status_code <= 299):
+            self.session.delete(self.url + url, **self.initrequest()) #the service keeps a rejected upload, we don't reuse it
+        return self._processupload(r.status_code, r.text, url)
+
+    def addinputfiles(self, project, inputtemplate, sourcefiles, **kwargs):
+        """Add/upload multiple input files for the same input template to the CLAM service in a single request. This is considerably faster than calling ``addinputfile()`` for each file when there are many files. The files are streamed.
+
+        project - the ID of the project you want to add the files to.
+        inputtemplate - The input template you want to use to add these files (InputTemplate instance or ID)
+        sourcefiles - The files you want to add: a list of filenames
+
+        Any keyword arguments will be passed as metadata shared by all files, and matched with the input template's parameters. Explicit metadata and archives are not supported, use ``addinputfile()`` for those. Files that are rejected do not prevent the others from being added, but an exception is raised for the first rejected file.
+
+        Example::
 
+            client.addinputfiles("myproject", "someinputtemplate", ["/path/to/local/file1", "/path/to/local/file2"], parameter1="blah")
+
+        """
+        if isinstance( inputtemplate, str): #pylint: disable=undefined-variable
+            data = self.get(project) #causes an extra query to server
+            inputtemplate = data.inputtemplate(inputtemplate)
+        elif not isinstance(inputtemplate, clam.common.data.InputTemplate):
+            raise Exception("inputtemplate must be instance of InputTemplate. Get from CLAMData.inputtemplate(id)")
+
+        files = [ ('file', (self.getinputfilename(inputtemplate, os.path.basename(sourcefile)), open(sourcefile,'rb'), inputtemplate.formatclass.mimetype)) for sourcefile in sourcefiles ]
+        data = [('inputtemplate', inputtemplate.id)] + [ (key, str(value)) for key, value in kwargs.items() ]
+
+        requestparams = self.initrequest()
+        if isinstance(self.auth, requests.auth.HTTPDigestAuth):
+            #a streamed body can't be sent again after the digest authentication challenge, disabling streaming
+            requestparams['data'] = data
+            requestparams['files'] = files
+        else:
+            #streaming support
+            encodeddata = MultipartEncoder(fields=data + files) #from requests-toolbelt, necessary for streaming support
+            requestparams['data'] = encodeddata
+            requestparams['headers']['Content-Type'] = encodeddata.content_type
+        try:
+            r = self.session.post(self.url + project + '/input/', **requestparams)
+        finally:
+            for _, (_, sourcefile, _) in files:
+                sourcefile.close()
+
+        return self._processupload(r.status_code, r.text, project + '/input/')
 
 
     def addinput(self, project, inputtemplate, contents, **kwargs):
@@ -512,30 +697,60 @@ class CLAMClient:
 
 
         requestparams = self.initrequest(data)
-        r = requests.post(self.url + project + '/input/' + filename,**requestparams)
+        r = self.session.post(self.url + project + '/input/' + filename,**requestparams)
 
-        if r.status_code == 400:
-            raise clam.common.data.BadRequest()
-        elif r.status_code == 401:
-            raise clam.common.data.AuthRequired()
-        elif r.status_code == 403:
-            if r.text[0] == '<':
-                #XML response
-                return self._parseupload(r.text)
+        return self._processupload(r.status_code, r.text, project + '/input/' + filename)
+
+    def addinputurl(self, project, inputtemplate, url, wait=True, interval=1, **kwargs):
+        """Add an input file to the CLAM service by having the service download it from the specified URL.
+
+        The service fetches the file in the background, this waits (polling every ``interval`` seconds) until it has been fetched and added, and then returns or raises exceptions as ``addinput()`` does. If ``wait`` is False, the state of the fetch (a dictionary) is returned right away instead; it can be polled with ``fetchstate()``.
+
+        Keyword arguments are as for ``addinput()``, ``filename`` defaults to the last component of the URL.
+
+        Example::
+
+            client.addinputurl("myproject", "someinputtemplate", "https://example.org/test.txt", parameter1="blah")
+
+        """
+        if isinstance( inputtemplate, str): #pylint: disable=undefined-variable
+            data = self.get(project) #causes an extra query to server
+            inputtemplate = data.inputtemplate(inputtemplate)
+        elif not isinstance(inputtemplate, clam.common.data.InputTemplate):
+            raise Exception("inputtemplate must be instance of InputTemplate. Get from CLAMData.inputtemplate(id)")
+
+        filename = self.getinputfilename(inputtemplate, kwargs.get('filename', url.rstrip('/').split('/')[-1]))
+
+        data = {"url": url, 'inputtemplate': inputtemplate.id}
+        for key, value in kwargs.items():
+            if key == 'filename':
+                pass #nothing to do
+            elif key == 'metadata':
+                assert isinstance(value, clam.common.data.CLAMMetaData)
+                data['metadata'] =  value.xml()
+            elif key == 'metafile':
+                with open(value,'r',encoding='utf-8') as f:
+                    data['metadata'] = f.read()
             else:
-                raise clam.common.data.PermissionDenied(r.text)
-        elif r.status_code == 404:
-            raise clam.common.data.NotFound(r.text)
-        elif r.status_code == 500:
-            raise clam.common.data.ServerError(r.text)
-        elif r.status_code == 405:
-            raise clam.common.data.ServerError("Server returned 405: Method not allowed for POST on " + self.url + project + '/input/' + filename)
-        elif r.status_code == 408:
-            raise clam.common.data.TimeOut()
-        elif not (r.status_code >= 200 and r.status_code <= 299):
-            raise Exception("An error occured, return code " + str(r.status_code))
+                data[key] = value
 
-        return self._parseupload(r.text)
+        r = self.session.post(self.url + project + '/input/' + filename, **self.initrequest(data))
+        if r.status_code != 202:
+            #older services fetch the file right away
+            return self._processupload(r.status_code, r.text, project + '/input/' + filename)
+        state = r.json()
+        if not wait:
+            return state
+        while state['status'] == 'fetching':
+            time.sleep(interval)
+            state = self.fetchstate(project, state['id'])
+        if state['result'] is None:
+            raise clam.common.data.UploadError(state['error'])
+        return self._processupload(state['http_code'], state['result'], project + '/input/' + filename)
+
+    def fetchstate(self, project, fetchid):
+        """Returns the state of a fetch of an input file from a URL (see ``addinputurl()``), as a dictionary"""
+        return json.loads(self.request(project + '/fetches/' + fetchid, parse=False))
 
 
 
@@ -26,13 +26,18 @@ import time
 import re
 import yaml
 import itertools
+import mmap
+import fnmatch
+from contextlib import contextmanager
 from copy import copy, deepcopy
+from urllib.parse import urlencode
 from lxml import etree as ElementTree
 from io import StringIO, BytesIO #pylint: disable=ungrouped-imports
 import clam.common.parameters
 import clam.common.status
 import clam.common.util
 import clam.common.viewers
+import clam.common.jsonapi
 
 VERSION = '3.0.18'
 
@@ -44,6 +49,8 @@ WRAPPERDIR = os.path.abspath(os.path.dirname(__file__) + '/../wrappers/')
 
 DISALLOWINSHELLSAFE = ('|','&',';','!','<','>','{','}','`','\n','\r','\t')
 
+CHUNKSIZE = 64*1024 #default size of chunks when reading files
+
 CUSTOM_FORMATS = []  #will be injected
 CUSTOM_VIEWERS = []  #will be injected
 
@@ -244,7 +251,7 @@ class CLAMFile:
                 requestparams = self.client.initrequest()
             else:
                 requestparams = {}
-            response = requests.get(self.projectpath + self.basedir + '/' + self.filename + '/metadata', **requestparams)
+            response = self.session().get(self.projectpath + self.basedir + '/' + self.filename + '/metadata', **requestparams)
             if response.status_code != 200:
                 extramsg = ""
                 if not self.client: extramsg = "No client was associated with this CLAMFile, associating a client is necessary when authentication is needed"
@@ -259,36 +266,85 @@ class CLAMFile:
             raise ValueError("Metadata is not XML! Contents: " + xml)
 
     def __iter__(self):
-        """Read the lines of the file, one by one without loading the file into memory."""
-        if not self.remote:
-            fullpath = self.projectpath + self.basedir + '/' + self.filename
-            if not os.path.exists(fullpath):
-                raise FileNotFoundError("No such file or directory: " + fullpath )
-            if self.metadata and 'encoding' in self.metadata:
-                for line in io.open(fullpath, 'r', encoding=self.metadata['encoding']).readlines():
-                    yield line
+        """Read the lines of the file, one by one without loading the file into memory. Lines are strings if the file has an encoding (in its metadata), bytes otherwise."""
+        if self.metadata and 'encoding' in self.metadata:
+            if not self.remote:
+                with io.open(self.fullpath(), 'r', encoding=self.metadata['encoding']) as f:
+                    for line in f:
+                        yield line
             else:
-                for line in io.open(fullpath, 'rb').readlines():
+                response = self.request()
+                response.raw.decode_content = True #undo any transfer compression
+                response.raw.auto_close = False #required for wrapping in a TextIOWrapper
+                with io.TextIOWrapper(response.raw, encoding=self.metadata['encoding']) as f:
+                    for line in f:
+                        yield line
+        elif not self.remote:
+            with io.open(self.fullpath(), 'rb') as f:
+                for line in f:
                     yield line
         else:
-            fullpath = self.projectpath + self.basedir + '/' + self.filename
-            if self.client:
-                requestparams = self.client.initrequest()
-            else:
-                requestparams = {}
-            requestparams['stream'] = True
-            response = requests.get(self.projectpath + self.basedir + '/' + self.filename, **requestparams)
-            if self.metadata and 'encoding' in self.metadata:
-                for line in response.iter_lines():
-                    #\n is stripped, re-add (should also work fine on binary files)
-                    if not isinstance(line,str):
-                        yield str(line, self.metadata['encoding']) + "\n"
-                    else:
-                        yield line + b'\n'
-            else:
-                CHUNKSIZE = 64*1024
-                for line in response.iter_content(CHUNKSIZE):
-                    yield line
+            #no line semantics for remote files without encoding, pass the data on as it comes in
+            for chunk in self.chunks():
+                yield chunk
+
+    def chunks(self, chunksize=CHUNKSIZE):
+        """Read the file as binary data, in chunks of (at most) the specified size"""
+        if not self.remote:
+            with io.open(self.fullpath(), 'rb') as f:
+                while True:
+                    chunk = f.read(chunksize)
+                    if not chunk:
+                        break
+                    yield chunk
+        else:
+            for chunk in self.request().iter_content(chunksize):
+                if chunk: # filter out keep-alive new chunks
+                    yield chunk
+
+    def request(self):
+        """Requests a remote file, returns the (streaming) response"""
+        if self.client:
+            requestparams = self.client.initrequest()
+        else:
+            requestparams = {}
+        requestparams['stream'] = True
+        return self.session().get(self.projectpath + self.basedir + '/' + self.filename, **requestparams)
+
+    def session(self):
+        """Returns the HTTP session for remote requests, the connection pool of the associated client is reused if there is one"""
+        if self.client:
+            return self.client.session
+        return requests
+
+    @contextmanager
+    def view(self):
+        """Memory-map the file and return a read-only memoryview on its contents, to be used as a context manager. Remote files can not be mapped, they are downloaded into memory instead. Example::
+
+            with clamfile.view() as data:
+                header = bytes(data[:4])
+        """
+        if self.remote:
+            yield memoryview(b"".join(self.chunks()))
+            return
+        with io.open(self.fullpath(), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield memoryview(b"") #empty files can not be mapped
+                return
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = memoryview(m)
+            try:
+                yield data
+            finally:
+                data.release()
+                m.close()
+
+    def fullpath(self):
+        """Returns the full path of a local file, raises FileNotFoundError if it does not exist"""
+        fullpath = self.projectpath + self.basedir + '/' + self.filename
+        if not os.path.exists(fullpath):
+            raise FileNotFoundError("No such file or directory: " + fullpath )
+        return fullpath
 
     def delete(self):
         """Delete this file"""
@@ -303,10 +359,13 @@ class CLAMFile:
             if os.path.exists(metafile):
                 os.unlink(metafile)
 
-            #also remove any .*.INPUTTEMPLATE.* links that pointed to this file: simply remove all dead links
-            for linkf,realf in clam.common.util.globsymlinks(self.projectpath + self.basedir + '/.*.INPUTTEMPLATE.*'):
-                if not os.path.exists(realf):
-                    os.unlink(linkf)
+            #also remove any .*.INPUTTEMPLATE.* (or .*.OUTPUTTEMPLATE.*) links that pointed to this file: simply remove all dead links
+            for kind in ('INPUTTEMPLATE', 'OUTPUTTEMPLATE'):
+                for links in clam.common.util.symlinkindex(self.projectpath + self.basedir, kind).values():
+                    for _, linkf, realf in links:
+                        if not os.path.exists(realf):
+                            os.unlink(linkf)
+            clam.common.util.invalidatesymlinkindex(self.projectpath + self.basedir)
 
             return True
         else:
@@ -314,7 +373,7 @@ class CLAMFile:
                 requestparams = self.client.initrequest()
             else:
                 requestparams = {}
-            requests.delete( self.projectpath + self.basedir + '/' + self.filename, **requestparams)
+            self.session().delete( self.projectpath + self.basedir + '/' + self.filename, **requestparams)
             return True
 
 
@@ -323,29 +382,23 @@ class CLAMFile:
         return list(iter(self))
 
     def read(self):
-        """Loads all lines in memory"""
-        lines = self.readlines()
+        """Loads the entire contents of the file in memory, as a string (decoded according to the encoding in the metadata, utf-8 by default)"""
         if self.metadata and 'encoding' in self.metadata:
             encoding = self.metadata['encoding']
         else:
             encoding = 'utf-8'
-        return "\n".join( str(line, 'utf-8') if isinstance(line, bytes) else line for line in lines)
+        if not self.remote:
+            with io.open(self.fullpath(), 'r', encoding=encoding) as f:
+                return f.read()
+        else:
+            return io.TextIOWrapper(io.BytesIO(b"".join(self.chunks())), encoding=encoding).read()
 
 
     def copy(self, target, timeout=500):
         """Copy or download this file to a new local file"""
-
-        if self.metadata and 'encoding' in self.metadata:
-            with io.open(target,'w', encoding=self.metadata['encoding']) as f:
-                for line in self:
-                    f.write(line)
-        else:
-            with io.open(target,'wb') as f:
-                for line in self:
-                    if isinstance(line,str):
-                        f.write(line.encode('utf-8'))
-                    else:
-                        f.write(line)
+        with io.open(target,'wb') as f:
+            for chunk in self.chunks():
+                f.write(chunk)
 
     def validate(self):
         """Validate this file. Returns a boolean."""
@@ -464,7 +517,7 @@ class CLAMData:
 
         * ``baseurl``         - The base URL to the service (string)
         * ``projecturl``      - The full URL to the selected project, if any  (string)
-        * ``status``          - Can be: ``clam.common.status.READY`` (0),``clam.common.status.RUNNING`` (1), or ``clam.common.status.DONE`` (2)
+        * ``status``          - Can be: ``clam.common.status.READY`` (0),``clam.common.status.RUNNING`` (1), ``clam.common.status.DONE`` (2), or ``clam.common.status.QUEUED`` (3)
         * ``statusmessage``   - The latest status message (string)
         * ``completion``      - An integer between 0 and 100 indicating
                           the percentage towards completion.
@@ -482,12 +535,15 @@ class CLAMData:
     Note that depending on the current status of the project, not all may be available.
     """
 
-    def __init__(self, xml, client=None, localroot = False, projectpath=None, loadmetadata=True):
+    def __init__(self, xml, client=None, localroot = False, projectpath=None, loadmetadata=True, spec=None):
         """Initialises a CLAMData object by passing pass a string containing the full CLAM XML response. It will be automatically parsed. This is usually not called directly but instantiated in system wrapper scripts using::
 
             data = clam.common.data.getclamdata("clam.xml")
 
         Or ``CLAMCLient`` is used, most responses are ``CLAMData`` instances.
+
+        Alternatively, a dictionary holding the JSON representation may be passed instead of CLAM XML, along with ``spec``, a ``CLAMData`` instance
+        obtained from CLAM XML earlier that provides the service specification (profiles, parameters, formats) the JSON representation leaves out.
         """
         self.xml = xml
 
@@ -512,7 +568,7 @@ class CLAMData:
         #: String containing the full URL to the project, if a project was indeed selected
         self.projecturl = ''
 
-        #: The current status of the service, returns clam.common.status.READY (1), clam.common.status.RUNNING (2), or clam.common.status.DONE (3)
+        #: The current status of the service, returns clam.common.status.READY (0), clam.common.status.RUNNING (1), clam.common.status.DONE (2), or clam.common.status.QUEUED (3)
         self.status = clam.common.status.READY
 
         #: The current status of the service in a human readable message
@@ -537,6 +593,12 @@ class CLAMData:
         #: List of output files ([ CLAMOutputFile ])
         self.output = []
 
+        #: Page of the input files that was returned, a dictionary with offset, limit (may be None) and total (the number of files in all pages), or None if all input files were returned
+        self.inputpage = None
+
+        #: Page of the output files that was returned, in the same form as ``inputpage``
+        self.outputpage = None
+
         #: Automatically load metadata for input and output files? (default: True)
         self.loadmetadata = loadmetadata
 
@@ -551,8 +613,10 @@ class CLAMData:
 
         self.client = client
 
-
-        self.parseresponse(xml, localroot)
+        if isinstance(xml, dict):
+            self.parsejson(xml, spec)
+        else:
+            self.parseresponse(xml, localroot)
 
 
 
@@ -657,12 +721,14 @@ class CLAMData:
                             FormatClass = type(subnode.attrib['id'], (CLAMMetaData,), { "mimetype": subnode.attrib['mimetype'], "name": subnode.attrib['name'] })
                             CUSTOM_FORMATS.append(FormatClass)
             elif node.tag == 'input':
+                self.inputpage = parsepage(node)
                 for filenode in node:
                     if filenode.tag == 'file':
                         for n in filenode:
                             if n.tag == 'name':
                                 self.input.append( CLAMInputFile( self.projecturl, n.text, self.loadmetadata, self.client,True) )
             elif node.tag == 'output':
+                self.outputpage = parsepage(node)
                 for filenode in node:
                     if filenode.tag == 'file':
                         for n in filenode:
@@ -685,6 +751,59 @@ class CLAMData:
                         if not inputfound:
                             self.program.add(outputfilenode.attrib['name'],outputfilenode.attrib['template'])
 
+    def parsejson(self, data, spec=None):
+        """Parses the JSON representation (a dictionary) of a response, the service specification is taken from spec (a CLAMData instance) if provided. There's usually no need to call this directly"""
+        if data.get('version') != clam.common.jsonapi.VERSION:
+            raise FormatError("Unsupported version of the JSON representation: " + str(data.get('version')))
+
+        if spec is not None:
+            for key in ('system_id','system_name','system_author','system_version','system_email','system_license','system_url','system_parent_url','system_login_url','system_register_url','system_cover_url','system_affiliation','description','authentication','baseurl'):
+                setattr(self, key, getattr(spec, key))
+            self.profiles = spec.profiles
+            self.parameters = deepcopy(spec.parameters)
+
+        self.baseurl = data.get('baseurl', self.baseurl)
+        self.project = data.get('project')
+        self.user = data.get('user')
+        if self.project:
+            self.remote = True
+            self.projecturl = self.baseurl + '/' + self.project + '/'
+
+        self.status = data.get('status', clam.common.status.READY)
+        self.statusmessage = data.get('statusmessage', "")
+        self.completion = data.get('completion', 0)
+        self.errors = data.get('errors', False)
+        self.errormsg = data.get('errormsg', "")
+
+        if 'parameters' in data:
+            #the specification is the same for all users, the parameters the user has no access to are left out of the data
+            self.parameters = [ (parametergroup, [ parameter for parameter in parameters if parameter.id in data['parameters'] ]) for parametergroup, parameters in self.parameters ]
+            for parametergroup, parameters in self.parameters: #pylint: disable=unused-variable
+                for parameter in parameters:
+                    if parameter.id in data['parameters']:
+                        if 'value' in data['parameters'][parameter.id]:
+                            parameter.set(data['parameters'][parameter.id]['value'])
+                        parameter.error = data['parameters'][parameter.id].get('error')
+
+        self.input = [ CLAMInputFile( self.projecturl, file['name'], self.loadmetadata, self.client,True) for file in data.get('input',[]) ]
+        self.inputpage = data.get('inputpage')
+        self.output = [ CLAMOutputFile( self.projecturl, file['name'], self.loadmetadata, self.client ) for file in data.get('output',[]) ]
+        self.outputpage = data.get('outputpage')
+
+        if data.get('program'):
+            self.program = Program(self.projecturl, data['program']['matchedprofiles'])
+            for outputfile in data['program']['outputfiles']:
+                if outputfile['inputfiles']:
+                    for inputfile in outputfile['inputfiles']:
+                        self.program.add(outputfile['name'], outputfile['template'], inputfile['name'], inputfile['template'])
+                else:
+                    self.program.add(outputfile['name'], outputfile['template'])
+
+        if 'projects' in data:
+            self.projects = [ project['name'] for project in data['projects'] ]
+        if 'corpora' in data:
+            self.corpora = data['corpora']
+
     def outputtemplate(self, template_id):
         """Get an output template by ID"""
         for profile in self.profiles:
@@ -812,6 +931,55 @@ class CLAMData:
             if not inputtemplate or inputfile.metadata.inputtemplate == inputtemplate:
                 yield inputfile
 
+    def iterinput(self, template=None, glob=None, pagesize=1000):
+        """Generator yielding all input files (``CLAMInputFile``), optionally only those with the specified input template (ID) and/or a filename matching the glob pattern. When connected to a service, the files are retrieved lazily, one page of ``pagesize`` files at a time, rather than all at once."""
+        return self._iterfiles('input', template, glob, pagesize)
+
+    def iteroutput(self, template=None, glob=None, pagesize=1000):
+        """Generator yielding all output files (``CLAMOutputFile``), optionally only those with the specified output template (ID) and/or a filename matching the glob pattern. When connected to a service, the files are retrieved lazily, one page of ``pagesize`` files at a time, rather than all at once."""
+        return self._iterfiles('output', template, glob, pagesize)
+
+    def _iterfiles(self, basedir, template, glob, pagesize):
+        if self.client is None or not self.project:
+            #no service to query, select from the files we have
+            for file in (self.input if basedir == 'input' else self.output):
+                if glob and not fnmatch.fnmatchcase(file.filename, glob):
+                    continue
+                if template:
+                    if not file.metadata:
+                        continue
+                    elif basedir == 'input' and file.metadata.inputtemplate != template:
+                        continue
+                    elif basedir == 'output' and (not file.metadata.provenance or file.metadata.provenance.outputtemplate_id != template):
+                        continue
+                yield file
+            return
+        offset = 0
+        while True:
+            query = {'list': '', 'offset': offset, 'limit': pagesize}
+            if template:
+                query['template'] = template
+            if glob:
+                query['glob'] = glob
+            data = self.client.request(self.project + '/' + basedir + '/?' + urlencode(query))
+            files = data.input if basedir == 'input' else data.output
+            page = data.inputpage if basedir == 'input' else data.outputpage
+            for file in files:
+                yield file
+            offset += len(files)
+            if not files or page is None or offset >= page['total']:
+                break
+
+def parsepage(node):
+    """Parses the pagination attributes of an input or output node, for internal use only"""
+    if 'total' not in node.attrib:
+        return None
+    return {
+        'offset': int(node.attrib.get('offset',0)),
+        'limit': int(node.attrib['limit']) if 'limit' in node.attrib else None,
+        'total': int(node.attrib['total']),
+    }
+
 def sanitizeparameters(parameters):
     """Construct a dictionary of parameters, for internal use only"""
     if not isinstance(parameters,dict):
@@ -1660,19 +1828,13 @@ class InputTemplate:
         return self.generate(metadata,user)
 
     def matchingfiles(self, projectpath):
-        """Checks if the input conditions are satisfied, i.e the required input files are present. We use the symbolic links .*.INPUTTEMPLATE.id.seqnr to determine this. Returns a list of matching results (seqnr, filename, inputtemplate)."""
-        results = []
-
+        """Checks if the input conditions are satisfied, i.e the required input files are present. We use the symbolic links .*.INPUTTEMPLATE.id.seqnr to determine this, through the (shared) index of these links. Returns a list of matching results (seqnr, filename, inputtemplate)."""
         if projectpath[-1] == '/':
             inputpath = projectpath + 'input/'
         else:
             inputpath = projectpath + '/input/'
 
-        for linkf,realf in clam.common.util.globsymlinks(inputpath + '/.*.INPUTTEMPLATE.' + self.id + '.*'):
-            seqnr = int(linkf.split('.')[-1])
-            results.append( (seqnr, realf[len(inputpath):], self) )
-        results = sorted(results)
-        #print("MATCHINGFILES: ", results,file=sys.stderr) #REMOVE DEBUG
+        results = [ (seqnr, realf[len(inputpath):], self) for seqnr, _, realf in clam.common.util.symlinkindex(inputpath).get(self.id, []) ]
         if self.unique and len(results) != 1:
             return []
         else:
@@ -0,0 +1,188 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- URL ingestion --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""URL ingestion. Input files to be downloaded from a URL are fetched in the background by a pool of threads sharing one HTTP session (and thus its connection pool), rather than within the request that asks for them. Downloads are streamed to disk and subject to a maximum size and a time limit. The state of each fetch is recorded in the project directory, so clients can poll it and, once fetched, the file is added as an input file like any other."""
+
+import os
+import json
+import time
+import random
+import threading
+import concurrent.futures
+import requests
+import requests.adapters
+
+from clam.common.resumable import validid
+
+FETCHDIR = '.fetches'
+
+CHUNKSIZE = 64 * 1024 #size of the blocks in which downloads are written to disk (in bytes)
+
+FETCHING = 'fetching'
+DONE = 'done'
+FAILED = 'failed'
+
+class FetchError(Exception):
+    pass
+
+def path(projectpath, fetchid=''):
+    """Returns the path of the directory holding the fetches of a project, or of the specified fetch within it"""
+    return os.path.join(projectpath, FETCHDIR, fetchid)
+
+def datapath(projectpath, fetchid):
+    """Returns the path of the file the download is written to"""
+    return path(projectpath, fetchid) + '.part'
+
+def create(projectpath, url, filename, fields):
+    """Records a new fetch of the URL, fields holds the request parameters to add the file with once it is fetched (such as the input template and metadata). Returns its state"""
+    os.makedirs(path(projectpath), exist_ok=True)
+    state = {'id': "%032x" % random.getrandbits(128), 'url': url, 'filename': filename, 'fields': fields, 'status': FETCHING, 'received': 0, 'size': None, 'error': None, 'http_code': None, 'result': None, 'created': time.time()}
+    save(projectpath, state)
+    return state
+
+def save(projectpath, state):
+    tmpfile = path(projectpath, state['id']) + '.json.tmp'
+    with open(tmpfile,'w',encoding='utf-8') as f:
+        json.dump(state, f)
+    os.rename(tmpfile, path(projectpath, state['id']) + '.json')
+
+def load(projectpath, fetchid):
+    """Returns the state of the fetch, or None if it does not exist"""
+    if not validid(fetchid):
+        return None
+    try:
+        with open(path(projectpath, fetchid) + '.json','r',encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def states(projectpath):
+    """Returns the states of all fetches of the project"""
+    if not os.path.isdir(path(projectpath)):
+        return []
+    return [ state for state in ( load(projectpath, filename[:-5]) for filename in os.listdir(path(projectpath)) if filename.endswith('.json') ) if state is not None ]
+
+def pending(projectpath, timeout):
+    """Returns the states of the fetches of the project that are still in progress. Fetches that have been in progress for longer than the time limit (in seconds) are considered lost, the process fetching them must have ended"""
+    return [ state for state in states(projectpath) if state['status'] == FETCHING and time.time() - state['created'] < timeout + 60 ]
+
+def remove(projectpath, fetchid):
+    """Removes the fetch, returns False if it did not exist"""
+    found = False
+    for extension in ('.part', '.json'):
+        if os.path.exists(path(projectpath, fetchid) + extension):
+            os.unlink(path(projectpath, fetchid) + extension)
+            found = True
+    return found
+
+def expire(projectpath, maxage):
+    """Removes the records of fetches that were initiated more than maxage seconds ago"""
+    for state in states(projectpath):
+        if time.time() - state['created'] > maxage:
+            remove(projectpath, state['id'])
+
+def session(poolsize=10):
+    """Returns an HTTP session keeping up to poolsize connections per host alive, to be shared by all fetches"""
+    s = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=poolsize, pool_maxsize=poolsize)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    s.headers['User-Agent'] = 'CLAM'
+    return s
+
+def download(s, url, target, maxsize=0, timeout=300, progress=None):
+    """Downloads the URL to the target file using session s, streaming it to disk. Raises FetchError if the download fails, exceeds maxsize bytes (0 = unlimited) or takes longer than timeout seconds. The progress function, if any, is called with the number of bytes received and the expected size (or None). Returns the number of bytes received"""
+    if not url.startswith(('http://','https://')):
+        raise FetchError("Only HTTP(S) URLs can be fetched")
+    deadline = time.time() + timeout
+    try:
+        with s.get(url, stream=True, timeout=timeout) as r:
+            if not 200 <= r.status_code < 300:
+                raise FetchError("Unable to fetch " + url + ": HTTP " + str(r.status_code))
+            try:
+                size = int(r.headers['Content-Length'])
+            except (KeyError, ValueError):
+                size = None
+            if maxsize and size is not None and size > maxsize:
+                raise FetchError("The file at " + url + " exceeds the maximum size (" + str(maxsize) + " bytes)")
+            received = 0
+            with open(target,'wb') as f:
+                for chunk in r.iter_content(chunk_size=CHUNKSIZE):
+                    received += len(chunk)
+                    if maxsize and received > maxsize:
+                        raise FetchError("The file at " + url + " exceeds the maximum size (" + str(maxsize) + " bytes)")
+                    if time.time() > deadline:
+                        raise FetchError("Fetching " + url + " took longer than " + str(timeout) + " seconds")
+                    f.write(chunk)
+                    if progress: progress(received, size)
+    except requests.exceptions.RequestException as e:
+        if os.path.exists(target):
+            os.unlink(target)
+        raise FetchError("Unable to fetch " + url + ": " + str(e))
+    except FetchError:
+        if os.path.exists(target):
+            os.unlink(target)
+        raise
+    return received
+
+class Fetcher:
+    def __init__(self, threads=4, maxsize=0, timeout=300, log=None):
+        self.threads = threads
+        self.maxsize = maxsize #in bytes, 0 = unlimited
+        self.timeout = timeout #in seconds
+        self.log = log
+        self.session = session(max(threads, 1))
+        self.executor = None #started on first use
+        self.lock = threading.Lock() #finished fetches are added one at a time, as adding determines sequence numbers
+
+    def download(self, url, target):
+        """Downloads the URL to the target file right away, within the calling thread"""
+        return download(self.session, url, target, self.maxsize, self.timeout)
+
+    def submit(self, projectpath, state, finish):
+        """Fetches in the background. Once downloaded, finish(state, datapath) is called to add the file, it returns the HTTP status code and body of the response adding it would have had; the file is considered added if the status code is 200. Returns a future"""
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+        return self.executor.submit(self.run, projectpath, state, finish)
+
+    def run(self, projectpath, state, finish):
+        """Performs a fetch, updates its state as it progresses. For internal use"""
+        lastsave = [time.time()]
+        def progress(received, size):
+            if time.time() - lastsave[0] >= 1:
+                state['received'], state['size'] = received, size
+                save(projectpath, state)
+                lastsave[0] = time.time()
+        target = datapath(projectpath, state['id'])
+        try:
+            state['received'] = state['size'] = download(self.session, state['url'], target, self.maxsize, self.timeout, progress)
+            with self.lock:
+                state['http_code'], state['result'] = finish(state, target)
+            state['status'] = DONE if state['http_code'] == 200 else FAILED
+            if state['status'] == FAILED:
+                state['error'] = "The fetched file was not accepted"
+        except FetchError as e:
+            state['status'] = FAILED
+            state['error'] = str(e)
+        except Exception as e: #pylint: disable=broad-except
+            state['status'] = FAILED
+            state['error'] = "Unable to add fetched file: " + str(e)
+        if os.path.exists(target):
+            os.unlink(target)
+        if os.path.isdir(path(projectpath)): #the project may have been deleted meanwhile
+            save(projectpath, state)
+        if self.log:
+            self.log("Fetch of " + state['url'] + (" completed" if state['status'] == DONE else " failed: " + state['error']))
+        return state
@@ -0,0 +1,215 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Project index --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Per-user project index, listing the projects of a user along with their date, size and status, and when their size was last computed from scratch. The index consists of a snapshot (.index) and an append-only journal of changes (.index.journal) that is periodically compacted into the snapshot. All access is serialised with an fcntl lock, so the webservice workers and dispatchers can update it concurrently. Each process keeps the index it loaded in memory and only reads what was appended to the journal since, so the disk usage of a user or project can be obtained in constant time."""
+
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+
+INDEXFILE = '.index'
+JOURNALFILE = '.index.journal'
+LOCKFILE = '.index.lock'
+
+MAXJOURNALSIZE = 65536 #compact the journal into the snapshot once it grows beyond this size (in bytes)
+
+CACHE = {} #maps user directories to the loaded index state
+CACHELOCK = threading.RLock()
+
+class ProjectIndex:
+    """Project index for the user directory at the given path (ROOT/projects/user/)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def lock(self, exclusive=True):
+        fd = os.open(os.path.join(self.path, LOCKFILE), os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd) #releases the lock
+
+    def readsnapshot(self):
+        """Reads the snapshot, returns a new state or None if there is no (valid) snapshot"""
+        try:
+            with open(os.path.join(self.path, INDEXFILE),'r',encoding='utf-8') as f:
+                st = os.fstat(f.fileno())
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or 'projects' not in data:
+            return None
+        if isinstance(data['projects'], list):
+            #old format: list of (project, date, size, status) tuples
+            projects = { projectdata[0]: list(projectdata[1:4]) + [0] for projectdata in data['projects'] }
+        else:
+            projects = { project: (projectdata + [0])[:4] for project, projectdata in data['projects'].items() } #entries without a reconciliation time were never reconciled
+        journalinode, offset = data.get('journal', (None, 0)) #the part of the journal that is already included in the snapshot
+        return {
+            'snapshot': (st.st_ino, st.st_mtime_ns, st.st_size),
+            'journal': journalinode,
+            'offset': offset,
+            'projects': projects,
+            'totalsize': sum( projectdata[1] for projectdata in projects.values() ),
+        }
+
+    def load(self):
+        """Returns the current state of the index, reading only the changes since it was last loaded, or None if there is no (valid) index. Must be called with the lock held"""
+        try:
+            st = os.stat(os.path.join(self.path, INDEXFILE))
+        except OSError:
+            return None
+        with CACHELOCK:
+            state = CACHE.get(self.path)
+            if state is None or state['snapshot'] != (st.st_ino, st.st_mtime_ns, st.st_size):
+                state = self.readsnapshot()
+                if state is None:
+                    CACHE.pop(self.path, None)
+                    return None
+            try:
+                with open(os.path.join(self.path, JOURNALFILE),'rb') as f:
+                    journalinode = os.fstat(f.fileno()).st_ino
+                    if journalinode != state['journal']:
+                        #a new journal, started after the snapshot was written
+                        state['journal'] = journalinode
+                        state['offset'] = 0
+                    f.seek(state['offset'])
+                    data = f.read()
+            except (IOError, OSError):
+                data = b"" #no journal
+            end = data.rfind(b"\n") + 1 #only process complete lines, a write may be in progress
+            for line in data[:end].split(b"\n"):
+                if line:
+                    try:
+                        self.apply(state, json.loads(str(line,'utf-8')))
+                    except ValueError:
+                        continue #garbled line from an interrupted write, skip
+            state['offset'] += end
+            CACHE[self.path] = state
+            return state
+
+    @staticmethod
+    def apply(state, delta):
+        projects = state['projects']
+        if delta['project'] in projects:
+            state['totalsize'] -= projects[delta['project']][1]
+        if delta.get('deleted'):
+            projects.pop(delta['project'], None)
+        else:
+            #entries are replaced rather than modified, copies returned by get() remain untouched
+            projectdata = list(projects.get(delta['project'], ["", 0.0, 0, 0]))
+            for i, key in enumerate(('date','size','status','reconciled')):
+                if key in delta:
+                    projectdata[i] = delta[key]
+            if 'grow' in delta:
+                projectdata[1] = max(0.0, projectdata[1] + delta['grow'])
+            projects[delta['project']] = projectdata
+            state['totalsize'] += projectdata[1]
+
+    def write(self, projects):
+        """Atomically writes a new snapshot and starts a new journal. Must be called with the exclusive lock held"""
+        journalfile = os.path.join(self.path, JOURNALFILE)
+        try:
+            st = os.stat(journalfile)
+            journal = (st.st_ino, st.st_size) #should we get interrupted before the new journal is in place, the entries that are in the snapshot will be skipped
+        except OSError:
+            journal = (None, 0)
+        tmpfile = os.path.join(self.path, INDEXFILE + '.tmp')
+        with open(tmpfile,'w',encoding='utf-8') as f:
+            json.dump({'projects': projects, 'totalsize': sum( projectdata[1] for projectdata in projects.values() ), 'journal': journal}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpfile, os.path.join(self.path, INDEXFILE))
+        with open(journalfile + '.tmp','wb'):
+            pass
+        os.replace(journalfile + '.tmp', journalfile)
+
+    def state(self, build=None):
+        with self.lock(False):
+            state = self.load()
+        if state is None and build is not None:
+            with self.lock(True):
+                state = self.load() #another process may have built it in the meantime
+                if state is None:
+                    self.write(build())
+                    state = self.load()
+        return state
+
+    def get(self, build=None):
+        """Returns the index as a dictionary mapping project names to [date, size, status, reconciled] lists, reconciled being the time at which the size was last computed from scratch (0 if never). If there is no index yet, the build function is called to compute one (it should return a dictionary in the same format) and it is stored"""
+        state = self.state(build)
+        if state is None:
+            return None
+        with CACHELOCK:
+            return dict(state['projects'])
+
+    def totalsize(self, build=None):
+        """Returns the total size (in MB) of all projects"""
+        state = self.state(build)
+        if state is None:
+            return 0.0
+        return state['totalsize']
+
+    def projectsize(self, project, build=None):
+        """Returns the size (in MB) of the specified project, or None if it is not in the index"""
+        state = self.state(build)
+        if state is None:
+            return None
+        with CACHELOCK:
+            if project in state['projects']:
+                return state['projects'][project][1]
+        return None
+
+    def reconciled(self, project, build=None):
+        """Returns the time at which the size of the specified project was last computed from scratch (0 if never), or None if it is not in the index"""
+        state = self.state(build)
+        if state is None:
+            return None
+        with CACHELOCK:
+            if project in state['projects']:
+                return state['projects'][project][3]
+        return None
+
+    def update(self, project, **kwargs):
+        """Records a change to a project (date, size and/or status, or grow to add to the size), or adds the project to the index. A size computed from scratch is accompanied by the time it was computed (reconciled). Does nothing if there is no index yet (it will be built from scratch when it is needed)"""
+        for key in kwargs:
+            if key not in ('date','size','status','grow','reconciled'):
+                raise KeyError("Invalid index field: " + key)
+        kwargs['project'] = project
+        self.journal(kwargs)
+
+    def remove(self, project):
+        """Removes a project from the index"""
+        self.journal({'project': project, 'deleted': True})
+
+    def journal(self, delta):
+        with self.lock(True):
+            if not os.path.exists(os.path.join(self.path, INDEXFILE)):
+                return False
+            fd = os.open(os.path.join(self.path, JOURNALFILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+            try:
+                os.write(fd, (json.dumps(delta, ensure_ascii=False) + "\n").encode('utf-8'))
+                journalsize = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            if journalsize > MAXJOURNALSIZE:
+                state = self.load()
+                if state is not None:
+                    self.write(state['projects'])
+        return True
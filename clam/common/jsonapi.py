@@ -0,0 +1,82 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- JSON API --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Versioned JSON representation of the project index, project state and upload results, an alternative to CLAM XML for machine clients. Clients ask for it in the Accept header. It only describes the state, the service specification (profiles, parameters, formats) is left to CLAM XML, which clients need to fetch only once."""
+
+import json
+
+#: Version of the JSON representation, incremented on incompatible changes
+VERSION = 1
+
+#: Media type of the JSON representation
+MIMETYPE = 'application/vnd.clam.v' + str(VERSION) + '+json'
+
+def accepted(accept):
+    """Returns True if the JSON representation is explicitly accepted, given the parsed Accept header (werkzeug's MIMEAccept). Wildcards do not count, CLAM XML remains the default"""
+    return any( mimetype == MIMETYPE and quality > 0 for mimetype, quality in accept )
+
+def parsefields(value):
+    """Parses a comma separated field selection, returns None if all fields are to be included"""
+    if not value:
+        return None
+    return [ field.strip() for field in value.split(',') if field.strip() ]
+
+def serialise(fields, selection=None):
+    """Produces the JSON representation given a dictionary mapping field names to functions computing their values. Only the selected fields are computed, all of them if selection is None. Raises KeyError on unknown fields"""
+    result = {'version': VERSION}
+    for field in (fields if selection is None else selection):
+        result[field] = fields[field]()
+    return json.dumps(result, ensure_ascii=False)
+
+def parameters(parametergroups, user=None):
+    """Returns the values and errors of the parameters, as a dictionary mapping parameter IDs to dictionaries with a value and/or error (empty if it has neither). Parameters the user has no access to are left out, so clients know which parameters of the specification apply to the user"""
+    result = {}
+    for _, parameterlist in parametergroups:
+        for parameter in parameterlist:
+            if user is not None and not parameter.access(user):
+                continue
+            d = {}
+            if parameter.hasvalue:
+                d['value'] = parameter.value
+            if parameter.error:
+                d['error'] = parameter.error
+            result[parameter.id] = d
+    return result
+
+def files(entries):
+    """Returns a list of dictionaries describing the files in a manifest"""
+    return [ {
+        'name': entry.filename,
+        'template': entry.template,
+        'format': entry.format,
+        'size': entry.size,
+        'viewers': [ viewer.id for viewer in entry.viewers ],
+        'converters': [ converter.id for converter in entry.converters ],
+    } for entry in entries ]
+
+def program(program, matchedprofiles):
+    """Returns a dictionary describing the output files a program is expected to produce from which input files"""
+    return {
+        'matchedprofiles': [ int(i) for i in matchedprofiles.split(',') ] if matchedprofiles else [],
+        'outputfiles': [ {
+            'name': outputfilename,
+            'template': outputtemplate,
+            'inputfiles': [ {'name': inputfilename, 'template': inputtemplate} for inputfilename, inputtemplate in inputfiles.items() ],
+        } for outputfilename, (outputtemplate, inputfiles) in program.items() ],
+    }
+
+def projects(projects):
+    """Returns a list of dictionaries describing the projects in an index, as returned by getprojects()"""
+    return [ {'name': project, 'time': time, 'size': size, 'status': status} for project, time, size, status in projects ]
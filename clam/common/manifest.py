@@ -0,0 +1,158 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Project file manifests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Manifests of the input and output files of a project. A manifest is a compact listing of all files in the input or output directory, with their template, format, size, viewers and converters, so a project can be described without loading the metadata of every single file. Manifests are stored in the project directory and are valid as long as none of the directories and files they cover has been modified (files may be rewritten in place, which leaves their directory untouched)."""
+
+import os
+import time
+import json
+import fnmatch
+
+import clam.common.data
+
+class ManifestEntry:
+    """A file in a manifest"""
+
+    def __init__(self, filename, template=None, format=None, size=0, viewers=None, converters=None, mtime=0):
+        self.filename = filename
+        self.template = template #input or output template ID
+        self.format = format #name of the format class
+        self.size = size #in bytes
+        self.viewers = viewers if viewers else []
+        self.converters = converters if converters else []
+        self.mtime = mtime #modification time of the file (in nanoseconds)
+
+    def json(self):
+        return [self.filename, self.template, self.format, self.size, [ viewer.id for viewer in self.viewers ], [ converter.id for converter in self.converters ], self.mtime]
+
+    def __str__(self):
+        return self.filename
+
+
+def manifestfile(projectpath, basedir):
+    return os.path.join(projectpath, '.manifest.' + basedir)
+
+def templates(profiles, basedir):
+    """Returns a dictionary mapping template IDs to input templates (basedir input) or output templates (basedir output)"""
+    result = {}
+    for profile in profiles:
+        for template in (profile.input if basedir == 'input' else profile.outputtemplates()):
+            result.setdefault(template.id, template)
+    return result
+
+def build(projectpath, basedir, profiles, quick=False, timeout=0, log=None):
+    """Lists all files in the input or output directory of the project. Returns a (entries, directories, complete) tuple, where directories maps the directories covered to their modification times. If the timeout (in seconds) is exceeded, metadata is no longer loaded for the remaining files and the result is marked incomplete"""
+    if basedir == 'input':
+        fileclass = clam.common.data.CLAMInputFile
+    else:
+        fileclass = clam.common.data.CLAMOutputFile
+    prefix = os.path.join(projectpath, basedir)
+    begintime = time.time()
+    complete = not quick
+    entries = []
+    directories = {}
+    for dirpath, dirnames, filenames in os.walk(prefix):
+        try:
+            directories[os.path.relpath(dirpath, prefix)] = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            continue
+        dirnames[:] = sorted( d for d in dirnames if d[0] != '.' ) #always skip all hidden files
+        for f in sorted(filenames):
+            if f[0] == '.':
+                continue
+            filename = os.path.relpath(os.path.join(dirpath, f), prefix)
+            file = fileclass(projectpath, filename, loadmetadata=complete)
+            file.attachviewers(profiles) #attaches converters as well
+            try:
+                st = os.stat(os.path.join(dirpath, f))
+                size, mtime = st.st_size, st.st_mtime_ns
+            except OSError:
+                size, mtime = 0, 0
+            if file.metadata:
+                template = file.metadata.inputtemplate if basedir == 'input' else (file.metadata.provenance.outputtemplate_id if file.metadata.provenance else None)
+                entries.append( ManifestEntry(filename, template, file.metadata.__class__.__name__, size, file.viewers, file.converters, mtime) )
+            else:
+                entries.append( ManifestEntry(filename, size=size, mtime=mtime) )
+            if complete and timeout and time.time() - begintime >= timeout:
+                if log: log("Loading " + basedir + " index is taking too long, enabling quick mode")
+                complete = False
+    return entries, directories, complete
+
+def load(projectpath, basedir, profiles):
+    """Loads the manifest, returns a list of ManifestEntry instances, or None if there is no valid manifest"""
+    try:
+        with open(manifestfile(projectpath, basedir),'r',encoding='utf-8') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    prefix = os.path.join(projectpath, basedir)
+    for directory, mtime in data['directories'].items():
+        try:
+            if os.stat(os.path.join(prefix, directory)).st_mtime_ns != mtime:
+                return None
+        except OSError:
+            return None
+    templatemap = templates(profiles, basedir)
+    entries = []
+    for fields in data['files']:
+        if len(fields) != 7:
+            return None #manifest of an earlier version
+        filename, templateid, format, size, viewerids, converterids, mtime = fields
+        try:
+            st = os.stat(os.path.join(prefix, filename))
+        except OSError:
+            return None
+        if st.st_mtime_ns != mtime or st.st_size != size:
+            return None #rewritten in place
+        viewers = []
+        converters = []
+        template = templatemap.get(templateid)
+        if template is not None:
+            viewers = [ viewer for viewer in template.viewers if viewer.id in viewerids ]
+            converters = [ converter for converter in template.converters if converter.id in converterids ]
+        entries.append( ManifestEntry(filename, templateid, format, size, viewers, converters, mtime) )
+    return entries
+
+def save(projectpath, basedir, entries, directories):
+    filename = manifestfile(projectpath, basedir)
+    tmpfile = filename + '.' + str(os.getpid())
+    with open(tmpfile,'w',encoding='utf-8') as f:
+        json.dump({'directories': directories, 'files': [ entry.json() for entry in entries ]}, f, ensure_ascii=False)
+    os.replace(tmpfile, filename)
+
+def get(projectpath, basedir, profiles, quick=False, timeout=0, log=None, settle=1.0):
+    """Returns a list of ManifestEntry instances for all files in the input or output directory of the project, from the manifest if it is still valid, otherwise the manifest is rebuilt.
+    A manifest is not stored if any directory or file was modified less than *settle* seconds ago, as further modifications within the timestamp granularity of the filesystem would go unnoticed."""
+    entries = load(projectpath, basedir, profiles)
+    if entries is None:
+        entries, directories, complete = build(projectpath, basedir, profiles, quick, timeout, log)
+        if complete and all( time.time() - mtime / 1e9 >= settle for mtime in list(directories.values()) + [ entry.mtime for entry in entries ] ):
+            try:
+                save(projectpath, basedir, entries, directories)
+            except (IOError, OSError) as e:
+                if log: log("Unable to save " + basedir + " manifest: " + str(e))
+    return entries
+
+def select(entries, template=None, glob=None, offset=0, limit=None):
+    """Selects the entries with the specified template (ID) and/or a filename matching the glob pattern, and returns the page starting at offset with at most limit entries (no limit if None), along with the total number of entries selected"""
+    if template:
+        entries = [ entry for entry in entries if entry.template == template ]
+    if glob:
+        entries = [ entry for entry in entries if fnmatch.fnmatchcase(entry.filename, glob) ]
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("Offset and limit must not be negative")
+    if limit is None:
+        return entries[offset:], len(entries)
+    return entries[offset:offset+limit], len(entries)
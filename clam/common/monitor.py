@@ -0,0 +1,189 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Resource monitor --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Monitors the resource consumption (memory, cpu time, I/O) of a process and all of its descendants, by reading /proc or the cgroup (v2) of the process directly, without forking any external tools"""
+
+import os
+import json
+
+CGROUPROOT = "/sys/fs/cgroup"
+
+try:
+    CLOCKTICKS = os.sysconf('SC_CLK_TCK')
+except (ValueError, OSError, AttributeError):
+    CLOCKTICKS = 100
+
+def readfile(filename):
+    """Returns the contents of a small (pseudo)file, or None if it can not be read (e.g. the process no longer exists)"""
+    try:
+        with open(filename,'r') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+def cgroupof(pid):
+    """Returns the path of the cgroup (v2) the process is in, or None if not available"""
+    data = readfile("/proc/" + str(pid) + "/cgroup")
+    if data:
+        for line in data.split("\n"):
+            if line.startswith("0::"):
+                return line[3:].strip()
+    return None
+
+
+class ResourceMonitor:
+    """Resource monitor for a process tree rooted at the given pid. Call sample() periodically and finish() once the process has been reaped."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.cgroup = None
+        cgroup = cgroupof(pid)
+        if cgroup is not None and cgroup != cgroupof(os.getpid()) and os.path.exists(CGROUPROOT + cgroup + "/memory.current"):
+            #the job has a cgroup of its own (it is not shared with us), that gives us exact accounting of all descendants
+            self.cgroup = CGROUPROOT + cgroup
+        ownpid = str(os.getpid())
+        self.childrensupported = os.path.exists("/proc/" + ownpid + "/task/" + ownpid + "/children") #not all kernels provide it (CONFIG_PROC_CHILDREN)
+        self.rss = 0 #current resident memory (in kB) of the process tree
+        self.peakrss = 0 #in kB
+        self.cputime = 0.0 #in seconds
+        self.readbytes = 0
+        self.writebytes = 0
+        self.samples = 0
+
+    def processes(self):
+        """Returns the pids of the process and all its descendants"""
+        if not self.childrensupported:
+            return self.scanprocesses()
+        pids = []
+        queue = [self.pid]
+        while queue:
+            pid = queue.pop()
+            pids.append(pid)
+            try:
+                tasks = os.listdir("/proc/" + str(pid) + "/task")
+            except OSError:
+                continue #the process exited meanwhile, so have its children (or they were reparented)
+            for task in tasks: #children forked by any of the threads of the process
+                children = readfile("/proc/" + str(pid) + "/task/" + task + "/children")
+                if children: #None if the thread exited meanwhile
+                    queue += [ int(child) for child in children.split() ]
+        return pids
+
+    def scanprocesses(self):
+        """Returns the pids of the process and all its descendants by scanning all of /proc (used if the kernel has no /proc/pid/task/tid/children)"""
+        children = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                stat = readfile("/proc/" + entry + "/stat")
+                if stat:
+                    ppid = int(stat[stat.rfind(')') + 2:].split()[1])
+                    children.setdefault(ppid, []).append(int(entry))
+        pids = []
+        queue = [self.pid]
+        while queue:
+            pid = queue.pop()
+            pids.append(pid)
+            queue += children.get(pid, [])
+        return pids
+
+    def sample(self):
+        """Measures the current resource consumption, returns the resident memory of the entire process tree (in kB)"""
+        if self.cgroup:
+            self.samplecgroup()
+        else:
+            self.sampleprocesses()
+        self.samples += 1
+        self.peakrss = max(self.peakrss, self.rss)
+        return self.rss
+
+    def samplecgroup(self):
+        memory = readfile(self.cgroup + "/memory.current")
+        self.rss = int(memory) // 1024 if memory else 0
+        peak = readfile(self.cgroup + "/memory.peak")
+        if peak:
+            self.peakrss = max(self.peakrss, int(peak) // 1024)
+        cpustat = readfile(self.cgroup + "/cpu.stat")
+        if cpustat:
+            for line in cpustat.split("\n"):
+                if line.startswith("usage_usec "):
+                    self.cputime = max(self.cputime, int(line.split()[1]) / 1000000.0)
+        iostat = readfile(self.cgroup + "/io.stat")
+        if iostat:
+            readbytes = writebytes = 0
+            for field in iostat.split():
+                if field.startswith("rbytes="):
+                    readbytes += int(field[7:])
+                elif field.startswith("wbytes="):
+                    writebytes += int(field[7:])
+            self.readbytes = max(self.readbytes, readbytes)
+            self.writebytes = max(self.writebytes, writebytes)
+
+    def sampleprocesses(self):
+        rss = 0
+        cputicks = 0
+        readbytes = writebytes = 0
+        for pid in self.processes():
+            procdir = "/proc/" + str(pid) + "/"
+            status = readfile(procdir + "status")
+            if status:
+                for line in status.split("\n"):
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1])
+                        break
+            stat = readfile(procdir + "stat")
+            if stat:
+                #utime, stime, cutime, cstime; the latter two cover descendants that have already been reaped
+                fields = stat[stat.rfind(')') + 2:].split()
+                cputicks += sum( int(x) for x in fields[11:15] )
+            io = readfile(procdir + "io")
+            if io:
+                for line in io.split("\n"):
+                    if line.startswith("read_bytes:"):
+                        readbytes += int(line.split()[1])
+                    elif line.startswith("write_bytes:"):
+                        writebytes += int(line.split()[1])
+        self.rss = rss
+        #counters are cumulative, but processes that exit before their parent reaps them drop out, so keep the maximum
+        self.cputime = max(self.cputime, cputicks / float(CLOCKTICKS))
+        self.readbytes = max(self.readbytes, readbytes)
+        self.writebytes = max(self.writebytes, writebytes)
+
+    def finish(self, rusage=None):
+        """Finalise the measurements once the process has been reaped, using its resource usage as returned by os.wait4() (includes all reaped descendants)"""
+        if self.cgroup:
+            self.samplecgroup()
+        if rusage is not None:
+            self.cputime = max(self.cputime, rusage.ru_utime + rusage.ru_stime)
+            self.peakrss = max(self.peakrss, rusage.ru_maxrss) #kB on Linux
+            self.readbytes = max(self.readbytes, rusage.ru_inblock * 512)
+            self.writebytes = max(self.writebytes, rusage.ru_oublock * 512)
+        self.rss = 0
+
+    def json(self):
+        return {
+            'peakrss': round(self.peakrss / 1024.0, 2), #MB
+            'cputime': round(self.cputime, 2), #seconds
+            'readbytes': self.readbytes,
+            'writebytes': self.writebytes,
+            'samples': self.samples,
+            'source': 'cgroup' if self.cgroup else 'proc',
+        }
+
+    def write(self, filename, **kwargs):
+        """Write the statistics to a JSON file, extra keyword arguments are included as well"""
+        data = self.json()
+        data.update(kwargs)
+        with open(filename,'w',encoding='utf-8') as f:
+            json.dump(data, f)
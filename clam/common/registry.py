@@ -0,0 +1,108 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Project state registry --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Persistent registry holding the state of all projects, keyed by (user, project). It is shared between all webservice workers and the dispatchers, so the state of a project can be obtained with a single lookup rather than by probing the marker files (.pid, .done, .aborted) in the project directory."""
+
+#pylint: disable=too-many-arguments
+
+import os
+import time
+import sqlite3
+import threading
+
+import clam.common.status
+
+REGISTRYFILE = '.registry.sqlite' #stored in the projects/ directory
+
+FIELDS = ('status','pid','exitcode','aborted','completion','message','updated')
+
+class Registry:
+    """Project state registry backed by SQLite. Connections are opened lazily, one per thread and process."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.OperationalError:
+                pass #not supported on this filesystem, fall back to the default rollback journal
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS projects (user TEXT NOT NULL, project TEXT NOT NULL, status INTEGER NOT NULL DEFAULT 0, pid INTEGER NOT NULL DEFAULT 0, exitcode INTEGER, aborted INTEGER NOT NULL DEFAULT 0, completion INTEGER NOT NULL DEFAULT 0, message TEXT, updated REAL, PRIMARY KEY (user, project))")
+            conn.execute("CREATE TABLE IF NOT EXISTS queue (user TEXT NOT NULL, project TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, submitted REAL NOT NULL, command TEXT NOT NULL, cwd TEXT, path TEXT NOT NULL, PRIMARY KEY (user, project))") #job queue, see clam.common.scheduler
+            conn.execute("CREATE TABLE IF NOT EXISTS scheduler (id INTEGER PRIMARY KEY, maxrunning INTEGER NOT NULL, maxperuser INTEGER NOT NULL, priorities TEXT NOT NULL, requirements TEXT)") #limits of the scheduler, as configured in the webservice
+            if 'requirements' not in [ row[1] for row in conn.execute("PRAGMA table_info(scheduler)") ]:
+                try:
+                    conn.execute("ALTER TABLE scheduler ADD COLUMN requirements TEXT") #registry created by an earlier version
+                except sqlite3.OperationalError:
+                    pass #added by another process meanwhile
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, user, project):
+        """Returns the state of the project as a dictionary, or None if the project is not registered"""
+        row = self.connection().execute("SELECT * FROM projects WHERE user=? AND project=?", (user, project)).fetchone()
+        if row is None:
+            return None
+        return dict(row)
+
+    def set(self, user, project, **kwargs):
+        """Registers or updates the state of a project, only the specified fields are changed"""
+        for key in kwargs:
+            if key not in FIELDS:
+                raise KeyError("Invalid registry field: " + key)
+        kwargs['updated'] = time.time()
+        keys = sorted(kwargs)
+        values = [ kwargs[key] for key in keys ]
+        conn = self.connection()
+        transaction = not conn.in_transaction #the caller (e.g. the scheduler) may already hold one
+        if transaction: conn.execute("BEGIN IMMEDIATE")
+        try:
+            #no UPSERT (INSERT ... ON CONFLICT DO UPDATE), it requires SQLite 3.24 or later
+            conn.execute("INSERT OR IGNORE INTO projects (user, project) VALUES (?, ?)", (user, project))
+            conn.execute("UPDATE projects SET " + ", ".join( key + "=?" for key in keys) + " WHERE user=? AND project=?", values + [user, project])
+            if transaction: conn.execute("COMMIT")
+        except:
+            if transaction: conn.execute("ROLLBACK")
+            raise
+
+    def setpid(self, user, project, pid):
+        """Sets the pid of a running project, but only if no pid was registered yet (the dispatcher may already have registered the pid of the actual process)"""
+        self.connection().execute("UPDATE projects SET pid=?, updated=? WHERE user=? AND project=? AND status=? AND pid=0", (pid, time.time(), user, project, clam.common.status.RUNNING))
+
+    def delete(self, user, project):
+        self.connection().execute("DELETE FROM queue WHERE user=? AND project=?", (user, project))
+        self.connection().execute("DELETE FROM projects WHERE user=? AND project=?", (user, project))
+
+    def counts(self):
+        """Returns a dictionary mapping status codes to the number of projects (of all users) with that status"""
+        return { row[0]: row[1] for row in self.connection().execute("SELECT status, COUNT(*) FROM projects GROUP BY status") }
+
+    def projects(self, user):
+        """Returns a dictionary mapping project names to states for all registered projects of the user"""
+        return { row['project']: dict(row) for row in self.connection().execute("SELECT * FROM projects WHERE user=?", (user,)) }
+
+
+def fromprojectpath(projectpath):
+    """Returns a (registry, user, project) tuple for the given project directory (ROOT/projects/user/project/)"""
+    projectpath = os.path.abspath(projectpath)
+    userpath = os.path.dirname(projectpath)
+    return Registry(os.path.join(os.path.dirname(userpath), REGISTRYFILE)), os.path.basename(userpath), os.path.basename(projectpath)
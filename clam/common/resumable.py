@@ -0,0 +1,154 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Resumable uploads --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Resumable uploads. A large input file can be sent in chunks, each written at its offset in a partial file in the project directory. Which byte ranges have been received is recorded alongside, so after a dropped connection the client asks what is missing and continues from there rather than starting over. Once all bytes are in, the upload is finalised and the file is added as an input file like any other. Chunks may arrive concurrently and in any order; updates of the received ranges are serialised with an fcntl lock."""
+
+import os
+import json
+import time
+import fcntl
+import random
+import shutil
+from contextlib import contextmanager
+
+UPLOADDIR = '.uploads'
+
+CHUNKSIZE = 64 * 1024 #size of the blocks in which chunks are copied to disk (in bytes)
+
+def path(projectpath, uploadid=''):
+    """Returns the path of the directory holding the resumable uploads of a project, or of the specified upload within it"""
+    return os.path.join(projectpath, UPLOADDIR, uploadid)
+
+def datapath(projectpath, uploadid):
+    """Returns the path of the file the upload is received in"""
+    return path(projectpath, uploadid) + '.part'
+
+def validid(uploadid):
+    """Checks whether the upload ID is well-formed, it is used in paths"""
+    return len(uploadid) == 32 and all( c in '0123456789abcdef' for c in uploadid )
+
+@contextmanager
+def lock(projectpath, uploadid):
+    fd = os.open(path(projectpath, uploadid) + '.lock', os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd) #releases the lock
+
+def create(projectpath, filename, size, fields):
+    """Initiates a resumable upload of the specified size (in bytes), fields holds the request parameters to add the file with once it is complete (such as the input template and metadata). Returns the state of the new upload"""
+    if size < 0:
+        raise ValueError("Invalid size")
+    os.makedirs(path(projectpath), exist_ok=True)
+    uploadid = "%032x" % random.getrandbits(128)
+    with open(datapath(projectpath, uploadid),'wb') as f:
+        f.truncate(size)
+    state = {'id': uploadid, 'filename': filename, 'size': size, 'fields': fields, 'received': [], 'created': time.time()}
+    save(projectpath, state)
+    return state
+
+def save(projectpath, state):
+    tmpfile = path(projectpath, state['id']) + '.json.tmp'
+    with open(tmpfile,'w',encoding='utf-8') as f:
+        json.dump(state, f)
+    os.rename(tmpfile, path(projectpath, state['id']) + '.json')
+
+def load(projectpath, uploadid):
+    """Returns the state of the upload, or None if it does not exist"""
+    if not validid(uploadid):
+        return None
+    try:
+        with open(path(projectpath, uploadid) + '.json','r',encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def merge(ranges, begin, end):
+    """Adds the range [begin, end) to a sorted list of non-overlapping ranges, merging adjacent and overlapping ones. Returns the new list"""
+    merged = []
+    for rbegin, rend in ranges:
+        if rend < begin or rbegin > end:
+            merged.append([rbegin, rend])
+        else:
+            begin = min(begin, rbegin)
+            end = max(end, rend)
+    merged.append([begin, end])
+    return sorted(merged)
+
+def complete(state):
+    """Checks whether all bytes of the upload have been received"""
+    return state['received'] == [[0, state['size']]] or state['size'] == 0
+
+def missing(state):
+    """Returns the byte ranges that have not been received yet, as a list of [begin, end) pairs"""
+    ranges = []
+    offset = 0
+    for begin, end in state['received']:
+        if begin > offset:
+            ranges.append([offset, begin])
+        offset = end
+    if offset < state['size']:
+        ranges.append([offset, state['size']])
+    return ranges
+
+def write(projectpath, uploadid, offset, stream, length=None):
+    """Writes a chunk read from the stream at the specified offset of the upload, and records it as received. Raises ValueError if the chunk does not fit in the upload. Returns the new state of the upload, or None if it does not exist"""
+    state = load(projectpath, uploadid)
+    if state is None:
+        return None
+    if offset < 0 or offset > state['size'] or (length is not None and offset + length > state['size']):
+        raise ValueError("Chunk does not fit in the upload")
+    end = offset
+    with open(datapath(projectpath, uploadid),'r+b') as f:
+        f.seek(offset)
+        while True:
+            data = stream.read(CHUNKSIZE)
+            if not data:
+                break
+            if end + len(data) > state['size']:
+                raise ValueError("Chunk does not fit in the upload")
+            f.write(data)
+            end += len(data)
+    if end == offset:
+        return state
+    with lock(projectpath, uploadid):
+        state = load(projectpath, uploadid) #others may have written chunks meanwhile
+        if state is None:
+            return None
+        state['received'] = merge(state['received'], offset, end)
+        save(projectpath, state)
+    return state
+
+def remove(projectpath, uploadid):
+    """Removes the upload, returns False if it did not exist"""
+    found = False
+    for extension in ('.part', '.json', '.lock'):
+        if os.path.exists(path(projectpath, uploadid) + extension):
+            os.unlink(path(projectpath, uploadid) + extension)
+            found = True
+    return found
+
+def expire(projectpath, maxage):
+    """Removes uploads that were initiated more than maxage seconds ago"""
+    if not os.path.isdir(path(projectpath)):
+        return
+    for filename in os.listdir(path(projectpath)):
+        if filename.endswith('.json'):
+            state = load(projectpath, filename[:-5])
+            if state is not None and time.time() - state['created'] > maxage:
+                remove(projectpath, state['id'])
+    if not os.listdir(path(projectpath)):
+        shutil.rmtree(path(projectpath), ignore_errors=True)
@@ -0,0 +1,171 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Job scheduler --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Persistent job queue with a scheduler that admits jobs according to a global and a per-user number of concurrency slots, and only while the system resources (memory, load, disk space) suffice. The queue is held in the project registry, the webservice submits jobs and every dispatcher invokes the scheduler when it finishes (successfully or not), so queued projects start as soon as a slot frees up. The webservice also invokes it periodically, to start projects that were queued for lack of resources once these are available again. The webservice stores its limits in the registry, for the dispatchers to use."""
+
+import os
+import sys
+import time
+import json
+import subprocess
+
+import clam.common.status
+import clam.common.admission
+
+class Scheduler:
+    def __init__(self, registry, maxrunning=0, maxperuser=0, priorities=None, log=None, sampler=None, requirements=None):
+        self.registry = registry
+        self.maxrunning = maxrunning #0 = unlimited
+        self.maxperuser = maxperuser #0 = unlimited
+        self.priorities = priorities if priorities else {} #maps users to priorities (higher goes first, default 0)
+        self.log = log
+        self.sampler = sampler #clam.common.admission.ResourceSampler, if set jobs are only admitted when the system resources meet the requirements
+        self.requirements = requirements if requirements else {} #keyword arguments for ResourceSampler.check() (requirememory, maxloadavg, mindiskspace)
+
+    @staticmethod
+    def load(registry, log=None):
+        """Returns a scheduler with the limits stored in the registry by the webservice, or an unlimited one if none were stored"""
+        row = registry.connection().execute("SELECT * FROM scheduler WHERE id=1").fetchone()
+        if row is None:
+            return Scheduler(registry, log=log)
+        sampler = None
+        requirements = json.loads(row['requirements']) if row['requirements'] else {}
+        if requirements:
+            #sampled on demand, no need for a background thread
+            sampler = clam.common.admission.ResourceSampler(requirements.pop('path'), background=False)
+        return Scheduler(registry, row['maxrunning'], row['maxperuser'], json.loads(row['priorities']), log, sampler, requirements)
+
+    def save(self):
+        """Stores the limits in the registry"""
+        requirements = dict(self.requirements, path=self.sampler.path) if self.sampler is not None and self.requirements else {}
+        self.registry.connection().execute("INSERT OR REPLACE INTO scheduler (id, maxrunning, maxperuser, priorities, requirements) VALUES (1, ?, ?, ?, ?)", (self.maxrunning, self.maxperuser, json.dumps(self.priorities), json.dumps(requirements)))
+
+    def printlog(self, msg):
+        if self.log:
+            self.log(msg)
+        else:
+            print("[CLAM Scheduler] " + msg, file=sys.stderr)
+
+    def submit(self, user, project, command, cwd, projectpath):
+        """Submit a job, it is launched immediately if a slot and sufficient system resources are available and otherwise queued. Returns the pid of the launched job, 0 if it was queued, or None if launching failed"""
+        conn = self.registry.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.registry.set(user, project, status=clam.common.status.QUEUED, pid=0, exitcode=None, aborted=0, completion=0, message=None)
+            conn.execute("INSERT OR REPLACE INTO queue (user, project, priority, submitted, command, cwd, path) VALUES (?, ?, ?, ?, ?, ?, ?)", (user, project, self.priorities.get(user, 0), time.time(), command, cwd, projectpath))
+            jobs = self.admit(conn)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        pid = 0
+        for job in jobs:
+            jobpid = self.launch(job)
+            if job['user'] == user and job['project'] == project:
+                pid = jobpid
+        if pid == 0:
+            self.printlog("Queued project " + project + " of user " + user)
+        return pid
+
+    def schedule(self):
+        """Launch as many queued jobs as there are free slots (if the system resources suffice), returns the number of launched jobs"""
+        conn = self.registry.connection()
+        if conn.execute("SELECT 1 FROM queue LIMIT 1").fetchone() is None:
+            return 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            jobs = self.admit(conn)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        for job in jobs:
+            self.launch(job)
+        return len(jobs)
+
+    def cancel(self, user, project):
+        """Remove a job from the queue, returns True if it was queued"""
+        conn = self.registry.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cancelled = conn.execute("DELETE FROM queue WHERE user=? AND project=?", (user, project)).rowcount > 0
+            if cancelled:
+                self.registry.set(user, project, status=clam.common.status.READY, pid=0)
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        return cancelled
+
+    def position(self, user, project):
+        """Returns the position of the job in the queue (1 = next in line), or 0 if it is not queued"""
+        conn = self.registry.connection()
+        job = conn.execute("SELECT priority, submitted FROM queue WHERE user=? AND project=?", (user, project)).fetchone()
+        if job is None:
+            return 0
+        return conn.execute("SELECT COUNT(*) FROM queue WHERE priority > ? OR (priority = ? AND submitted < ?)", (job['priority'], job['priority'], job['submitted'])).fetchone()[0] + 1
+
+    def admit(self, conn):
+        """Selects the queued jobs that can be started now and marks them as running, must be called within a transaction"""
+        if self.sampler is not None and self.requirements:
+            sufficient, _ = self.sampler.check(**self.requirements)
+            if not sufficient:
+                return [] #not enough system resources, the jobs remain queued until they are
+        running = {}
+        for row in conn.execute("SELECT user, pid, updated FROM projects WHERE status=?", (clam.common.status.RUNNING,)):
+            if alive(row['pid'], row['updated']):
+                running[row['user']] = running.get(row['user'], 0) + 1
+        total = sum(running.values())
+        jobs = []
+        for job in conn.execute("SELECT * FROM queue ORDER BY priority DESC, submitted ASC"):
+            if self.maxrunning and total >= self.maxrunning:
+                break
+            if self.maxperuser and running.get(job['user'], 0) >= self.maxperuser:
+                continue
+            jobs.append(dict(job))
+            total += 1
+            running[job['user']] = running.get(job['user'], 0) + 1
+        for job in jobs:
+            conn.execute("DELETE FROM queue WHERE user=? AND project=?", (job['user'], job['project']))
+            self.registry.set(job['user'], job['project'], status=clam.common.status.RUNNING, pid=0)
+        return jobs
+
+    def launch(self, job):
+        """Launch a job that has been admitted, returns its pid (or None on failure)"""
+        self.printlog("Launching project " + job['project'] + " of user " + job['user'])
+        try:
+            #the job is started in a session of its own, so it outlives a dispatcher that launches it
+            process = subprocess.Popen(job['command'], cwd=job['cwd'], shell=True, start_new_session=True)
+        except OSError as e:
+            self.printlog("Unable to launch project " + job['project'] + " of user " + job['user'] + ": " + str(e))
+            self.registry.set(job['user'], job['project'], status=clam.common.status.READY, pid=0)
+            return None
+        with open(os.path.join(job['path'], '.pid'),'w') as f: #will be handled by dispatcher!
+            f.write(str(process.pid))
+        self.registry.setpid(job['user'], job['project'], process.pid)
+        return process.pid
+
+
+def alive(pid, updated):
+    """Checks whether a registered running process is still alive (a pid of 0 means it is being launched)"""
+    if pid == 0:
+        return time.time() - updated <= 60
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
@@ -0,0 +1,71 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Input sequence numbers --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Sequence numbers of the input files of non-unique input templates. The next free sequence number of each input template is kept in a small state file in the project directory, so adding a file need not scan the input directory for the sequence numbers in use. Numbers are reserved under an fcntl lock, so concurrent uploads never get the same one. The state of an input template is rebuilt from the input files (by a single scan) only when it is missing."""
+
+import os
+import json
+import fcntl
+from contextlib import contextmanager
+
+SEQUENCEFILE = '.sequences'
+
+@contextmanager
+def lock(projectpath):
+    fd = os.open(os.path.join(projectpath, SEQUENCEFILE + '.lock'), os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd) #releases the lock
+
+def load(projectpath):
+    """Returns the next free sequence number of each input template (a dictionary), for as far as known"""
+    try:
+        with open(os.path.join(projectpath, SEQUENCEFILE),'r',encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def save(projectpath, state):
+    tmpfile = os.path.join(projectpath, SEQUENCEFILE + '.tmp')
+    with open(tmpfile,'w',encoding='utf-8') as f:
+        json.dump(state, f)
+    os.rename(tmpfile, os.path.join(projectpath, SEQUENCEFILE))
+
+def allocate(projectpath, inputtemplate_id, scan, count=1):
+    """Reserves count consecutive sequence numbers for the input template and returns the first. If the state of the input template is missing, scan() is called to obtain the sequence numbers in use by its input files"""
+    with lock(projectpath):
+        state = load(projectpath)
+        if inputtemplate_id not in state:
+            state[inputtemplate_id] = max(scan(), default=0) + 1
+        seq = state[inputtemplate_id]
+        state[inputtemplate_id] = seq + count
+        save(projectpath, state)
+    return seq
+
+def release(projectpath, inputtemplate_id, seq, count=1):
+    """Returns count reserved sequence numbers, starting at seq, that ended up unused (the files were not accepted). They are handed out again if no later numbers have been reserved meanwhile"""
+    with lock(projectpath):
+        state = load(projectpath)
+        if state.get(inputtemplate_id) == seq + count:
+            state[inputtemplate_id] = seq
+            save(projectpath, state)
+
+def reset(projectpath):
+    """Forgets all sequence numbers, to be called when all input files are removed. They are rebuilt when needed"""
+    with lock(projectpath):
+        if os.path.exists(os.path.join(projectpath, SEQUENCEFILE)):
+            os.unlink(os.path.join(projectpath, SEQUENCEFILE))
@@ -1,10 +1,16 @@
 import io
+import os
+import re
 import time
 import sys
+import datetime
+import threading
+import collections
 
 READY = 0
 RUNNING = 1
 DONE = 2
+QUEUED = 3 #waiting for a free slot, will be started automatically
 
 
 def write(statusfile, statusmessage, completion = 0, timestamp = False, encoding = 'utf-8'):
@@ -17,3 +23,101 @@ def write(statusfile, statusmessage, completion = 0, timestamp = False, encoding
         f.write(str(completion) + "%\t" + str(timestamp) + "\t" + statusmessage + "\n")
         f.close()
 
+
+
+DATEMATCH = re.compile(r'^[\d\.\-\s:]*$')
+
+class StatusLogCache:
+    """Reads status files incrementally. The most recent parsed entries and the byte offset up to which a file was parsed are cached per file, so subsequent reads only parse lines that were appended in the meantime. At most maxentries entries are retained per file, older ones are only obtained by parsing the file anew."""
+
+    def __init__(self, maxfiles=256, maxentries=1000):
+        self.maxfiles = maxfiles
+        self.maxentries = maxentries
+        self.files = collections.OrderedDict() #statusfile => [inode, offset, entries, totalcompletion, prevmsg, count]
+        self.lock = threading.Lock()
+
+    def read(self, statusfile, limit=0):
+        """Returns (statuslog, totalcompletion), where statuslog is a list of (message, timestamp, completion) tuples, most recent first. If limit is set, only the last so many entries are returned"""
+        with self.lock:
+            cached = self.load(statusfile)
+            if cached is None:
+                return [], 0
+            if not (limit and limit <= len(cached[2])) and len(cached[2]) < cached[5]:
+                cached = self.parseall(statusfile, cached[0]) #older entries than retained are requested
+            entries = list(cached[2])
+            if limit:
+                entries = entries[-limit:]
+            entries.reverse()
+            return entries, cached[3]
+
+    def since(self, statusfile, offset=0):
+        """Returns (entries, offset, totalcompletion), where entries is a list of the (message, timestamp, completion) tuples following the first offset entries, in chronological order. The returned offset is the total number of entries, pass it on the next call to obtain only the entries that were added in the meantime"""
+        with self.lock:
+            cached = self.load(statusfile)
+            if cached is None:
+                return [], 0, 0
+            if offset > cached[5]:
+                offset = 0 #the file was replaced, start over
+            first = cached[5] - len(cached[2]) #number of entries no longer retained
+            if offset < first:
+                cached = self.parseall(statusfile, cached[0])
+                first = 0
+            return list(cached[2])[offset - first:], cached[5], cached[3]
+
+    def load(self, statusfile):
+        """Returns the cached state of the status file, parsing what was appended since the last call, or None if it does not exist. Must be called with the lock held"""
+        try:
+            st = os.stat(statusfile)
+        except OSError:
+            self.files.pop(statusfile, None)
+            return None
+        cached = self.files.pop(statusfile, None)
+        if cached is None or cached[0] != st.st_ino or st.st_size < cached[1]:
+            #new, replaced or truncated file: start from scratch
+            cached = [st.st_ino, 0, collections.deque(maxlen=self.maxentries or None), 0, None, 0]
+        if st.st_size > cached[1]:
+            self.parse(statusfile, cached)
+        self.files[statusfile] = cached
+        while len(self.files) > self.maxfiles:
+            self.files.popitem(last=False)
+        return cached
+
+    def parseall(self, statusfile, inode):
+        """Parses the entire status file, without retaining the result"""
+        cached = [inode, 0, [], 0, None, 0]
+        self.parse(statusfile, cached)
+        return cached
+
+    @staticmethod
+    def parse(statusfile, cached):
+        with open(statusfile,'rb') as f:
+            f.seek(cached[1])
+            data = f.read()
+        end = data.rfind(b"\n") + 1 #only complete lines are parsed, a line still being written is read on the next call
+        cached[1] += end
+        for line in data[:end].decode('utf-8', errors='replace').split("\n"):
+            line = line.strip()
+            if line:
+                message = ""
+                completion = 0
+                timestamp = ""
+                for field in line.split("\t"):
+                    if field:
+                        if field[-1] == '%' and field[:-1].isdigit():
+                            completion = int(field[:-1])
+                            if completion > 0:
+                                cached[3] = completion
+                        elif DATEMATCH.match(field):
+                            if field.isdigit():
+                                try:
+                                    d = datetime.datetime.fromtimestamp(float(field))
+                                    timestamp = d.strftime("%d/%b/%Y %H:%M:%S")
+                                except ValueError:
+                                    pass
+                        else:
+                            message += " " + field
+
+                if message and (message != cached[4]):
+                    cached[2].append( (message.strip(), timestamp, completion) )
+                    cached[4] = message
+                    cached[5] += 1
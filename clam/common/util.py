@@ -14,41 +14,141 @@
 
 #pylint: disable=global-statement
 
-import glob
 import os
 import sys
 import datetime
 import io
+import stat
+import fnmatch
+import threading
+import concurrent.futures
 
 DEBUGLOG = sys.stderr
 LOG = sys.stdout
 
 DEBUG = False
 
+SYMLINKINDEX = threading.local() #per-thread memo of symlink indices, see symlinkindex()
+
 def globsymlinks(pattern, recursion=True):
-    for f in glob.glob(pattern):
-        if os.path.islink(f):
-            yield f, os.readlink(f)
-    if recursion:
-        for d in os.listdir(os.path.dirname(pattern)):
-            if os.path.isdir(d):
-                for linkf,realf in globsymlinks(d + '/' + os.path.basename(pattern),recursion):
-                    yield linkf,realf
-
-def computediskusage(path):
+    """Yields (link, target) tuples for all symbolic links matching the pattern (only the last component may hold wildcards). If recursion is enabled, matching links in subdirectories are included too. The directory is scanned once"""
+    directory, basepattern = os.path.split(pattern)
+    try:
+        entries = list(os.scandir(directory or '.'))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_symlink():
+            if fnmatch.fnmatchcase(entry.name, basepattern):
+                yield entry.path, os.readlink(entry.path)
+        elif recursion and entry.is_dir(follow_symlinks=False):
+            yield from globsymlinks(os.path.join(entry.path, basepattern), recursion)
+
+def buildsymlinkindex(directory):
+    """Builds an index of the template links (.filename.INPUTTEMPLATE.id.seqnr or .filename.OUTPUTTEMPLATE.id.seqnr) in and under the directory, in a single scan: a dictionary mapping INPUTTEMPLATE/OUTPUTTEMPLATE to a dictionary mapping template IDs to sorted lists of (seqnr, link, target) tuples"""
+    index = {}
+    for linkf, realf in globsymlinks(os.path.join(directory, '.*'), True):
+        head, kind, rest = os.path.basename(linkf).rpartition('.INPUTTEMPLATE.')
+        if not kind:
+            head, kind, rest = os.path.basename(linkf).rpartition('.OUTPUTTEMPLATE.')
+        templateid, _, seqnr = rest.rpartition('.')
+        if not head or not templateid or not seqnr.isdigit():
+            continue
+        index.setdefault(kind.strip('.'), {}).setdefault(templateid, []).append( (int(seqnr), linkf, realf) )
+    for templates in index.values():
+        for links in templates.values():
+            links.sort()
+    return index
+
+def symlinkindex(directory, kind='INPUTTEMPLATE'):
+    """Returns the index of the template links of the specified kind (INPUTTEMPLATE or OUTPUTTEMPLATE) in and under the directory: a dictionary mapping template IDs to sorted lists of (seqnr, link, target) tuples. The index is built once and then shared by all callers, as long as memoization is enabled for the current thread (see beginsymlinkindex()), otherwise it is built anew on each call. The index must not be modified"""
+    directory = os.path.normpath(directory)
+    memo = getattr(SYMLINKINDEX, 'memo', None)
+    if memo is None:
+        return buildsymlinkindex(directory).get(kind, {})
+    if directory not in memo:
+        memo[directory] = buildsymlinkindex(directory)
+    return memo[directory].get(kind, {})
+
+def beginsymlinkindex():
+    """Enables memoization of symlink indices for the current thread, starting afresh. The webservice does so at the start of each request"""
+    SYMLINKINDEX.memo = {}
+
+def endsymlinkindex(*args): #pylint: disable=unused-argument
+    """Disables memoization of symlink indices for the current thread"""
+    SYMLINKINDEX.memo = None
+
+def invalidatesymlinkindex(directory):
+    """Drops the memoized symlink indices of the directory and all directories above or below it, to be called whenever template links are added or removed"""
+    memo = getattr(SYMLINKINDEX, 'memo', None)
+    if memo:
+        directory = os.path.normpath(directory)
+        for key in list(memo.keys()):
+            if key == directory or key.startswith(directory + os.sep) or directory.startswith(key + os.sep):
+                del memo[key]
+
+def scandiskusage(path):
+    """Returns the total size (in bytes) and number of files under the specified directory, symbolic links are not followed nor counted"""
+    total_size = 0
+    total_files = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0, 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                size, files = scandiskusage(entry.path)
+                total_size += size
+                total_files += files
+            elif entry.is_file(follow_symlinks=False):
+                total_size += entry.stat(follow_symlinks=False).st_size
+                total_files += 1
+        except OSError:
+            #may happen if files are removed while we scan
+            pass
+    return total_size, total_files
+
+def computediskusage(path, threads=4):
+    """Computes the disk usage of a directory (in MB) and the number of files in it. This walks the entire tree (in parallel for the subdirectories), projects normally keep track of their disk usage incrementally and only use this for reconciliation"""
     total_size = 0
     total_files = 0
-    for dirpath, dirnames, filenames in os.walk(path): #pylint: disable=unused-variable
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            try:
-                total_size += os.path.getsize(fp)
+    subdirs = []
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0.0, 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                total_size += entry.stat(follow_symlinks=False).st_size
                 total_files += 1
-            except:
-                #may happen in case of dangling symlinks
-                pass
+        except OSError:
+            pass
+    if len(subdirs) > 1 and threads > 1:
+        with concurrent.futures.ThreadPoolExecutor(min(threads, len(subdirs))) as executor:
+            results = list(executor.map(scandiskusage, subdirs))
+    else:
+        results = [ scandiskusage(subdir) for subdir in subdirs ]
+    for size, files in results:
+        total_size += size
+        total_files += files
     return total_size / 1024 / 1024, total_files #MB
 
+def filesize(*filenames):
+    """Returns the combined size (in MB) of the specified files, missing files and symbolic links count as zero"""
+    total_size = 0
+    for filename in filenames:
+        try:
+            st = os.lstat(filename)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            total_size += st.st_size
+    return total_size / 1024 / 1024 #MB
+
 
 def setlog(log):
     global LOG
@@ -126,25 +126,77 @@ else:
 
 
 
+#The following limits protect the system against overload: with the project registry enabled (PROJECTREGISTRY, default), projects started while any of them is exceeded are queued and start automatically once resources are available, otherwise they are refused
+
 #Amount of free memory required prior to starting a new process (in MB!), Free Memory + Cached (without swap!). Set to 0 to disable this check (not recommended)
 REQUIREMEMORY = 10
 
 #Maximum load average at which processes are still started (first number reported by 'uptime'). Set to 0 to disable this check (not recommended)
 #MAXLOADAVG = 4.0
 
-#Minimum amount of free diskspace in MB. Set to 0 to disable this check (not recommended)
-#DISK = '/dev/sda1' #set this to the disk where ROOT is on
+#Minimum amount of free diskspace in MB on the disk where ROOT is on. Set to 0 to disable this check (not recommended)
 #MINDISKSPACE = 10
 
+#Interval (in seconds) at which the available memory, load and disk space are sampled (default: 5)
+#RESOURCEPOLLINTERVAL = 5
+
 #The amount of diskspace a user may use (in MB), this is a soft quota which can be exceeded, but creation of new projects is blocked until usage drops below the quota again
 #USERQUOTA = 100
 
+#The disk usage of projects is tracked incrementally, it is recomputed from scratch when a job finishes if this was last done more than this many seconds ago (default: 86400, 0 = never). Symbolic links, such as input files from preinstalled data, do not count towards the disk usage
+#DISKUSAGERECONCILE = 86400
+
+#Maximum number of projects that may run simultaneously, in total and per user. Projects started beyond this are queued and will start automatically once a slot is free. Set to 0 for no limit (default)
+#MAXCONCURRENTPROJECTS = 0
+#MAXCONCURRENTPROJECTSPERUSER = 0
+
+#Queue priorities per user, queued projects of users with a higher priority are started first (default priority is 0)
+#PRIORITIES = {'someuser': 10}
+
 #The secret key is used internally for cryptographically signing session data, in production environments, you'll want to set this to a persistent value. If not set it will be randomly generated.
 #SECRET_KEY = 'mysecret'
 
 #Allow Asynchronous HTTP requests from **web browsers** in following domains (sets Access-Control-Allow-Origin HTTP headers), by default this is unrestricted
 #ALLOW_ORIGIN = "*"
 
+#Compression level (0-9) for the archives of all output files that users can download. Archives are generated on the fly whilst they are being downloaded, lower levels use less CPU time. Set to 0 to store files without compression, useful if your outputs are already compressed (default: 6)
+#ARCHIVECOMPRESSION = 6
+
+#Maximum number of (most recent) status log entries to include in project responses, useful if your wrapper script reports progress very frequently. Set to 0 to include the entire log (default)
+#MAXSTATUSLOG = 0
+
+#Maximum number of seconds a client may wait for progress of a project in a single long polling request, or follow it in a single stream of server-sent events (default: 60). Each waiting request occupies a worker, so make sure enough are available
+#LONGPOLLTIMEOUT = 60
+
+#Allow clients to pass a callback URL when starting a project, the final state of the project (status, exit code and output files) is posted to it in JSON once the project has finished. Set to True to allow any HTTP(S) URL, or to a list of allowed URLs (scheme, host and port have to match, leave the port empty to allow any, and the path has to start with the path of the allowed URL). Disabled by default, as it lets users have the service issue requests on their behalf
+#ALLOWCALLBACKS = False
+
+#Number of times a failed callback is retried, with exponential backoff (default: 5), and the timeout in seconds of a single attempt (default: 10)
+#CALLBACKRETRIES = 5
+#CALLBACKTIMEOUT = 10
+
+#Secret used to sign callbacks, the signature is passed in the X-CLAM-Signature header (sha256=<hex HMAC of the body>) so receivers can verify callbacks originate from this service
+#CALLBACKSECRET = None
+
+#Files larger than this (in MB) are uploaded in chunks by the web interface, so an interrupted upload resumes where it left off rather than starting over (default: 64, 0 disables). The Python client does the same for files over its own threshold
+#CHUNKEDUPLOADTHRESHOLD = 64
+
+#Resumable uploads that are not finalised are removed after this many seconds (default: 86400)
+#UPLOADEXPIRY = 86400
+
+#Number of threads used to generate metadata for and validate the files extracted from an uploaded archive (default: 4)
+#UPLOADTHREADS = 4
+
+#Input files added by URL are downloaded in the background by this many threads, the request responds right away (202) with a
+#handle to poll. 0 downloads them within the request instead (default: 4)
+#FETCHTHREADS = 4
+
+#Maximum size (in MB) of an input file downloaded from a URL, 0 = unlimited (default: 0)
+#FETCHMAXSIZE = 0
+
+#Maximum time (in seconds) downloading an input file from a URL may take (default: 300)
+#FETCHTIMEOUT = 300
+
 # ======== WEB-APPLICATION STYLING =============
 
 #Choose a style (has to be defined as a CSS file in clam/style/ ). You can copy, rename and adapt it to make your own style
@@ -310,10 +362,12 @@ ACTIONS = [
 #DISPATCHER = 'clamdispatcher.py'
 
 #DISPATCHER_POLLINTERVAL = 30   #interval at which the dispatcher polls for resource consumption (default: 30 secs)
-#DISPATCHER_MAXRESMEM = 0    #maximum consumption of resident memory (in megabytes), processes that exceed this will be automatically aborted. (0 = unlimited, default)
+#DISPATCHER_MAXRESMEM = 0    #maximum consumption of resident memory (in megabytes) of the process and all its descendants, processes that exceed this will be automatically aborted. (0 = unlimited, default)
 #DISPATCHER_MAXTIME = 0      #maximum number of seconds a process may run, it will be aborted if this duration is exceeded.   (0=unlimited, default)
 #DISPATCHER_PYTHONPATH = []        #list of extra directories to add to the python path prior to launch of dispatcher
 
+#PROJECTREGISTRY = True    #keep the state of all projects in a shared registry (ROOT/projects/.registry.sqlite) that is updated by the dispatcher, rather than probing files in the project directory on each request. Disable this if ROOT is on a network filesystem that does not support proper locking (default: True)
+
 #Run background process on a remote host? Then set the following (leave the lambda in):
 #REMOTEHOST = lambda: return 'some.remote.host'
 #REMOTEUSER = 'username'
@@ -89,6 +89,9 @@ assert TEST_DUMMY == "test"   #a test, you never need/want this in your own conf
 #The amount of diskspace a user may use (in MB), this is a soft quota which can be exceeded, but creation of new projects is blocked until usage drops below the quota again
 USERQUOTA = 10
 
+#Allow clients to pass a callback URL when starting a project, restricted to local receivers here
+ALLOWCALLBACKS = ['http://localhost:', 'http://127.0.0.1:']
+
 # ======== WEB-APPLICATION STYLING =============
 
 #Choose a style (has to be defined as a CSS file in style/ )
@@ -11,7 +11,7 @@
  ***********************************************************/
 
 /*eslint-env browser,jquery */
-/*global stage,progress:true,user,accesstoken,oauth_access_token, preselectinputtemplate,baseurl,project, inputtemplates,parametersxsl:true, tableinputfiles:true */
+/*global stage,progress:true,queued,user,accesstoken,oauth_access_token, preselectinputtemplate,baseurl,project, inputtemplates,parametersxsl:true, tableinputfiles:true */
 //global but not used: systemid
 /*eslint-disable quotes, no-alert,complexity,curly,eqeqeq */
 
@@ -204,7 +204,7 @@ function pollstatus() {
         dataType: 'json',
         data: {accesstoken: accesstoken, user: user},
         success: function(response){
-                if (response.statuscode !== 1) {
+                if ((response.statuscode !== 1 && response.statuscode !== 3) || (response.statuscode === 1 && typeof(queued) != 'undefined' && queued)) { /* 3 = queued */
                     if (oauth_access_token !== "") {
                       window.location.href = baseurl + '/' + project + '/?oauth_access_token=' + oauth_access_token; /* refresh */
                     } else {
@@ -340,6 +340,105 @@ function quickdelete(projectname) {//eslint-disable-line no-unused-vars
         }});
 }
 
+function chunkedupload(file, params) {
+    //Uploads a large file in chunks (resumable upload), chunks that fail are sent again after asking the service what it has received
+    var url = baseurl + '/' + project + '/uploads/';
+    var chunksize = 8 * 1024 * 1024;
+    var failures = 0;
+    var file_params = $.extend({}, params, {'filename': file.name, 'size': file.size});
+    delete file_params.accesstoken;
+    delete file_params.user;
+    $('#uploadprogress').show();
+    var progress = function(upload) {
+        $('#uploadprogress strong').html("Upload of " + upload.filename + " in progress (" + Math.floor(100 * (upload.size - upload.missing.reduce(function(total, range) { return total + range[1] - range[0]; }, 0)) / Math.max(upload.size,1)) + "%)... Please wait...");
+    };
+    var finish = function(upload) {
+        $.ajax({
+            type: "POST",
+            url: url + upload.id,
+            dataType: "xml",
+            beforeSend: oauthheader,
+            crossDomain: true,
+            xhrFields: {
+              withCredentials: true
+            },
+            success: function(response){
+                processuploadresponse(response, '#uploadparameters');
+                $('#uploadprogress').hide();
+            },
+            error: function(response, errortype){ //eslint-disable-line no-unused-vars
+                processuploadresponse(response.responseXML, '#uploadparameters');
+                $('#uploadprogress').hide();
+            }
+        });
+    };
+    var send = function(upload) {
+        progress(upload);
+        if (upload.missing.length === 0) {
+            finish(upload);
+            return;
+        }
+        var begin = upload.missing[0][0];
+        var end = Math.min(upload.missing[0][1], begin + chunksize);
+        $.ajax({
+            type: "PUT",
+            url: url + upload.id + "?offset=" + begin,
+            data: file.slice(begin, end),
+            processData: false,
+            contentType: "application/octet-stream",
+            dataType: "json",
+            beforeSend: oauthheader,
+            crossDomain: true,
+            xhrFields: {
+              withCredentials: true
+            },
+            success: function(response){
+                failures = 0;
+                send(response);
+            },
+            error: function(response, errortype){ //eslint-disable-line no-unused-vars
+                failures++;
+                if ((failures > 10) || ((response.status >= 400) && (response.status < 500))) {
+                    $('#uploadprogress').hide();
+                    alert("Uploading " + file.name + " failed: " + response.responseText);
+                    return;
+                }
+                //ask the service what it has received and resume from there
+                window.setTimeout(function(){
+                    $.ajax({
+                        type: "GET",
+                        url: url + upload.id,
+                        dataType: "json",
+                        beforeSend: oauthheader,
+                        crossDomain: true,
+                        xhrFields: {
+                          withCredentials: true
+                        },
+                        success: send,
+                        error: function(){ send(upload); }
+                    });
+                }, 1000 * Math.pow(2, Math.min(failures, 5)));
+            }
+        });
+    };
+    $.ajax({
+        type: "POST",
+        url: url,
+        data: file_params,
+        dataType: "json",
+        beforeSend: oauthheader,
+        crossDomain: true,
+        xhrFields: {
+          withCredentials: true
+        },
+        success: send,
+        error: function(response, errortype){ //eslint-disable-line no-unused-vars
+            $('#uploadprogress').hide();
+            alert(response.responseText);
+        }
+    });
+}
+
 function addformdata(parent, data) {
     var fields = $(parent).find(':input');
     $(fields).each(function(){ //also works on textarea, select, button!
@@ -723,25 +822,58 @@ function initclam() { //eslint-disable-line no-unused-vars, complexity
             $('#urlupload').hide();
             $('#urluploadprogress').show();
 
+            var finish = function(responsexml) {
+                processuploadresponse(responsexml, '#urluploadparameters');
+                $('#urluploadprogress').hide();
+                $('#urlupload').show();
+            };
+            //the service fetches the file in the background and responds with 202 and the state of the fetch, which we poll until the file has been added
+            var poll = function(fetch) {
+                if (fetch.status == 'fetching') {
+                    setTimeout(function(){
+                        $.ajax({
+                            type: "GET",
+                            url: fetch.poll,
+                            dataType: "json",
+                            beforeSend: oauthheader,
+                            crossDomain: true,
+                            xhrFields: {
+                              withCredentials: true
+                            },
+                            success: poll,
+                            error: function(response, errortype){ //eslint-disable-line no-unused-vars
+                                alert("Unable to follow the download of " + fetch.url);
+                                finish(null);
+                            }
+                        });
+                    }, 1000);
+                } else if ((fetch.result) && (fetch.result.charAt(0) == '<')) {
+                    finish($.parseXML(fetch.result));
+                } else {
+                    alert(fetch.error + ((fetch.result) ? ": " + fetch.result : ""));
+                    finish(null);
+                }
+            };
+
             $.ajax({
                 type: "POST",
                 url: baseurl + '/' + project + "/input/" + filename,
-                dataType: "xml",
+                dataType: "text",
                 data: {'url': $('#urluploadfile').val(), 'inputtemplate': $('#urluploadinputtemplate').val() },
                 beforeSend: oauthheader,
                 crossDomain: true,
                 xhrFields: {
                   withCredentials: true
                 },
-                success: function(response){
-                    processuploadresponse(response, '#urluploadparameters');
-                    $('#urluploadprogress').hide();
-                    $('#urlupload').show();
+                success: function(response, status, xhr){ //eslint-disable-line no-unused-vars
+                    if (xhr.status == 202) {
+                        poll(JSON.parse(response));
+                    } else {
+                        finish(xhr.responseXML || $.parseXML(response));
+                    }
                 },
                 error: function(response, errortype){ //eslint-disable-line no-unused-vars
-                    processuploadresponse(response.responseXML, '#urluploadparameters');
-                    $('#urluploadprogress').hide();
-                    $('#urlupload').show();
+                    finish(response.responseXML);
                 }
             });
     });
@@ -772,6 +904,13 @@ function initclam() { //eslint-disable-line no-unused-vars, complexity
                 }
                 var params = {inputtemplate: inputtemplate_id, user:user, accesstoken:accesstoken };
                 addformdata( '#uploadparameters', params );
+                //large files are uploaded in chunks instead, so the upload can resume after connection problems
+                var handler = $(this).data('fineuploader').uploader._handler;
+                var file = (handler._files !== undefined) ? handler._files[id] : null; //eslint-disable-line no-undefined
+                if ((typeof(chunkeduploadthreshold) !== 'undefined') && (chunkeduploadthreshold > 0) && file && (typeof(file.slice) !== 'undefined') && (file.size > chunkeduploadthreshold)) {
+                    chunkedupload(file, params);
+                    return false;
+                }
                 $(this).fineUploader('setParams',params);
 
                 return true;
@@ -102,7 +102,7 @@
 <xsl:template name="head">
   <head>
     <meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
-    <xsl:if test="status/@code = 1 and (contains(/clam/@interfaceoptions,'secureonly') or contains(/clam/@interfaceoptions,'simplepolling'))" >
+    <xsl:if test="(status/@code = 1 or status/@code = 3) and (contains(/clam/@interfaceoptions,'secureonly') or contains(/clam/@interfaceoptions,'simplepolling'))" >
       <meta http-equiv="refresh" content="2" />
     </xsl:if>
     <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no" />
@@ -140,6 +140,11 @@
                 stage = 1;
                 progress = 0;
         </xsl:if>
+        <xsl:if test="status/@code = 3">
+                stage = 1;
+                progress = 0;
+                queued = true;
+        </xsl:if>
         <xsl:if test="status/@code = 0">
                 stage = 0;
         </xsl:if>
@@ -284,6 +289,14 @@
 
         <xsl:call-template name="log" />
       </xsl:when>
+      <xsl:when test="@code = 3">
+        <div id="actions">
+        	<input id="abortbutton" class="btn btn-danger" type="button" value="Cancel execution" />
+        </div>
+        <div id="statusmessage" class="running"><xsl:value-of select="@message"/></div>
+        <img class="progress" src="{/clam/@baseurl}/static/progress.gif" />
+        <p class="alert alert-info">You may safely close your browser or shut down your computer, the system will start automatically on the server as soon as there is room and will be available when you return another time.</p>
+      </xsl:when>
       <xsl:when test="@code = 2">
         <div id="actions">
             <input id="indexbutton" type="button" class="btn btn-primary" value="Return to project index" /><input id="deletebutton" class="btn btn-danger" type="button" value="Cancel and delete project" /><input id="restartbutton" type="button" class="btn btn-danger" value="Discard output and restart" />
@@ -722,7 +735,7 @@
                         <li class="nav-item disabled"><a class="nav-link disabled" href="#" tabindex="-1" aria-disabled="true">3.&#160;<span class="oi oi-timer"></span>&#160;Runtime</a></li>
                         <li class="nav-item disabled"><a class="nav-link disabled" href="#" tabindex="-1" aria-disabled="true">4.&#160;<span class="oi oi-cloud-download"></span>&#160;Results</a></li>
                     </xsl:when>
-                    <xsl:when test="@project and status/@code = 1">
+                    <xsl:when test="@project and (status/@code = 1 or status/@code = 3)">
                         <li class="nav-item disabled"><a class="nav-link disabled" href="#" tabindex="-1" aria-disabled="true">2.&#160;<span class="oi oi-cloud-upload"></span>&#160;Staging</a></li>
                         <li class="nav-item active"><a class="nav-link" href="#" tabindex="-1" aria-disabled="false">3.&#160;<span class="oi oi-timer"></span>&#160;Runtime</a></li>
                         <li class="nav-item disabled"><a class="nav-link disabled" href="#" tabindex="-1" aria-disabled="true">4.&#160;<span class="oi oi-cloud-download"></span>&#160;Results</a></li>
@@ -874,6 +887,11 @@
                                        <span class="done">done</span>
                                    </xsl:when>
                                </xsl:choose>
+                               <xsl:choose>
+                                   <xsl:when test="@status = 3">
+                                       <span class="running">queued</span>
+                                   </xsl:when>
+                               </xsl:choose>
                             </td>
                            <td><xsl:value-of select="@size" /> MB</td>
                            <td><xsl:value-of select="@time" /></td>
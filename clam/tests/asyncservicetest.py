@@ -0,0 +1,88 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Asynchronous CLAM Client tests for Text Statistics webservice --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+#pylint: disable=wrong-import-position
+
+import sys
+import os
+import io
+import asyncio
+import zipfile
+import unittest
+
+#We may need to do some path magic in order to find the clam.* imports
+
+sys.path.append(sys.path[0] + '/../../')
+os.environ['PYTHONPATH'] = sys.path[0] + '/../../'
+
+from clam.common.asyncclient import AsyncCLAMClient
+from clam.common.data import CLAMData, ParameterError
+import clam.common.status
+
+
+class AsyncServiceTest(unittest.IsolatedAsyncioTestCase):
+    """Test the asynchronous client, requires the textstats service to be running"""
+
+    async def asyncSetUp(self):
+        self.url = 'http://' + os.uname()[1] + ':8080'
+        self.client = AsyncCLAMClient(self.url, concurrency=4)
+        self.projects = [ 'asyncservicetest' + str(i) for i in range(8) ]
+        with io.open('/tmp/asyncservicetest.txt','w',encoding='utf-8') as f:
+            f.write("On espère que tout ça marche bien.")
+
+    async def test1_index(self):
+        """Asynchronous Client Test - Index"""
+        data = await self.client.index()
+        self.assertTrue(isinstance(data, CLAMData))
+        self.assertEqual(data.system_id, "textstats")
+        self.assertTrue(data.profiles)
+
+    async def test2_concurrentruns(self):
+        """Asynchronous Client Test - Concurrent runs of multiple projects"""
+        async def run(project):
+            await self.client.create(project)
+            data = await self.client.get(project)
+            await self.client.addinputfile(project, data.inputtemplate('textinput'), '/tmp/asyncservicetest.txt', language='fr')
+            await self.client.addinput(project, 'textinput', "Dit is een test.", filename='test2.txt', language='nl')
+            data = await self.client.start(project)
+            self.assertFalse(data.errors)
+            data = await self.client.wait(project, 10)
+            self.assertEqual(data.status, clam.common.status.DONE)
+            await self.client.download(project, 'asyncservicetest.txt.freqlist', '/tmp/' + project + '.freqlist')
+            await self.client.downloadarchive(project, '/tmp/' + project + '.zip')
+            return data
+
+        results = await asyncio.gather(*[ run(project) for project in self.projects ])
+        for project, data in zip(self.projects, results):
+            self.assertEqual(sorted( f.filename for f in data.input ), ['asyncservicetest.txt', 'test2.txt'])
+            self.assertTrue('asyncservicetest.txt.freqlist' in [ f.filename for f in data.output ])
+            self.assertTrue(os.path.getsize('/tmp/' + project + '.freqlist') > 0)
+            with zipfile.ZipFile('/tmp/' + project + '.zip') as archive:
+                self.assertTrue('asyncservicetest.txt.freqlist' in archive.namelist())
+
+    async def test3_parametererror(self):
+        """Asynchronous Client Test - Parameter error"""
+        project = self.projects[0]
+        await self.client.create(project)
+        await self.client.addinputfile(project, 'textinput', '/tmp/asyncservicetest.txt', language='fr')
+        with self.assertRaises(ParameterError):
+            await self.client.startsafe(project, casesensitive='nonexistant')
+
+    async def asyncTearDown(self):
+        await asyncio.gather(*[ self.client.delete(project) for project in self.projects ], return_exceptions=True)
+        await self.client.close()
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -32,6 +32,7 @@ from clam.common.client import *
 from clam.common.data import * #pylint: disable=redefined-builtin
 from clam.common.formats import *
 import clam.common.status
+from clam.common.asyncclient import AsyncCLAMClient, DigestAuth
 
 class AuthServiceTest(unittest.TestCase):
     """Test basic operations with authentication"""
@@ -88,6 +89,55 @@ class NoAuthServiceTest(unittest.TestCase):
         self.assertRaises( AuthRequired, self.client.index)
 
 
+class DigestAuthTest(unittest.TestCase):
+    """Test the digest authentication of the asynchronous client against the examples of RFC 7616"""
+
+    def test1_response(self):
+        """Digest Authentication - Responses for MD5 and SHA-256"""
+        for algorithm, response in (('MD5', '8ca523f5e9506fed4657c9700eebdbec'), ('SHA-256', '753927fa0e85d155564e2e272a28d1802ca10daf4496794697cf8db5856cb6c1')):
+            auth = DigestAuth('Mufasa', 'Circle of Life')
+            self.assertTrue(auth.challenged('Digest realm="http-auth@example.org", qop="auth, auth-int", algorithm=' + algorithm + ', nonce="7ypf/xlj9XXwfDPEoM4URrv/xwf94BcCAzFZH4GiTo0v", opaque="FQhe/qaU925kfnzjCev0ciny7QMkPqMAFRtzCUYo5tdS"'))
+            header = auth.header('GET', 'http://www.example.org/dir/index.html', 'f2/wE4q74E6zIJEtWaHKaf5wv/H5QzzpXusqGemxURZJ')
+            self.assertIn('response="' + response + '"', header)
+            self.assertIn('nc=00000001', header)
+
+    def test2_noncecount(self):
+        """Digest Authentication - Nonce count increases per request and restarts with a new nonce"""
+        auth = DigestAuth('Mufasa', 'Circle of Life')
+        auth.challenged('Digest realm="test", qop="auth", nonce="a"')
+        auth.header('GET', 'http://localhost/')
+        self.assertIn('nc=00000002', auth.header('GET', 'http://localhost/'))
+        auth.challenged('Digest realm="test", qop="auth", nonce="b", stale=true')
+        self.assertIn('nc=00000001', auth.header('GET', 'http://localhost/'))
+
+    def test3_unsupported(self):
+        """Digest Authentication - Unsupported challenges are declined"""
+        auth = DigestAuth('Mufasa', 'Circle of Life')
+        self.assertFalse(auth.challenged('Digest realm="test", qop="auth-int", nonce="a"'))
+        self.assertFalse(auth.challenged('Digest realm="test", algorithm=SHA-512-256, nonce="a"'))
+
+class AsyncAuthServiceTest(unittest.IsolatedAsyncioTestCase):
+    """Test digest authentication with the asynchronous client"""
+
+    def setUp(self):
+        self.url = 'http://' + os.uname()[1] + ':8080'
+
+    async def test1_index(self):
+        """Asynchronous Client Test - Index with digest authentication"""
+        async with AsyncCLAMClient(self.url, 'proycon', 'secret') as client:
+            data = await client.index()
+            self.assertTrue(data.system_id == "authtest")
+            nc = client.digest.nc
+            data = await client.index() #authenticates right away, with the same nonce
+            self.assertTrue(data.system_id == "authtest")
+            self.assertEqual(client.digest.nc, nc + 1)
+
+    async def test2_wrongpw(self):
+        """Asynchronous Client Test - Inability to access index with wrong user credentials"""
+        async with AsyncCLAMClient(self.url, 'proycon', 'wrongpw') as client:
+            with self.assertRaises(AuthRequired):
+                await client.index()
+
 class BasicServiceTest(unittest.TestCase):
     """Test basic operations with authentication"""
 
@@ -111,6 +161,14 @@ class BasicServiceTest(unittest.TestCase):
         self.assertTrue(data.parameters)
         self.assertFalse(data.projects)
 
+    def test1_3_session(self):
+        """Basic Service Test - Digest authentication negotiated only once per client"""
+        challenges = []
+        self.client.session.hooks['response'].append(lambda r, *args, **kwargs: challenges.append(len(r.history))) #the 401 challenge ends up in the history
+        for _ in range(3):
+            self.client.index()
+        self.assertEqual(sum(challenges), 1)
+
     def test2_1_create(self):
         """Basic Service Test - Project creation"""
         success = self.client.create('basicservicetest')
@@ -160,6 +218,18 @@ class BasicServiceTest(unittest.TestCase):
         success = self.client.addinput('basicservicetest', data.inputtemplate('textinput'),"On espère que tout ça marche bien.",filename='servicetest.txt', language='fr')
         self.assertTrue(success)
 
+    def test2_4c_batchupload(self):
+        """Basic Service Test - Uploading multiple files at once"""
+        filenames = []
+        for i in range(2):
+            filenames.append('/tmp/servicetest_batch' + str(i) + '.txt')
+            with io.open(filenames[-1],'w',encoding='utf-8') as f:
+                f.write("Dit is bestand nummer " + str(i) + ".")
+        success = self.client.addinputfiles('basicservicetest', 'textinput', filenames, language='nl')
+        self.assertTrue(success)
+        data = self.client.get('basicservicetest')
+        self.assertTrue(all( os.path.basename(filename) in [ f.filename for f in data.input ] for filename in filenames ))
+
     def test2_5_upload(self):
         """Basic Service Test - File upload verification"""
         data = self.client.get('basicservicetest')
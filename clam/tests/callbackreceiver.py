@@ -0,0 +1,80 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- Callback receiver for tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Stand-in receiver for completion callbacks, records what is posted to it. Can also be run standalone to print the callbacks a service posts: python callbackreceiver.py [port]"""
+
+import sys
+import json
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+class CallbackReceiver:
+    """Receives callbacks on localhost in a background thread. The first *failures* requests are answered with 503 Service Unavailable, to test retries. If *redirect* is set, requests are redirected to that URL instead"""
+
+    def __init__(self, port=0, failures=0, redirect=None):
+        self.callbacks = [] #list of (headers, body) tuples
+        self.failures = failures
+        self.redirect = redirect
+        self.attempts = 0
+        self.received = threading.Event()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self): #pylint: disable=invalid-name
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                receiver.attempts += 1
+                if receiver.redirect:
+                    self.send_response(302)
+                    self.send_header('Location', receiver.redirect)
+                elif receiver.attempts <= receiver.failures:
+                    self.send_response(503)
+                else:
+                    receiver.callbacks.append( (self.headers, body) ) #case-insensitive
+                    receiver.received.set()
+                    self.send_response(204)
+                self.end_headers()
+
+            #a redirected POST becomes a GET
+            do_GET = do_POST #pylint: disable=invalid-name
+
+            def log_message(self, format, *args): #pylint: disable=redefined-builtin
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:' + str(self.server.server_port) + '/'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait(self, timeout=60):
+        """Waits for a callback to be received, returns its decoded JSON body, or None on timeout"""
+        if not self.received.wait(timeout):
+            return None
+        return json.loads(str(self.callbacks[-1][1],'utf-8'))
+
+if __name__ == '__main__':
+    with CallbackReceiver(int(sys.argv[1]) if len(sys.argv) > 1 else 8090) as receiver:
+        print("Listening on " + receiver.url, file=sys.stderr)
+        while True:
+            receiver.received.wait()
+            receiver.received.clear()
+            headers, body = receiver.callbacks[-1]
+            print(headers.get('X-CLAM-Signature', ''), str(body,'utf-8'))
@@ -15,6 +15,13 @@
 import unittest
 import sys
 import os
+import shutil
+import tarfile
+import zipfile
+import io
+import tempfile
+import threading
+import subprocess
 
 #We may need to do some path magic in order to find the clam.* imports
 sys.path.append(sys.path[0] + '/../../')
@@ -24,6 +31,22 @@ import clam.common.data
 import clam.common.parameters
 import clam.common.formats
 import clam.common.converters
+import clam.common.status
+import clam.common.index
+import clam.common.manifest
+import clam.common.util
+import clam.common.callback
+import clam.common.resumable
+import clam.common.archive
+import clam.common.fetch
+import clam.common.registry
+import clam.common.scheduler
+import clam.common.sequence
+import clam.common.jsonapi
+import clam.common.monitor
+import clam.clamdispatcher
+from clam.tests.callbackreceiver import CallbackReceiver
+from clam.tests.fileserver import FileServer
 
 class InputTemplateTest(unittest.TestCase):
     def generate(self):
@@ -221,8 +244,631 @@ class ParametersInFilename(unittest.TestCase):
         self.assertEqual(filename,'test.utf-8.fr.txt')
 
 
+class JSONParametersTest(unittest.TestCase):
+    def test1_access(self):
+        """JSON representation - Only parameters the user has access to"""
+        parameters = [('Group', [
+            clam.common.parameters.BooleanParameter('public','Public','', value=True),
+            clam.common.parameters.StringParameter('restricted','Restricted','', allowusers=['admin']),
+        ])]
+        self.assertEqual(clam.common.jsonapi.parameters(parameters, 'admin'), {'public': {'value': True}, 'restricted': {}})
+        self.assertEqual(clam.common.jsonapi.parameters(parameters, 'someone'), {'public': {'value': True}})
 
 
+class TempDirTestCase(unittest.TestCase):
+    """Base class for tests that work in a temporary directory (self.path, with trailing slash), which is removed afterwards"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='clamtest') + '/'
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+class StatusLogTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.statusfile = self.path + '.status'
+        self.cache = clam.common.status.StatusLogCache()
+
+    def test1_incremental(self):
+        """Status log - Incremental reading"""
+        clam.common.status.write(self.statusfile, "Starting", 10)
+        statuslog, completion = self.cache.read(self.statusfile)
+        self.assertEqual([ entry[0] for entry in statuslog ], ['Starting'])
+        self.assertEqual(completion, 10)
+        clam.common.status.write(self.statusfile, "Processing", 50)
+        clam.common.status.write(self.statusfile, "Processing", 60) #repeated message
+        statuslog, completion = self.cache.read(self.statusfile)
+        self.assertEqual([ entry[0] for entry in statuslog ], ['Processing','Starting'])
+        self.assertEqual(completion, 60)
+
+    def test2_partialline(self):
+        """Status log - Incomplete lines are not parsed yet"""
+        with open(self.statusfile,'w') as f:
+            f.write("20%\t1\tHalf a me")
+        self.assertEqual(self.cache.read(self.statusfile), ([], 0))
+        with open(self.statusfile,'a') as f:
+            f.write("ssage\n")
+        statuslog, completion = self.cache.read(self.statusfile)
+        self.assertEqual(statuslog[0][0], 'Half a message')
+        self.assertEqual(completion, 20)
+
+    def test3_limit(self):
+        """Status log - Last N entries"""
+        for i in range(100):
+            clam.common.status.write(self.statusfile, "Step " + str(i), i)
+        statuslog, completion = self.cache.read(self.statusfile, 3)
+        self.assertEqual([ entry[0] for entry in statuslog ], ['Step 99','Step 98','Step 97'])
+        self.assertEqual(completion, 99)
+
+    def test4_truncated(self):
+        """Status log - Rewritten file is parsed from the start"""
+        clam.common.status.write(self.statusfile, "First run, a long message", 90)
+        self.cache.read(self.statusfile)
+        os.unlink(self.statusfile)
+        clam.common.status.write(self.statusfile, "Second run", 5)
+        statuslog, completion = self.cache.read(self.statusfile)
+        self.assertEqual([ entry[0] for entry in statuslog ], ['Second run'])
+        self.assertEqual(completion, 5)
+
+    def test5_since(self):
+        """Status log - Entries since an offset"""
+        self.assertEqual(self.cache.since(self.statusfile), ([], 0, 0))
+        clam.common.status.write(self.statusfile, "Starting", 10)
+        clam.common.status.write(self.statusfile, "Processing", 50)
+        entries, offset, completion = self.cache.since(self.statusfile)
+        self.assertEqual([ entry[0] for entry in entries ], ['Starting','Processing'])
+        self.assertEqual((offset, completion), (2, 50))
+        clam.common.status.write(self.statusfile, "Finishing", 90)
+        entries, offset, completion = self.cache.since(self.statusfile, offset)
+        self.assertEqual([ entry[0] for entry in entries ], ['Finishing'])
+        self.assertEqual(self.cache.since(self.statusfile, offset + 1)[1], 3)
+        self.assertEqual(self.cache.since(self.statusfile, 3), ([], 3, 90))
+
+    def test6_bounded(self):
+        """Status log - Only the most recent entries are retained, older ones are read from the file"""
+        cache = clam.common.status.StatusLogCache(maxentries=10)
+        for i in range(25):
+            clam.common.status.write(self.statusfile, "Step " + str(i), i)
+        statuslog, _ = cache.read(self.statusfile, 5)
+        self.assertEqual(len(cache.files[self.statusfile][2]), 10)
+        self.assertEqual(statuslog[-1][0], 'Step 20')
+        statuslog, _ = cache.read(self.statusfile)
+        self.assertEqual(len(statuslog), 25)
+        self.assertEqual(statuslog[-1][0], 'Step 0')
+        entries, offset, _ = cache.since(self.statusfile, 20)
+        self.assertEqual(([ entry[0] for entry in entries ], offset), (['Step 20','Step 21','Step 22','Step 23','Step 24'], 25))
+        entries, offset, _ = cache.since(self.statusfile, 2)
+        self.assertEqual((entries[0][0], len(entries), offset), ('Step 2', 23, 25))
+        self.assertEqual(len(cache.files[self.statusfile][2]), 10)
+
+
+class CLAMFileTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(self.path + 'input')
+        with open(self.path + 'input/latin1.txt','wb') as f:
+            f.write("één\ntwee\ndrie".encode('latin-1'))
+        with open(self.path + 'input/empty.bin','wb') as f:
+            pass
+
+    def getfile(self, filename, encoding=None):
+        clamfile = clam.common.data.CLAMInputFile(self.path, filename, False)
+        if encoding:
+            clamfile.metadata = clam.common.formats.PlainTextFormat(clamfile, encoding=encoding)
+        return clamfile
+
+    def test1_lines(self):
+        """CLAMFile - Line-wise iteration with decoding"""
+        self.assertEqual(list(self.getfile('latin1.txt','latin-1')), ["één\n","twee\n","drie"])
+        self.assertEqual(list(self.getfile('latin1.txt')), ["één\n".encode('latin-1'),b"twee\n",b"drie"])
+
+    def test2_chunks(self):
+        """CLAMFile - Chunked reading"""
+        self.assertEqual(list(self.getfile('latin1.txt').chunks(5)), [b"\xe9\xe9n\nt", b"wee\nd", b"rie"])
+        self.assertEqual(list(self.getfile('empty.bin').chunks()), [])
+
+    def test3_view(self):
+        """CLAMFile - Memory mapped access"""
+        with self.getfile('latin1.txt').view() as data:
+            self.assertEqual(bytes(data[4:8]), b"twee")
+        with self.getfile('empty.bin').view() as data:
+            self.assertEqual(len(data), 0)
+
+    def test4_read(self):
+        """CLAMFile - Reading and copying"""
+        self.assertEqual(self.getfile('latin1.txt','latin-1').read(), "één\ntwee\ndrie")
+        self.getfile('latin1.txt','latin-1').copy(self.path + 'copy.txt')
+        with open(self.path + 'copy.txt','rb') as f:
+            self.assertEqual(f.read(), "één\ntwee\ndrie".encode('latin-1'))
+
+class ProjectIndexTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = clam.common.index.ProjectIndex(self.path)
+
+    def test1_build(self):
+        """Project index - Built once when missing"""
+        built = []
+        def build():
+            built.append(True)
+            return {'a': ["2020-01-01 00:00:00", 1.5, 2, 100.0]}
+        self.assertEqual(self.index.get(build), {'a': ["2020-01-01 00:00:00", 1.5, 2, 100.0]})
+        self.assertEqual(self.index.get(build), {'a': ["2020-01-01 00:00:00", 1.5, 2, 100.0]})
+        self.assertEqual(len(built), 1)
+
+    def test2_deltas(self):
+        """Project index - Delta updates"""
+        self.index.get(lambda: {'a': ["2020-01-01 00:00:00", 1.5, 2]})
+        self.index.update('b', date="2020-01-02 00:00:00", size=0.0, status=0)
+        self.index.update('b', size=2.25, status=2)
+        self.index.remove('a')
+        projects = self.index.get()
+        self.assertEqual(projects, {'b': ["2020-01-02 00:00:00", 2.25, 2, 0]})
+        self.assertEqual(self.index.totalsize(), 2.25)
+
+    def test3_compaction(self):
+        """Project index - Journal is compacted"""
+        self.index.get(dict)
+        for i in range(2000):
+            self.index.update('p' + str(i), date="2020-01-01 00:00:00", size=1.0, status=0)
+        self.assertTrue(os.path.getsize(self.path + '.index.journal') <= clam.common.index.MAXJOURNALSIZE)
+        self.assertEqual(self.index.totalsize(), 2000.0)
+
+    def test4_grow(self):
+        """Project index - Incremental disk usage"""
+        self.index.get(lambda: {'a': ["2020-01-01 00:00:00", 1.0, 0]})
+        self.index.update('a', grow=2.5)
+        self.index.update('a', grow=-0.5)
+        self.assertEqual(self.index.projectsize('a'), 3.0)
+        self.assertEqual(self.index.totalsize(), 3.0)
+        self.index.update('a', size=1.0) #reconciled
+        self.assertEqual(self.index.totalsize(), 1.0)
+        #another process sees the same
+        del clam.common.index.CACHE[self.path]
+        self.assertEqual(self.index.projectsize('a'), 1.0)
+
+    def test5_diskusage(self):
+        """Project index - Disk usage computation"""
+        for d in ('input','output/sub'):
+            os.makedirs(self.path + 'p/' + d)
+            with open(self.path + 'p/' + d + '/f.txt','wb') as f:
+                f.write(b"x" * 1048576)
+        os.symlink(self.path + 'p/input/f.txt', self.path + 'p/input/.f.txt.INPUTTEMPLATE.x.1')
+        self.assertEqual(clam.common.util.computediskusage(self.path + 'p'), (2.0, 2))
+
+    def test6_noindex(self):
+        """Project index - Updates are not recorded without an index"""
+        self.index.update('a', size=1.0)
+        self.assertEqual(self.index.get(), None)
+        self.assertEqual(self.index.get(lambda: {}), {})
+
+    def test7_reconciled(self):
+        """Project index - Time of the last reconciliation of the disk usage"""
+        self.index.get(lambda: {'a': ["2020-01-01 00:00:00", 1.0, 0]}) #older index entries lack it
+        self.assertEqual(self.index.reconciled('a'), 0)
+        self.index.update('a', grow=1.0)
+        self.assertEqual(self.index.reconciled('a'), 0)
+        self.index.update('a', size=1.5, reconciled=100.0)
+        self.assertEqual(self.index.reconciled('a'), 100.0)
+        self.assertEqual(self.index.reconciled('b'), None)
+        #survives compaction
+        state = self.index.state()
+        with self.index.lock():
+            self.index.write(state['projects'])
+        del clam.common.index.CACHE[self.path]
+        self.assertEqual(self.index.get(), {'a': ["2020-01-01 00:00:00", 1.5, 0, 100.0]})
+
+    def test8_reconcile(self):
+        """Project index - Disk usage is recomputed when a job finishes and it was not for a while"""
+        for d in ('input','output'):
+            os.makedirs(self.path + 'p/' + d)
+            with open(self.path + 'p/' + d + '/f.txt','wb') as f:
+                f.write(b"x" * 1048576)
+        self.index.get(lambda: {'p': ["2020-01-01 00:00:00", 0.5, 0, 0]}) #drifted
+        clam.clamdispatcher.updateindex(self.path + 'p/', 3600)
+        self.assertEqual(self.index.projectsize('p'), 2.0)
+        self.assertTrue(self.index.reconciled('p') > 0)
+        #recently reconciled: only the output is added
+        clam.clamdispatcher.updateindex(self.path + 'p/', 3600)
+        self.assertEqual(self.index.projectsize('p'), 3.0)
+
+
+class ManifestTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(self.path + 'input')
+        with open(self.path + 'input/a.txt','w',encoding='utf-8') as f:
+            f.write("test")
+
+    def test1_store(self):
+        """Manifest - Stored once settled"""
+        entries = clam.common.manifest.get(self.path, 'input', [], settle=0)
+        self.assertEqual([ (entry.filename, entry.size) for entry in entries ], [('a.txt', 4)])
+        self.assertTrue(os.path.exists(self.path + '.manifest.input'))
+        self.assertEqual([ entry.filename for entry in clam.common.manifest.load(self.path, 'input', []) ], ['a.txt'])
+
+    def test2_unsettled(self):
+        """Manifest - Not stored whilst the directory is still changing"""
+        clam.common.manifest.get(self.path, 'input', [], settle=3600)
+        self.assertFalse(os.path.exists(self.path + '.manifest.input'))
+
+    def test3_invalidation(self):
+        """Manifest - Invalidated when a file is added"""
+        clam.common.manifest.get(self.path, 'input', [], settle=0)
+        with open(self.path + 'input/b.txt','w',encoding='utf-8') as f:
+            f.write("test")
+        os.utime(self.path + 'input', ns=(0, os.stat(self.path + 'input').st_mtime_ns + 1000)) #coarse timestamps
+        self.assertEqual(clam.common.manifest.load(self.path, 'input', []), None)
+        self.assertEqual([ entry.filename for entry in clam.common.manifest.get(self.path, 'input', [], settle=0) ], ['a.txt','b.txt'])
+
+    def test4_rewritten(self):
+        """Manifest - Invalidated when a file is rewritten in place"""
+        clam.common.manifest.get(self.path, 'input', [], settle=0)
+        dirmtime = os.stat(self.path + 'input').st_mtime_ns
+        with open(self.path + 'input/a.txt','w',encoding='utf-8') as f:
+            f.write("rewritten")
+        os.utime(self.path + 'input', ns=(0, dirmtime))
+        self.assertEqual(clam.common.manifest.load(self.path, 'input', []), None)
+        self.assertEqual([ entry.size for entry in clam.common.manifest.get(self.path, 'input', [], settle=0) ], [9])
+
+    def test5_select(self):
+        """Manifest - Selection and pagination"""
+        entries = [ clam.common.manifest.ManifestEntry(str(i) + ('.txt' if i % 2 else '.xml'), 'even' if i % 2 == 0 else 'odd') for i in range(10) ]
+        self.assertEqual(clam.common.manifest.select(entries, offset=8), (entries[8:], 10))
+        self.assertEqual([ str(entry) for entry in clam.common.manifest.select(entries, 'odd', offset=1, limit=2)[0] ], ['3.txt','5.txt'])
+        self.assertEqual(clam.common.manifest.select(entries, glob='*.xml', limit=0), ([], 5))
+        self.assertRaises(ValueError, clam.common.manifest.select, entries, offset=-1)
+
+
+class CallbackTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(self.path + 'output')
+        with open(self.path + '.status','w',encoding='utf-8') as f:
+            f.write("Done\n")
+
+    def test1_allowed(self):
+        """Callback - Allowed URLs"""
+        self.assertFalse(clam.common.callback.allowed('http://example.org/', False))
+        self.assertTrue(clam.common.callback.allowed('https://example.org/', True))
+        self.assertFalse(clam.common.callback.allowed('file:///etc/passwd', True))
+        self.assertTrue(clam.common.callback.allowed('http://localhost:8090/done', ['http://localhost:']))
+        self.assertFalse(clam.common.callback.allowed('http://example.org/', ['http://localhost:']))
+        #the host is compared, not a string prefix
+        self.assertFalse(clam.common.callback.allowed('http://localhost:80@evil.example.com/x', ['http://localhost:']))
+        self.assertFalse(clam.common.callback.allowed('http://localhost.evil.example.com/x', ['http://localhost']))
+        self.assertFalse(clam.common.callback.allowed('http://user@localhost:8090/', ['http://localhost:']))
+        self.assertFalse(clam.common.callback.allowed('http://user@example.org/', True))
+        self.assertTrue(clam.common.callback.allowed('HTTP://LOCALHOST:8090/', ['http://localhost:']))
+        #scheme, port and path
+        self.assertFalse(clam.common.callback.allowed('http://example.org/cb/done', ['https://example.org/cb/']))
+        self.assertFalse(clam.common.callback.allowed('https://example.org:8443/cb/done', ['https://example.org/cb/']))
+        self.assertTrue(clam.common.callback.allowed('https://example.org:443/cb/done', ['https://example.org/cb/']))
+        self.assertFalse(clam.common.callback.allowed('https://example.org/other', ['https://example.org/cb/']))
+        self.assertFalse(clam.common.callback.allowed('http://localhost:99999/', ['http://localhost:']))
+
+    def test2_retry(self):
+        """Callback - Retried with backoff until accepted"""
+        with CallbackReceiver(failures=2) as receiver:
+            self.assertTrue(clam.common.callback.post(receiver.url, b'{}', retries=3, backoff=0.01))
+            self.assertEqual(receiver.attempts, 3)
+        with CallbackReceiver(failures=5) as receiver:
+            self.assertFalse(clam.common.callback.post(receiver.url, b'{}', retries=1, backoff=0.01))
+            self.assertEqual(receiver.attempts, 2)
+
+    def test2b_redirect(self):
+        """Callback - Redirects are not followed"""
+        with CallbackReceiver() as target:
+            with CallbackReceiver(redirect=target.url) as receiver:
+                self.assertFalse(clam.common.callback.post(receiver.url, b'{}', retries=0))
+                self.assertEqual(receiver.attempts, 1)
+            self.assertEqual(target.attempts, 0)
+
+    def test3_notify(self):
+        """Callback - Final state posted to the registered URL, signed"""
+        self.assertEqual(clam.common.callback.notify(self.path, 0), None)
+        with CallbackReceiver() as receiver:
+            clam.common.callback.register(self.path, receiver.url, 'http://localhost/clamcallbacktest/')
+            self.assertTrue(clam.common.callback.notify(self.path, 0, [], secret='secret'))
+            data = receiver.wait(1)
+            self.assertEqual(data['project'], os.path.basename(self.path[:-1]))
+            self.assertEqual(data['status'], clam.common.status.DONE)
+            self.assertEqual(data['statusmessage'], 'Done')
+            self.assertEqual(data['exitcode'], 0)
+            self.assertFalse(data['aborted'])
+            self.assertEqual(data['outputfiles'], [])
+            headers, body = receiver.callbacks[-1]
+            self.assertEqual(headers['X-CLAM-Signature'], clam.common.callback.signature(body, 'secret'))
+        clam.common.callback.register(self.path, None, None)
+        self.assertFalse(os.path.exists(self.path + clam.common.callback.CALLBACKFILE))
+
+
+class ResumableUploadTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+
+    def test1_merge(self):
+        """Resumable upload - Merging received ranges"""
+        ranges = clam.common.resumable.merge([], 10, 20)
+        self.assertEqual(ranges, [[10,20]])
+        ranges = clam.common.resumable.merge(ranges, 30, 40)
+        self.assertEqual(ranges, [[10,20],[30,40]])
+        ranges = clam.common.resumable.merge(ranges, 0, 10)
+        self.assertEqual(ranges, [[0,20],[30,40]])
+        ranges = clam.common.resumable.merge(ranges, 15, 35)
+        self.assertEqual(ranges, [[0,40]])
+
+    def test2_chunks(self):
+        """Resumable upload - Chunks written out of order and again"""
+        state = clam.common.resumable.create(self.path, 'test.txt', 10, {'inputtemplate': 'textinput'})
+        self.assertEqual(clam.common.resumable.missing(state), [[0,10]])
+        state = clam.common.resumable.write(self.path, state['id'], 6, io.BytesIO(b'6789'))
+        self.assertEqual(clam.common.resumable.missing(state), [[0,6]])
+        state = clam.common.resumable.write(self.path, state['id'], 0, io.BytesIO(b'0123'))
+        self.assertEqual(clam.common.resumable.missing(state), [[4,6]])
+        self.assertFalse(clam.common.resumable.complete(state))
+        state = clam.common.resumable.write(self.path, state['id'], 2, io.BytesIO(b'2345'))
+        self.assertTrue(clam.common.resumable.complete(clam.common.resumable.load(self.path, state['id'])))
+        with open(clam.common.resumable.datapath(self.path, state['id']),'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+        with self.assertRaises(ValueError):
+            clam.common.resumable.write(self.path, state['id'], 8, io.BytesIO(b'89A'))
+        self.assertTrue(clam.common.resumable.remove(self.path, state['id']))
+        self.assertEqual(clam.common.resumable.load(self.path, state['id']), None)
+        self.assertEqual(clam.common.resumable.load(self.path, '../../etc/passwd'), None)
+
+class ArchiveExtractTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(self.path + 'input')
+
+    def target(self, name):
+        return self.path + 'input/' + name
+
+    def test1_zip(self):
+        """Archive extraction - Zip, unsafe members skipped"""
+        with zipfile.ZipFile(self.path + 'test.zip','w') as archive:
+            archive.writestr('a.txt', 'a')
+            archive.writestr('sub/b.txt', 'b')
+            archive.writestr('../evil.txt', 'evil')
+            archive.writestr('/abs.txt', 'evil')
+            archive.writestr('__MACOSX/._a.txt', 'junk')
+            archive.writestr('sub/', '')
+        extracted = clam.common.archive.extract(self.path + 'test.zip', 'zip', self.target)
+        self.assertEqual([ name for name, _ in extracted ], ['a.txt','b.txt'])
+        self.assertEqual(sorted(os.listdir(self.path + 'input')), ['a.txt','b.txt'])
+        self.assertFalse(os.path.exists(self.path + 'evil.txt'))
+
+    def test2_targz(self):
+        """Archive extraction - Tar.gz from a stream, links skipped"""
+        with open(self.path + 'a.txt','w',encoding='utf-8') as f:
+            f.write('a')
+        with tarfile.open(self.path + 'test.tar.gz','w:gz') as archive:
+            archive.add(self.path + 'a.txt', 'dir/a.txt')
+            archive.add(self.path + 'a.txt', '../evil.txt')
+            link = tarfile.TarInfo('passwd.txt')
+            link.type = tarfile.SYMTYPE
+            link.linkname = '/etc/passwd'
+            archive.addfile(link)
+        with open(self.path + 'test.tar.gz','rb') as f:
+            extracted = clam.common.archive.extract(f, 'tar.gz', self.target)
+        self.assertEqual([ name for name, _ in extracted ], ['a.txt'])
+        self.assertEqual(os.listdir(self.path + 'input'), ['a.txt'])
+
+class FetchTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        os.makedirs(self.path + 'www')
+        with open(self.path + 'www/test.txt','w',encoding='utf-8') as f:
+            f.write("Dit is een test.\n" * 1000)
+
+    def test1_download(self):
+        """URL ingestion - Download, with size limit and HTTP errors"""
+        with FileServer(self.path + 'www') as server:
+            session = clam.common.fetch.session()
+            self.assertEqual(clam.common.fetch.download(session, server.url + 'test.txt', self.path + 'out.txt'), 17000)
+            self.assertEqual(os.path.getsize(self.path + 'out.txt'), 17000)
+            with self.assertRaises(clam.common.fetch.FetchError):
+                clam.common.fetch.download(session, server.url + 'test.txt', self.path + 'big.txt', maxsize=1000)
+            self.assertFalse(os.path.exists(self.path + 'big.txt'))
+            with self.assertRaises(clam.common.fetch.FetchError):
+                clam.common.fetch.download(session, server.url + 'nonexistant.txt', self.path + 'missing.txt')
+            with self.assertRaises(clam.common.fetch.FetchError):
+                clam.common.fetch.download(session, 'file:///etc/passwd', self.path + 'local.txt')
+
+    def test2_fetcher(self):
+        """URL ingestion - Background fetches"""
+        added = []
+        def finish(state, datapath):
+            with open(datapath,'r',encoding='utf-8') as f:
+                added.append( (state['filename'], f.read()) )
+            return 200, "<clamupload/>"
+        fetcher = clam.common.fetch.Fetcher(threads=2, maxsize=10000)
+        with FileServer(self.path + 'www') as server:
+            with open(self.path + 'www/small.txt','w',encoding='utf-8') as f:
+                f.write("Klein.")
+            states = [ clam.common.fetch.create(self.path, server.url + name, name, {'inputtemplate': 'test'}) for name in ('small.txt','test.txt','nonexistant.txt') ]
+            self.assertEqual(len(clam.common.fetch.pending(self.path, 300)), 3)
+            for future in [ fetcher.submit(self.path, state, finish) for state in states ]:
+                future.result()
+        self.assertEqual(added, [('small.txt', "Klein.")])
+        self.assertFalse(clam.common.fetch.pending(self.path, 300))
+        small, big, missing = [ clam.common.fetch.load(self.path, state['id']) for state in states ]
+        self.assertEqual(small['status'], clam.common.fetch.DONE)
+        self.assertEqual(small['result'], "<clamupload/>")
+        self.assertEqual(big['status'], clam.common.fetch.FAILED)
+        self.assertTrue('maximum size' in big['error'])
+        self.assertEqual(missing['status'], clam.common.fetch.FAILED)
+        self.assertFalse(any( filename.endswith('.part') for filename in os.listdir(clam.common.fetch.path(self.path)) ))
+
+class SequenceTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scans = 0
+
+    def scan(self):
+        self.scans += 1
+        return [1, 3, 2]
+
+    def test1_allocate(self):
+        """Sequence numbers - Allocation, rebuilt from a scan only when missing"""
+        self.assertEqual(clam.common.sequence.allocate(self.path, 'test', self.scan), 4)
+        self.assertEqual(clam.common.sequence.allocate(self.path, 'test', self.scan, 3), 5)
+        self.assertEqual(clam.common.sequence.allocate(self.path, 'test', self.scan), 8)
+        self.assertEqual(clam.common.sequence.allocate(self.path, 'other', lambda: []), 1)
+        self.assertEqual(self.scans, 1)
+        clam.common.sequence.reset(self.path)
+        self.assertEqual(clam.common.sequence.allocate(self.path, 'test', self.scan), 4)
+        self.assertEqual(self.scans, 2)
+
+    def test2_release(self):
+        """Sequence numbers - Unused numbers are handed out again"""
+        self.assertEqual(clam.common.sequence.allocate(self.path, 'test', self.scan, 5), 4)
+        clam.common.sequence.release(self.path, 'test', 6, 3)
+        self.assertEqual(clam.common.sequence.allocate(self.path, 'test', self.scan), 6)
+        seq = clam.common.sequence.allocate(self.path, 'test', self.scan)
+        clam.common.sequence.allocate(self.path, 'test', self.scan)
+        clam.common.sequence.release(self.path, 'test', seq) #not the last one, not reused
+        self.assertEqual(clam.common.sequence.allocate(self.path, 'test', self.scan), 9)
+
+    def test3_concurrent(self):
+        """Sequence numbers - Concurrent allocation"""
+        seqs = []
+        def allocate():
+            for _ in range(25):
+                seqs.append(clam.common.sequence.allocate(self.path, 'test', self.scan))
+        threads = [ threading.Thread(target=allocate) for _ in range(4) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(seqs), list(range(4, 104)))
+
+class SymlinkIndexTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.projectpath = self.path
+        self.path += 'input/'
+        os.makedirs(self.path + 'sub')
+        for filename, seq in (('a.txt', 2), ('b.txt', 1), ('sub/c.txt', 3)):
+            with open(self.path + filename,'w',encoding='utf-8') as f:
+                f.write(filename)
+            linkfilename = os.path.dirname(filename) + ('/' if os.path.dirname(filename) else '') + '.' + os.path.basename(filename) + '.INPUTTEMPLATE.test.' + str(seq)
+            os.symlink(self.path + filename, self.path + linkfilename)
+        os.symlink(self.path + 'a.txt', self.path + '.a.txt.INPUTTEMPLATE.other.1')
+        os.symlink(self.path + 'a.txt', self.path + 'notalink.txt.INPUTTEMPLATE.test.9') #not hidden, doesn't match
+
+    def tearDown(self):
+        clam.common.util.endsymlinkindex()
+        shutil.rmtree(self.projectpath, ignore_errors=True)
+
+    def test1_glob(self):
+        """Symlink index - Globbing symlinks, recursively"""
+        links = sorted(clam.common.util.globsymlinks(self.path + '.*.INPUTTEMPLATE.test.*'))
+        self.assertEqual(links, [(self.path + '.a.txt.INPUTTEMPLATE.test.2', self.path + 'a.txt'), (self.path + '.b.txt.INPUTTEMPLATE.test.1', self.path + 'b.txt'), (self.path + 'sub/.c.txt.INPUTTEMPLATE.test.3', self.path + 'sub/c.txt')])
+        self.assertEqual(len(list(clam.common.util.globsymlinks(self.path + '.*.INPUTTEMPLATE.test.*', False))), 2)
+
+    def test2_index(self):
+        """Symlink index - Index by template, sorted by sequence number"""
+        index = clam.common.util.symlinkindex(self.path)
+        self.assertEqual(sorted(index.keys()), ['other','test'])
+        self.assertEqual([ (seq, realf) for seq, _, realf in index['test'] ], [(1, self.path + 'b.txt'), (2, self.path + 'a.txt'), (3, self.path + 'sub/c.txt')])
+        self.assertEqual(clam.common.util.symlinkindex(self.path, 'OUTPUTTEMPLATE'), {})
+
+    def test3_memo(self):
+        """Symlink index - Memoization and invalidation"""
+        clam.common.util.beginsymlinkindex()
+        index = clam.common.util.symlinkindex(self.path)
+        self.assertTrue(clam.common.util.symlinkindex(self.path.rstrip('/')) is index)
+        os.unlink(self.path + '.b.txt.INPUTTEMPLATE.test.1')
+        self.assertEqual(len(clam.common.util.symlinkindex(self.path)['test']), 3) #memoized
+        clam.common.util.invalidatesymlinkindex(self.path + 'sub')
+        self.assertEqual(len(clam.common.util.symlinkindex(self.path)['test']), 2)
+        clam.common.util.endsymlinkindex()
+        self.assertFalse(clam.common.util.symlinkindex(self.path) is clam.common.util.symlinkindex(self.path))
+
+    def test4_delete(self):
+        """Symlink index - Links of deleted files are removed"""
+        clam.common.util.beginsymlinkindex()
+        template = clam.common.data.InputTemplate('test', clam.common.formats.PlainTextFormat, "test", multi=True)
+        self.assertEqual([ filename for _, filename, _ in template.matchingfiles(self.projectpath) ], ['b.txt','a.txt','sub/c.txt'])
+        self.assertTrue(clam.common.data.CLAMInputFile(self.projectpath, 'a.txt').delete())
+        self.assertEqual([ filename for _, filename, _ in template.matchingfiles(self.projectpath) ], ['b.txt','sub/c.txt'])
+        self.assertFalse(os.path.lexists(self.path + '.a.txt.INPUTTEMPLATE.other.1'))
+
+class MonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.monitor = clam.common.monitor.ResourceMonitor(os.getpid())
+        if not self.monitor.childrensupported:
+            self.skipTest("No /proc/pid/task/tid/children")
+
+    def test1_threads(self):
+        """Resource monitor - Children forked by other threads are found"""
+        started = threading.Event()
+        done = threading.Event()
+        processes = []
+        def fork():
+            processes.append(subprocess.Popen(['sleep','10']))
+            started.set()
+            done.wait()
+        thread = threading.Thread(target=fork)
+        thread.start()
+        started.wait()
+        try:
+            self.assertIn(processes[0].pid, self.monitor.processes())
+        finally:
+            processes[0].kill()
+            processes[0].wait()
+            done.set()
+            thread.join()
+
+    def test2_vanished(self):
+        """Resource monitor - Processes that exit meanwhile do not cause a scan of all processes"""
+        process = subprocess.Popen(['true'])
+        process.wait()
+        monitor = clam.common.monitor.ResourceMonitor(process.pid)
+        def scan():
+            raise AssertionError("all processes scanned")
+        monitor.scanprocesses = scan
+        self.assertEqual(monitor.processes(), [process.pid])
+
+class SchedulerTest(TempDirTestCase):
+    class Sampler:
+        """Stand-in resource sampler"""
+        def __init__(self):
+            self.path = '/'
+            self.sufficient = False
+
+        def check(self, **kwargs): #pylint: disable=unused-argument
+            return self.sufficient, ""
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(self.path + 'p')
+        self.registry = clam.common.registry.Registry(self.path + clam.common.registry.REGISTRYFILE)
+        self.sampler = SchedulerTest.Sampler()
+        self.scheduler = clam.common.scheduler.Scheduler(self.registry, log=lambda msg: None, sampler=self.sampler, requirements={'maxloadavg': 1.0})
+
+    def test1_resources(self):
+        """Scheduler - Jobs are queued until the system resources suffice"""
+        self.assertEqual(self.scheduler.submit('anonymous', 'p', 'true', self.path, self.path + 'p'), 0)
+        self.assertEqual(self.registry.get('anonymous', 'p')['status'], clam.common.status.QUEUED)
+        self.assertEqual(self.scheduler.schedule(), 0)
+        self.sampler.sufficient = True
+        self.assertEqual(self.scheduler.schedule(), 1)
+        self.assertEqual(self.registry.get('anonymous', 'p')['status'], clam.common.status.RUNNING)
+        self.assertEqual(self.scheduler.position('anonymous', 'p'), 0)
+
+    def test2_load(self):
+        """Scheduler - Resource requirements are stored for the dispatchers"""
+        self.scheduler.save()
+        scheduler = clam.common.scheduler.Scheduler.load(self.registry)
+        self.assertEqual(scheduler.requirements, {'maxloadavg': 1.0})
+        self.assertEqual(scheduler.sampler.path, '/')
+        self.assertFalse(scheduler.sampler.background)
+        clam.common.scheduler.Scheduler(self.registry).save()
+        self.assertEqual(clam.common.scheduler.Scheduler.load(self.registry).sampler, None)
 
 if __name__ == '__main__':
     unittest.main()
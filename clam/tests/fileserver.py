@@ -0,0 +1,48 @@
+#-*- coding:utf-8 -*-
+
+###############################################################
+# CLAM: Computational Linguistics Application Mediator
+# -- File server for tests --
+#       by Maarten van Gompel (proycon)
+#       https://proycon.github.io/clam
+#
+#       Centre for Language and Speech Technology / Language Machines
+#       Radboud University Nijmegen
+#
+#       Licensed under GPLv3
+#
+###############################################################
+
+"""Stand-in web server serving the files in a directory, to test adding input files by URL"""
+
+import os
+import threading
+import socketserver
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class FileServer:
+    """Serves the files in the directory on localhost in a background thread"""
+
+    def __init__(self, directory, port=0):
+        class Handler(SimpleHTTPRequestHandler):
+            def translate_path(self, path):
+                #serve from the directory rather than from the current working directory
+                return os.path.join(directory, os.path.relpath(super().translate_path(path), os.getcwd()))
+
+            def log_message(self, format, *args): #pylint: disable=redefined-builtin
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:' + str(self.server.server_port) + '/'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
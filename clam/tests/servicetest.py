@@ -21,6 +21,9 @@ import time
 import unittest
 import io
 import zipfile
+import tarfile
+import json
+import requests
 
 #We may need to do some path magic in order to find the clam.* imports
 
@@ -32,6 +35,9 @@ from clam.common.client import *
 from clam.common.data import * #pylint: disable=redefined-builtin
 from clam.common.formats import *
 import clam.common.status
+import clam.common.jsonapi
+from clam.tests.callbackreceiver import CallbackReceiver
+from clam.tests.fileserver import FileServer
 
 
 class BasicServiceTest(unittest.TestCase):
@@ -49,6 +55,28 @@ class BasicServiceTest(unittest.TestCase):
         self.assertTrue(data.profiles)
         self.assertTrue(data.parameters)
 
+    def test1b_health(self):
+        """Basic Service Test - Health endpoint"""
+        r = requests.get(self.url + '/health/')
+        self.assertIn(r.status_code, (200, 503))
+        data = json.loads(r.text)
+        self.assertIn(data['status'], ('ok','saturated'))
+        self.assertTrue(data['diskfree'] > 0)
+        self.assertEqual(data['queued'], 0)
+
+    def test1c_spec(self):
+        """Basic Service Test - Service specification"""
+        r = requests.get(self.url + '/spec/')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.headers['ETag'])
+        self.assertEqual(r.headers['Cache-Control'], 'no-cache')
+        data = CLAMData(r.text)
+        self.assertEqual(data.system_id, 'textstats')
+        self.assertTrue(data.profiles)
+        self.assertTrue(data.parameters)
+        r = requests.get(self.url + '/spec/', headers={'If-None-Match': r.headers['ETag']})
+        self.assertEqual(r.status_code, 304)
+
     def test2_1_create(self):
         """Basic Service Test - Project creation"""
         success = self.client.create('basicservicetest')
@@ -91,6 +119,130 @@ class BasicServiceTest(unittest.TestCase):
                 found = True
         self.assertTrue(found)
 
+    def test2_5b_download(self):
+        """Basic Service Test - File download with range and conditional requests"""
+        url = self.url + '/basicservicetest/input/servicetest.txt'
+        r = requests.get(url)
+        self.assertEqual(r.content, "On espère que tout ça marche bien.".encode('utf-8'))
+        self.assertTrue(r.headers['ETag'])
+        self.assertEqual(requests.get(url, headers={'If-None-Match': r.headers['ETag']}).status_code, 304)
+        r = requests.get(url, headers={'Range': 'bytes=3-9'})
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(r.content, "espère".encode('utf-8'))
+
+    def test2_5c_json(self):
+        """Basic Service Test - JSON representation with field selection"""
+        r = requests.get(self.url + '/basicservicetest/?fields=status,input', headers={'Accept': clam.common.jsonapi.MIMETYPE})
+        self.assertTrue(r.headers['Content-Type'].startswith(clam.common.jsonapi.MIMETYPE))
+        data = r.json()
+        self.assertEqual(sorted(data.keys()), ['input','status','version'])
+        self.assertEqual(data['status'], clam.common.status.READY)
+        self.assertTrue('servicetest.txt' in [ f['name'] for f in data['input'] ])
+        self.assertEqual(requests.get(self.url + '/basicservicetest/?fields=nonexistant', headers={'Accept': clam.common.jsonapi.MIMETYPE}).status_code, 400)
+        #CLAM XML remains the default
+        self.assertTrue(requests.get(self.url + '/basicservicetest/').headers['Content-Type'].startswith('text/xml'))
+        data = self.client.get('basicservicetest')
+        self.assertTrue(isinstance(data.xml, dict))
+        self.assertTrue(data.inputtemplate('textinput'))
+        xmldata = CLAMData(requests.get(self.url + '/basicservicetest/').text)
+        self.assertEqual([ (group, [ parameter.id for parameter in parameters ]) for group, parameters in data.parameters ], [ (group, [ parameter.id for parameter in parameters ]) for group, parameters in xmldata.parameters ])
+
+    def test2_5d_session(self):
+        """Basic Service Test - Connections reused by the client and its files"""
+        data = self.client.get('basicservicetest')
+        inputfile = [ f for f in data.input if f.filename == 'servicetest.txt' ][0]
+        self.assertTrue(inputfile.session() is self.client.session)
+        self.assertEqual(inputfile.read(), "On espère que tout ça marche bien.")
+        with inputfile.view() as data: #downloaded into memory
+            self.assertEqual(bytes(data[:7]), b"On esp\xc3")
+        self.client.get('basicservicetest')
+        pools = self.client.session.get_adapter(self.url).poolmanager.pools
+        self.assertEqual(len(pools.keys()), 1)
+        self.assertEqual(pools[next(iter(pools.keys()))].num_connections, 1)
+
+    def test2_5d_waitready(self):
+        """Basic Service Test - Waiting for a project that was not started"""
+        begintime = time.time()
+        data = self.client.wait('basicservicetest', 10)
+        self.assertEqual(data.status, clam.common.status.READY)
+        self.assertTrue(time.time() - begintime < 5)
+
+    def test2_5e_batchupload(self):
+        """Basic Service Test - Uploading multiple files at once"""
+        filenames = []
+        for i in range(3):
+            filenames.append('/tmp/servicetest_batch' + str(i) + '.txt')
+            with io.open(filenames[-1],'w',encoding='utf-8') as f:
+                f.write("Dit is bestand nummer " + str(i) + ".")
+        success = self.client.addinputfiles('basicservicetest', 'textinput', filenames, language='nl')
+        self.assertTrue(success)
+        data = self.client.get('basicservicetest')
+        for filename in filenames:
+            inputfile = [ f for f in data.input if f.filename == os.path.basename(filename) ]
+            self.assertEqual(len(inputfile), 1)
+            inputfile[0].loadmetadata()
+            self.assertEqual(inputfile[0].metadata['language'], 'nl')
+        with self.assertRaises(ParameterError):
+            self.client.addinputfiles('basicservicetest', 'textinput', filenames, language='nonexistant')
+
+    def test2_5f_chunkedupload(self):
+        """Basic Service Test - Large file uploaded in chunks"""
+        with io.open('/tmp/servicetest_large.txt','w',encoding='utf-8') as f:
+            for i in range(150000):
+                f.write("Dit is regel " + str(i) + ".\n")
+        client = CLAMClient(self.url, chunkthreshold=1, chunksize=1)
+        success = client.addinputfile('basicservicetest', 'textinput', '/tmp/servicetest_large.txt', language='nl')
+        self.assertTrue(success)
+        r = requests.get(self.url + '/basicservicetest/input/servicetest_large.txt')
+        self.assertEqual(len(r.content), os.path.getsize('/tmp/servicetest_large.txt'))
+
+    def test2_5g_resumableupload(self):
+        """Basic Service Test - Resumable upload protocol"""
+        contents = "On espère que tout ça marche bien.".encode('utf-8')
+        r = requests.post(self.url + '/basicservicetest/uploads/', data={'filename': 'resumable.txt', 'size': len(contents), 'inputtemplate': 'textinput'})
+        self.assertEqual(r.status_code, 201)
+        upload = r.json()
+        self.assertEqual(upload['missing'], [[0, len(contents)]])
+        r = requests.put(self.url + '/basicservicetest/uploads/' + upload['id'], params={'offset': 10}, data=contents[10:])
+        self.assertEqual(r.json()['missing'], [[0, 10]])
+        r = requests.post(self.url + '/basicservicetest/uploads/' + upload['id'], data={'language': 'fr'}) #incomplete
+        self.assertEqual(r.status_code, 403)
+        r = requests.put(self.url + '/basicservicetest/uploads/' + upload['id'], params={'offset': 0}, data=contents[:10])
+        self.assertTrue(r.json()['complete'])
+        r = requests.post(self.url + '/basicservicetest/uploads/' + upload['id'], data={'language': 'nonexistant'}) #rejected, but kept
+        self.assertEqual(r.status_code, 403)
+        r = requests.post(self.url + '/basicservicetest/uploads/' + upload['id'], data={'language': 'fr'})
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(self.client._parseupload(r.text)) #pylint: disable=protected-access
+        r = requests.get(self.url + '/basicservicetest/uploads/' + upload['id'])
+        self.assertEqual(r.status_code, 404)
+        r = requests.get(self.url + '/basicservicetest/input/resumable.txt')
+        self.assertEqual(r.content, contents)
+
+    def test2_5h_urlupload(self):
+        """Basic Service Test - Adding files by URL, fetched in the background"""
+        os.makedirs('/tmp/servicetestwww', exist_ok=True)
+        with io.open('/tmp/servicetestwww/fetched.txt','w',encoding='utf-8') as f:
+            f.write("On espère que tout ça marche bien.")
+        with FileServer('/tmp/servicetestwww') as server:
+            r = requests.post(self.url + '/basicservicetest/input/fetched.txt', data={'url': server.url + 'fetched.txt', 'inputtemplate': 'textinput', 'language': 'fr'})
+            self.assertEqual(r.status_code, 202)
+            fetch = r.json()
+            self.assertEqual(fetch['status'], 'fetching')
+            self.assertTrue(self.client.addinputurl('basicservicetest', 'textinput', server.url + 'fetched.txt', filename='fetched2.txt', language='fr'))
+            with self.assertRaises(clam.common.data.UploadError):
+                self.client.addinputurl('basicservicetest', 'textinput', server.url + 'nonexistant.txt', language='fr')
+            for _ in range(50):
+                fetch = self.client.fetchstate('basicservicetest', fetch['id'])
+                if fetch['status'] != 'fetching':
+                    break
+                time.sleep(0.1)
+        self.assertEqual(fetch['status'], 'done')
+        self.assertEqual(fetch['http_code'], 200)
+        for filename in ('fetched.txt', 'fetched2.txt'):
+            r = requests.get(self.url + '/basicservicetest/input/' + filename)
+            self.assertEqual(r.text, "On espère que tout ça marche bien.")
+
     def test2_6_deletion(self):
         """Basic Service Test - File Deletion"""
         data = self.client.get('basicservicetest')
@@ -216,6 +368,74 @@ class ExtensiveServiceTest(unittest.TestCase):
         self.client.downloadarchive(self.project,'/tmp/target.zip','zip')
         self.assertEqual(zipfile.ZipFile('/tmp/target.zip').testzip(), None) #testing zip file integrity
 
+    def test1c_downloadarchive(self):
+        """Extensive Service Test - Download Archive (tar.bz2, caching)"""
+        data = self.client.get(self.project)
+        success = self.client.addinputfile(self.project, data.inputtemplate('textinput'),'/tmp/servicetest.txt', language='fr')
+        self.assertTrue(success)
+        data = self.client.start(self.project)
+        while data.status != clam.common.status.DONE:
+            time.sleep(1) #wait 1 second before polling status
+            data = self.client.get(self.project) #get status again
+        self.client.downloadarchive(self.project,'/tmp/target.tar.bz2','bz2')
+        with tarfile.open('/tmp/target.tar.bz2','r:bz2') as archive:
+            self.assertEqual(sorted(archive.getnames()), sorted( outputfile.filename for outputfile in data.output ))
+        r = requests.get(self.url + '/' + self.project + '/output/bz2')
+        self.assertTrue(r.headers['ETag'])
+        r = requests.get(self.url + '/' + self.project + '/output/bz2', headers={'If-None-Match': r.headers['ETag']})
+        self.assertEqual(r.status_code, 304)
+
+    def test1d_listing(self):
+        """Extensive Service Test - Paginated file listing"""
+        data = self.client.get(self.project)
+        for i in range(3):
+            self.client.addinput(self.project, data.inputtemplate('textinput'), "On espère que tout ça marche bien.", filename='servicetest' + str(i) + '.txt', language='fr')
+        data = self.client.start(self.project)
+        while data.status != clam.common.status.DONE:
+            time.sleep(1) #wait 1 second before polling status
+            data = self.client.get(self.project) #get status again
+        page = self.client.request(self.project + '/?offset=1&limit=1')
+        self.assertEqual([ x.filename for x in page.input ], ['servicetest1.txt'])
+        self.assertEqual(page.inputpage, {'offset': 1, 'limit': 1, 'total': 3})
+        self.assertEqual(page.outputpage['total'], len(data.output))
+        self.assertEqual([ x.filename for x in data.iteroutput(template='statsbydoc', pagesize=2) ], ['servicetest0.txt.stats','servicetest1.txt.stats','servicetest2.txt.stats'])
+        self.assertEqual([ x.filename for x in data.iterinput(glob='*2.txt') ], ['servicetest2.txt'])
+        self.assertEqual(requests.get(self.url + '/' + self.project + '/output/?list&offset=-1').status_code, 400)
+
+    def test1e_progress(self):
+        """Extensive Service Test - Progress by long polling and server-sent events"""
+        data = self.client.get(self.project)
+        self.client.addinputfile(self.project, data.inputtemplate('textinput'),'/tmp/servicetest.txt', language='fr')
+        progress = self.client.progress(self.project)
+        self.assertEqual(progress['status'], clam.common.status.READY)
+        self.client.start(self.project)
+        messages = []
+        while progress['status'] != clam.common.status.DONE:
+            progress = self.client.progress(self.project, progress['offset'], wait=10)
+            messages += [ entry[0] for entry in progress['log'] ]
+        self.assertEqual(messages[-1], 'Done')
+        self.assertEqual(progress['offset'], len(messages))
+        r = requests.get(self.url + '/' + self.project + '/progress/', headers={'Accept': 'text/event-stream', 'Last-Event-ID': str(len(messages) - 1)})
+        self.assertTrue(r.headers['Content-Type'].startswith('text/event-stream'))
+        self.assertEqual(r.text.count('event: log'), 1)
+        self.assertTrue(r.text.startswith('retry: '))
+        self.assertTrue('"status": 2' in r.text)
+
+    def test1f_callback(self):
+        """Extensive Service Test - Completion callback"""
+        data = self.client.get(self.project)
+        self.client.addinputfile(self.project, data.inputtemplate('textinput'),'/tmp/servicetest.txt', language='fr')
+        r = requests.post(self.url + '/' + self.project + '/', data={'callback': 'http://example.org/'})
+        self.assertEqual(r.status_code, 403)
+        with CallbackReceiver() as receiver:
+            self.client.start(self.project, callback=receiver.url)
+            data = receiver.wait(60)
+        self.assertTrue(data)
+        self.assertEqual(data['project'], self.project)
+        self.assertEqual(data['status'], clam.common.status.DONE)
+        self.assertEqual(data['exitcode'], 0)
+        self.assertTrue('servicetest.txt.freqlist' in [ outputfile['name'] for outputfile in data['outputfiles'] ])
+
     def test2_parametererror(self):
         """Extensive Service Test - Global parameter error"""
         data = self.client.get(self.project)
@@ -327,6 +547,16 @@ class ArchiveUploadTest(unittest.TestCase):
         self.assertTrue('servicetest2.txt' in [ x.filename for x in data.input ])
         self.assertTrue('servicetest3.txt' in [ x.filename for x in data.input ])
 
+    def test3_manyfiles(self):
+        """Archive Upload Test - ZIP file with many files"""
+        with zipfile.ZipFile('/tmp/servicetest_many.zip','w') as archive:
+            for i in range(50):
+                archive.writestr('corpus/doc' + str(i) + '.txt', "Dit is document " + str(i) + ".")
+        success = self.client.addinputfile(self.project, 'textinput', '/tmp/servicetest_many.zip', language='nl')
+        self.assertTrue(success)
+        data = self.client.get(self.project)
+        self.assertEqual(sorted( x.filename for x in data.input ), sorted( 'doc' + str(i) + '.txt' for i in range(50) ))
+
     def tearDown(self):
         self.client.delete(self.project)
 
@@ -78,6 +78,18 @@ if [ $? -ne 0 ]; then
    echo "</-------------------- servicetest.server.log --------------------------------->" >&2
 fi
 
+python -c "import aiohttp" 2>/dev/null
+if [ $? -eq 0 ]; then
+    echo "Running asynchronous client tests:" >&2
+    python asyncservicetest.py
+    if [ $? -ne 0 ]; then
+        echo "ERROR: Asynchronous client test failed!!" >&2
+        GOOD=0
+    fi
+else
+    echo "Skipping asynchronous client tests (aiohttp not installed)" >&2
+fi
+
 echo "Stopping clam service" >&2
 kill $(ps aux | grep 'clamservice' | awk '{print $2}') 2>/dev/null
 